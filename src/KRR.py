@@ -1,4 +1,6 @@
 import numpy as np
+import hashlib
+import time
 
 """
 X is the input data of type np.array of dimensions (nbr of years, nbr of activities + 1), where the data for one year , i.e. 1 input,
@@ -41,6 +43,78 @@ def rbf_kernel(xi, xj, sigma):
     return np.exp( - ( 1. / (2. * sigma**2)) * ((xi - xj)**2).sum())
 
 
+def linear_kernel_matrix(A, B):
+    """
+    Computes the linear kernel between every row of A and every row of B in one matrix product
+    :param A: np.array (n, nbr of activities + 1) : First inputs
+    :param B: np.array (m, nbr of activities + 1) : Second inputs
+    :return: np.array (n, m)
+    """
+    return A @ B.T
+
+
+def polynomial_kernel_matrix(A, B, d=2):
+    """
+    Computes the polynomial kernel between every row of A and every row of B in one matrix product
+    :param A: np.array (n, nbr of activities + 1) : First inputs
+    :param B: np.array (m, nbr of activities + 1) : Second inputs
+    :param d: the degree of the polynomial, by default 2
+    :return: np.array (n, m)
+    """
+    return (A @ B.T + 1)**d
+
+
+def rbf_kernel_matrix(A, B, sigma):
+    """
+    Computes the RBF (Gaussian) kernel between every row of A and every row of B,
+    using the expansion ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+    :param A: np.array (n, nbr of activities + 1) : First inputs
+    :param B: np.array (m, nbr of activities + 1) : Second inputs
+    :param sigma: the sigma parameter, smaller implies sharper function
+    :return: np.array (n, m)
+    """
+    sq_dist = (A**2).sum(axis=1)[:, None] + (B**2).sum(axis=1)[None, :] - 2. * (A @ B.T)
+    # The expansion can give tiny negative values by cancellation
+    np.maximum(sq_dist, 0., out=sq_dist)
+    return np.exp( - ( 1. / (2. * sigma**2)) * sq_dist)
+
+
+# Batched version of each pairwise kernel, used to build whole kernel matrices at once
+BATCHED_KERNELS = {
+    linear_kernel: linear_kernel_matrix,
+    polynomial_kernel: polynomial_kernel_matrix,
+    rbf_kernel: rbf_kernel_matrix,
+}
+
+
+# Kernels by name, to store the kernel of a fitted model
+KERNELS = {kernel_function.__name__: kernel_function for kernel_function in BATCHED_KERNELS}
+
+
+def cross_kernel(A, B, kernel_function, *kernel_args):
+    """
+    Computes the kernel matrix between two sets of inputs, i.e. C[i,j] corresponds to kernel_function(ai, bj).
+    The batched version of the kernel is used if there is one, otherwise the kernel function is called for each pair
+    :param A: np.array (n, nbr of activities + 1) : First inputs
+    :param B: np.array (m, nbr of activities + 1) : Second inputs
+    :param kernel_function: the kernel function
+    :param kernel_args: the arguments for the kernel function if needed
+    :return: np.array (n, m)
+    """
+    A = np.atleast_2d(A)
+    B = np.atleast_2d(B)
+
+    batched = BATCHED_KERNELS.get(kernel_function)
+    if batched is not None:
+        return batched(A, B, *kernel_args)
+
+    C = np.empty((A.shape[0], B.shape[0]))
+    for i in range(A.shape[0]):
+        for j in range(B.shape[0]):
+            C[i, j] = kernel_function(A[i], B[j], *kernel_args)
+    return C
+
+
 def matrix_kernel(X, kernel_function, *kernel_args):
     """
     Computes the kernel matrix K, where K[i,j] corresponds to kernel_function(xi, xj)
@@ -49,12 +123,14 @@ def matrix_kernel(X, kernel_function, *kernel_args):
     :param kernel_args: the arguments for the kernel function if needed
     :return:
     """
-    nbr_years, nbr_activ = X.shape
+    batched = BATCHED_KERNELS.get(kernel_function)
+    if batched is not None:
+        K = batched(X, X, *kernel_args)
+        # Remove the rounding asymmetry of the matrix product, the kernel matrix must be symmetric
+        return 0.5 * (K + K.T)
 
-    K = np.zeros((nbr_years, nbr_years))
-    for i in range(nbr_years):
-        for j in range(nbr_years):
-            K[i,j] = kernel_function(X[i], X[j], *kernel_args)
+    # Custom kernel : evaluated for each pair
+    K = cross_kernel(X, X, kernel_function, *kernel_args)
     #The kernel matrix must be symmetric
     assert np.allclose(K, K.T)
 
@@ -69,7 +145,9 @@ def prediction_matrix(Y, K, lambd=0):
     :param lambd: the regularizer influence, default to 0, i.e. no regularization
     :return:
     """
-    return Y.T @ np.linalg.inv(K + lambd * np.eye(Y.shape[0]))
+    # Solve with the Cholesky factor instead of forming the inverse explicitly
+    L = regularized_cholesky(K, lambd)[0]
+    return _back_substitution(L.T, _forward_substitution(L, Y)).T
 
 
 def prediction_vector(X, x, kernel_function, *kernel_args):
@@ -81,12 +159,7 @@ def prediction_vector(X, x, kernel_function, *kernel_args):
     :param kernel_args: the arguments for the kernel function if needed
     :return: np.array (nbr of years, 1)
     """
-    nbr_years = X.shape[0]
-
-    kXx = np.zeros((nbr_years, 1))
-    for i in range(nbr_years):
-        kXx[i, 0] = kernel_function(X[i], x, *kernel_args)
-    return kXx
+    return cross_kernel(X, np.reshape(x, (1, -1)), kernel_function, *kernel_args)
 
 
 def predict_KRR(X, x, Y, lambd, kernel_function, *kernel_args, pred_matrix=None):
@@ -104,4 +177,372 @@ def predict_KRR(X, x, Y, lambd, kernel_function, *kernel_args, pred_matrix=None)
     if pred_matrix is None:
         K = matrix_kernel(X, kernel_function, *kernel_args)
         pred_matrix = prediction_matrix(Y, K, lambd)
-    return pred_matrix @ prediction_vector(X, x, kernel_function,*kernel_args)
\ No newline at end of file
+    return pred_matrix @ prediction_vector(X, x, kernel_function,*kernel_args)
+
+
+def predict_KRR_batch(X, X_candidates, Y, lambd, kernel_function, *kernel_args, pred_matrix=None):
+    """
+    Computes the predictions for many samples at once by using the kernel ridge regression with multiple outputs.
+    The kernel between the training data and all the candidates is computed in one matrix operation
+    :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+    :param X_candidates: np.array (nbr of candidates, nbr of activities + 1) : the input samples, one per row
+    :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+    :param lambd: the regularizer influence
+    :param kernel_function: the kernel function
+    :param kernel_args: the arguments for the kernel function if needed
+    :param pred_matrix: the prediction matrix, if None (default) it is computed
+    :return: np.array (nbr of activities, nbr of candidates) : the jth column is the prediction for the jth candidate
+    """
+    if pred_matrix is None:
+        K = matrix_kernel(X, kernel_function, *kernel_args)
+        pred_matrix = prediction_matrix(Y, K, lambd)
+    return pred_matrix @ cross_kernel(X, X_candidates, kernel_function, *kernel_args)
+
+
+
+# Number of rows solved together in the triangular solves
+SUBSTITUTION_BLOCK = 64
+
+
+def _forward_substitution(L, B):
+    """
+    Solves L Z = B for a lower triangular matrix L, in O(n^2) per column of B. The rows are solved by blocks :
+    the rows already solved are eliminated from a block with one matrix product, and only the small diagonal
+    block is solved directly
+    :param L: np.array (n, n) : lower triangular matrix
+    :param B: np.array (n, m) : right hand side
+    :return: np.array (n, m)
+    """
+    n = L.shape[0]
+    Z = np.empty(B.shape)
+    for start in range(0, n, SUBSTITUTION_BLOCK):
+        end = min(start + SUBSTITUTION_BLOCK, n)
+        Z[start:end] = np.linalg.solve(L[start:end, start:end], B[start:end] - L[start:end, :start] @ Z[:start])
+    return Z
+
+
+def _back_substitution(U, B):
+    """
+    Solves U Z = B for an upper triangular matrix U, in O(n^2) per column of B, by blocks of rows from the last one
+    (see _forward_substitution)
+    :param U: np.array (n, n) : upper triangular matrix
+    :param B: np.array (n, m) : right hand side
+    :return: np.array (n, m)
+    """
+    n = U.shape[0]
+    Z = np.empty(B.shape)
+    for end in range(n, 0, -SUBSTITUTION_BLOCK):
+        start = max(end - SUBSTITUTION_BLOCK, 0)
+        Z[start:end] = np.linalg.solve(U[start:end, start:end], B[start:end] - U[start:end, end:] @ Z[end:])
+    return Z
+
+
+def regularized_cholesky(K, lambd=0, max_tries=10):
+    """
+    Computes the Cholesky factor L of K + lambda * Id. If the matrix is singular (e.g. lambda = 0 and
+    collinear points history), a growing jitter is added to the diagonal until the factorization succeeds
+    :param K: np.array (nbr of years, nbr of years) : the kernel matrix
+    :param lambd: the regularizer influence, default to 0, i.e. no regularization
+    :param max_tries: the number of times the jitter is increased before giving up
+    :return: np.array (nbr of years, nbr of years), float : the lower triangular factor and the jitter that was added
+    """
+    n = K.shape[0]
+    A = K + lambd * np.eye(n)
+    jitter = 0.
+    scale = max(np.abs(np.diag(A)).mean(), 1.) if n > 0 else 1.
+    for i in range(max_tries + 1):
+        try:
+            return np.linalg.cholesky(A + jitter * np.eye(n)), jitter
+        except np.linalg.LinAlgError:
+            jitter = scale * 1e-12 * 10**i
+    raise np.linalg.LinAlgError('The regularized kernel matrix is not positive definite')
+
+
+def _hash_arrays(h, *arrays):
+    """
+    Adds arrays (shape and content, as float) to a hash
+    :param h: the hashlib object
+    :param arrays: the arrays
+    :return: Nothing
+    """
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr, dtype=float)
+        h.update(np.asarray(arr.shape, dtype=np.int64).tobytes())
+        h.update(arr.tobytes())
+
+
+def data_fingerprint(X, Y):
+    """
+    Hash of the training data only, to find the model fitted on some data whatever its kernel configuration
+    :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+    :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+    :return: str : the hexadecimal digest
+    """
+    h = hashlib.sha256()
+    _hash_arrays(h, X, Y)
+    return h.hexdigest()
+
+
+class KRRModel:
+    """
+    Kernel ridge regression with multiple outputs, fitted once and then used for as many predictions as needed.
+    It keeps the training inputs, the kernel and its parameters, and the Cholesky factor of K + lambda * Id,
+    so the prediction never needs an explicit inverse.
+    """
+
+    def __init__(self, kernel_function=linear_kernel, *kernel_args, lambd=0):
+        """
+        :param kernel_function: the kernel function, by default the linear kernel
+        :param kernel_args: the arguments for the kernel function if needed
+        :param lambd: the regularizer influence, default to 0, i.e. no regularization
+        """
+        self.kernel_function = kernel_function
+        self.kernel_args = kernel_args
+        self.lambd = lambd
+
+        self.X = None
+        self.Y = None
+        self.L = None
+        self.jitter = 0.
+        self.alpha = None
+
+    def fingerprint(self, X=None, Y=None):
+        """
+        Hash of the training data and of the kernel configuration, used as key of the persisted models
+        :param X: np.array (nbr of years, nbr of activities + 1) : the input data, by default the fitted one
+        :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs, by default the fitted ones
+        :return: str : the hexadecimal digest
+        """
+        X = self.X if X is None else X
+        Y = self.Y if Y is None else Y
+
+        h = hashlib.sha256()
+        h.update(self.kernel_function.__name__.encode())
+        h.update(np.asarray(self.kernel_args, dtype=float).tobytes())
+        h.update(np.float64(self.lambd).tobytes())
+        _hash_arrays(h, X, Y)
+        return h.hexdigest()
+
+    def fit(self, X, Y):
+        """
+        Fits the model on the training data
+        :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+        :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+        :return: the model itself
+        """
+        self.X = np.asarray(X, dtype=float)
+        self.Y = np.asarray(Y, dtype=float)
+
+        K = matrix_kernel(self.X, self.kernel_function, *self.kernel_args)
+        self.L, self.jitter = regularized_cholesky(K, self.lambd)
+        self._solve_alpha()
+
+        return self
+
+    def add_sample(self, x, y):
+        """
+        Adds one training sample (i.e. a new year) to the fitted model. Only a row and a column are added to
+        the kernel matrix, so the Cholesky factor is extended by bordering in O(n^2) instead of being recomputed
+        :param x: np.array (nbr of activities + 1, ) : the new input
+        :param y: np.array (nbr of activities, ) : the new ground truth output
+        :return: the model itself
+        """
+        x = np.reshape(np.asarray(x, dtype=float), (1, -1))
+        y = np.reshape(np.asarray(y, dtype=float), (1, -1))
+
+        if self.L is None:
+            return self.fit(x, y)
+
+        # New row of the regularized kernel matrix
+        k = cross_kernel(self.X, x, self.kernel_function, *self.kernel_args)
+        kappa = cross_kernel(x, x, self.kernel_function, *self.kernel_args)[0, 0] + self.lambd + self.jitter
+
+        l = _forward_substitution(self.L, k)[:, 0]
+        d2 = kappa - l @ l
+
+        self.X = np.append(self.X, x, axis=0)
+        self.Y = np.append(self.Y, y, axis=0)
+
+        if d2 <= 0:
+            # The new year makes the matrix numerically singular, fall back to a full fit with a new jitter
+            return self.fit(self.X, self.Y)
+
+        n = self.L.shape[0]
+        L = np.zeros((n + 1, n + 1))
+        L[:n, :n] = self.L
+        L[n, :n] = l
+        L[n, n] = np.sqrt(d2)
+        self.L = L
+        self._solve_alpha()
+
+        return self
+
+    def _solve_alpha(self):
+        """
+        Computes alpha = (K + lambda * Id)^(-1) Y with the two triangular solves of the Cholesky factor
+        :return: Nothing
+        """
+        self.alpha = _back_substitution(self.L.T, _forward_substitution(self.L, self.Y))
+
+    @property
+    def pred_matrix(self):
+        """
+        The matrix Y^T (K + lambda * Id)^(-1), as returned by prediction_matrix
+        :return: np.array (nbr of activities, nbr of years)
+        """
+        return self.alpha.T
+
+    def predict(self, x):
+        """
+        Computes the prediction for the sample x
+        :param x: np.array (nbr of activities + 1, ) : the input sample
+        :return: np.array (nbr of activities, 1)
+        """
+        return self.predict_batch(np.reshape(x, (1, -1)))
+
+    def predict_batch(self, X_candidates):
+        """
+        Computes the predictions for many samples at once
+        :param X_candidates: np.array (nbr of candidates, nbr of activities + 1) : the input samples, one per row
+        :return: np.array (nbr of activities, nbr of candidates) : the jth column is the prediction for the jth candidate
+        """
+        if self.alpha is None:
+            raise ValueError('The model must be fitted before predicting')
+        return self.alpha.T @ cross_kernel(self.X, X_candidates, self.kernel_function, *self.kernel_args)
+
+
+class ApproxKRRModel:
+    """
+    Approximate kernel ridge regression for large (pooled) training sets. The kernel is replaced by an explicit
+    feature map of rank m, K ~ Phi Phi^T, and the ridge regression is solved in the feature space, so the memory
+    is O(n m) and the fit O(n m^2) instead of O(n^2) and O(n^3) :
+        - 'rff' : random Fourier features, only for the RBF kernel
+        - 'nystrom' : Nystrom approximation with m landmarks taken among the training inputs, for any kernel
+    """
+
+    def __init__(self, kernel_function=rbf_kernel, *kernel_args, lambd=0, rank=100, method='nystrom', seed=None):
+        """
+        :param kernel_function: the kernel function, by default the RBF kernel
+        :param kernel_args: the arguments for the kernel function if needed
+        :param lambd: the regularizer influence, default to 0, i.e. no regularization
+        :param rank: the number of random features or landmarks
+        :param method: 'rff' or 'nystrom'
+        :param seed: the seed of the random generator, for reproducible features
+        """
+        if method not in ('rff', 'nystrom'):
+            raise ValueError('Unknown approximation method : ' + str(method))
+        if method == 'rff' and kernel_function is not rbf_kernel:
+            raise ValueError('Random Fourier features are only available for the RBF kernel')
+
+        self.kernel_function = kernel_function
+        self.kernel_args = kernel_args
+        self.lambd = lambd
+        self.rank = rank
+        self.method = method
+        self.rng = np.random.default_rng(seed)
+
+        # Random Fourier features : frequencies and phases
+        self.W = None
+        self.b = None
+        # Nystrom : landmarks and K_mm^(-1/2)
+        self.landmarks = None
+        self.normalization = None
+
+        self.weights = None
+
+    def features(self, X):
+        """
+        Computes the feature map Phi(X), such that Phi(X) Phi(X')^T approximates the kernel matrix
+        :param X: np.array (n, nbr of activities + 1) : the inputs
+        :return: np.array (n, rank)
+        """
+        X = np.atleast_2d(X)
+        if self.method == 'rff':
+            return np.sqrt(2. / self.W.shape[1]) * np.cos(X @ self.W + self.b)
+        return cross_kernel(X, self.landmarks, self.kernel_function, *self.kernel_args) @ self.normalization
+
+    def fit(self, X, Y):
+        """
+        Fits the model on the training data
+        :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+        :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+        :return: the model itself
+        """
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        n, dim = X.shape
+
+        if self.method == 'rff':
+            sigma = self.kernel_args[0]
+            self.W = self.rng.normal(scale=1. / sigma, size=(dim, self.rank))
+            self.b = self.rng.uniform(0., 2. * np.pi, size=self.rank)
+        else:
+            self.landmarks = X[self.rng.choice(n, size=min(self.rank, n), replace=False)]
+            K_mm = matrix_kernel(self.landmarks, self.kernel_function, *self.kernel_args)
+
+            # K_mm^(-1/2), ignoring the directions with a numerically null eigenvalue
+            w, V = np.linalg.eigh(K_mm)
+            keep = w > w.max() * 1e-10
+            self.normalization = V[:, keep] / np.sqrt(w[keep])
+
+        # Ridge regression in the feature space : (Phi^T Phi + lambda * Id) weights = Phi^T Y
+        Phi = self.features(X)
+        L = regularized_cholesky(Phi.T @ Phi, self.lambd)[0]
+        self.weights = _back_substitution(L.T, _forward_substitution(L, Phi.T @ Y))
+
+        return self
+
+    def predict(self, x):
+        """
+        Computes the prediction for the sample x
+        :param x: np.array (nbr of activities + 1, ) : the input sample
+        :return: np.array (nbr of activities, 1)
+        """
+        return self.predict_batch(np.reshape(x, (1, -1)))
+
+    def predict_batch(self, X_candidates):
+        """
+        Computes the predictions for many samples at once
+        :param X_candidates: np.array (nbr of candidates, nbr of activities + 1) : the input samples, one per row
+        :return: np.array (nbr of activities, nbr of candidates) : the jth column is the prediction for the jth candidate
+        """
+        if self.weights is None:
+            raise ValueError('The model must be fitted before predicting')
+        return (self.features(X_candidates) @ self.weights).T
+
+
+def approximation_report(X, Y, kernel_function, *kernel_args, lambd=0, ranks=(10, 20, 50, 100, 200),
+                         method='nystrom', X_test=None, seed=None):
+    """
+    Compares the approximate models of increasing rank with the exact solver
+    :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+    :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+    :param kernel_function: the kernel function
+    :param kernel_args: the arguments for the kernel function if needed
+    :param lambd: the regularizer influence
+    :param ranks: the ranks of the approximations to evaluate
+    :param method: 'rff' or 'nystrom'
+    :param X_test: np.array (n, nbr of activities + 1) : the inputs on which the predictions are compared,
+    by default the training inputs
+    :param seed: the seed of the random generator
+    :return: list of dict with the keys 'rank', 'relative_error' (relative Frobenius distance between the approximate
+    and exact predictions), 'fit_time' (in seconds), and the exact fit time as first entry with rank None
+    """
+    if X_test is None:
+        X_test = X
+
+    start = time.perf_counter()
+    exact = KRRModel(kernel_function, *kernel_args, lambd=lambd).fit(X, Y)
+    report = [{'rank': None, 'relative_error': 0., 'fit_time': time.perf_counter() - start}]
+    exact_predictions = exact.predict_batch(X_test)
+
+    for rank in ranks:
+        start = time.perf_counter()
+        model = ApproxKRRModel(kernel_function, *kernel_args, lambd=lambd, rank=rank, method=method,
+                               seed=seed).fit(X, Y)
+        fit_time = time.perf_counter() - start
+
+        error = np.linalg.norm(model.predict_batch(X_test) - exact_predictions) / np.linalg.norm(exact_predictions)
+        report.append({'rank': rank, 'relative_error': float(error), 'fit_time': fit_time})
+
+    return report
@@ -8,7 +8,12 @@ import numpy as np
 # Personal modules
 import points_system.file_manager as fm
 import points_system.statistics as stat
-from points_system.KRR import linear_kernel
+import points_system.web_report as web_report
+from points_system.summary import compute_summary
+from points_system.trends import compute_trends, alerts, format_alerts
+from points_system.KRR import linear_kernel, KRRModel
+from points_system.optimizer import optimize_allocation
+from points_system.model_selection import select_hyperparameters
 
 
 class Home(ttk.Frame):
@@ -30,7 +35,8 @@ class Home(ttk.Frame):
         
         Remarques :
             - Vous trouverez un \"mode d'emploi\" détaillé sous ...
-            - Veillez à bien entrer les fichiers de données dans l'ordre croissant des années !
+            - Plusieurs années peuvent être importées d'un coup depuis un dossier, avec un fichier .csv
+            (nom du fichier, année, nombre de personnes) sous l'onglet \"Données\".
             - Bien utiliser le format de fichier excel convenu et non un autre !
         """
         explications = tk.Label(self, text=expl, justify='left')
@@ -43,6 +49,7 @@ class Home(ttk.Frame):
         exit_but.grid(row=3, column=4, padx=15, pady=15)
 
     def exit_manager(self):
+        fm.close_all_db()
         self.root.destroy()
 
 
@@ -66,47 +73,78 @@ class Statistics(ttk.Frame):
         save_stat = tk.Button(self, text='Enregistrer', command=self.comp_save_stat)
         save_stat.grid(row=2, column=1, padx=15, pady=15)
 
-    def comp_save_stat(self):
-        # Open dialog box to get location where to save the file
-        self.filename = filedialog.askdirectory(title='Enregistrer le fichier sous')
+        # Button to save the stats as a web page
+        save_html = tk.Button(self, text='Enregistrer (web)', command=self.comp_save_html)
+        save_html.grid(row=3, column=1, padx=15, pady=15)
 
+        # Button to show the activities whose presence dropped sharply
+        alerts_but = tk.Button(self, text='Alertes', command=self.show_alerts)
+        alerts_but.grid(row=4, column=1, padx=15, pady=15)
+
+    def load_stat_data(self):
         # Retrieve the data
         last_year, data_full, society_size, last_points = fm.get_last_cumulative(db_path)
         last_year2, mdt_list, last_names = fm.get_last_mandatory_and_names_from_db(db_path)
 
         # Reput cumulative data in term of persons
         society_size = np.array(society_size).reshape((data_full.shape[0], -1))
-        print(society_size)
-        print(data_full)
         data_full = data_full * society_size
-        print(data_full)
+
+        summary = compute_summary(data_full, mdt_list, society_size[:, 0])
+        trends = compute_trends(data_full, society_size[:, 0],
+                                np.arange(last_year - data_full.shape[0] + 1, last_year + 1))
+        return last_year, data_full, mdt_list, last_names, society_size, summary, trends
+
+    def comp_save_stat(self):
+        # Open dialog box to get location where to save the file
+        self.filename = filedialog.askdirectory(title='Enregistrer le fichier sous')
+
+        last_year, data_full, mdt_list, last_names, society_size, summary, trends = self.load_stat_data()
 
         # Compute the stats and save the pdf at the specified location
-        path_pdf = stat.create_pdf(data_full, mdt_list, last_year, last_names, society_size[-1,0], self.filename)
+        path_pdf = stat.create_pdf(data_full, mdt_list, last_year, last_names, society_size[-1,0], self.filename, summary,
+                                   trends=trends, cache_dir=os.path.join(os.path.dirname(db_path), 'report_cache'))
 
         # Display success
         messagebox.showinfo('Statistiques - ' + str(last_year),
                             'Calcul terminé, le fichier se trouve sous ' + path_pdf)
 
+    def comp_save_html(self):
+        # Open dialog box to get location where to save the files
+        self.filename = filedialog.askdirectory(title='Enregistrer les fichiers sous')
+
+        last_year, data_full, mdt_list, last_names, society_size, summary, trends = self.load_stat_data()
+
+        # Save the html page and the json data at the specified location
+        path_html, path_json = web_report.create_html(data_full, mdt_list, last_year, last_names, society_size[-1, 0],
+                                                      self.filename, summary)
+
+        # Display success
+        messagebox.showinfo('Statistiques - ' + str(last_year),
+                            'Calcul terminé, les fichiers se trouvent sous ' + path_html + '\net ' + path_json)
+
+    def show_alerts(self):
+        last_year, data_full, mdt_list, last_names, society_size, summary, trends = self.load_stat_data()
+
+        # Activities whose presence the last year is far under the previous years
+        messagebox.showinfo('Alertes - ' + str(last_year), format_alerts(alerts(trends, last_names)))
+
 
 class Predictions(ttk.Frame):
     def __init__(self, parent, *args, **kwargs):
         ttk.Frame.__init__(self, parent)
 
-        # The "prediction matrix", at beginning empty to avoid computing it multiple times
-        self.pred_matrix = None
+        # The fitted model, at beginning empty to avoid fitting it multiple times
+        self.model = None
         self.nbr_activ = 0
 
         # If there is no db yet, it will crash, so I put an if and the user must first create the db and
         # restart for the first time
         if os.path.exists(db_path):
-            # Retrieve the cumulative data
-            last_year, self.data_full_cumul, self.society_size, self.last_points = fm.get_last_cumulative(db_path)
-
-            # Retrieve the mandatory list and names from the db
-            last_year, mdt, self.name_list = fm.get_last_mandatory_and_names_from_db(db_path)
+            self.load_training_data()
 
-            self.nbr_activ = self.data_full_cumul.shape[1] // 3
+            # Keep the model up to date each time a year is written in the db
+            fm.register_write_listener(self.on_record_written)
 
         # The "titles" of the columns
         names = tk.Label(self, text='Activités :', justify='left')
@@ -121,12 +159,20 @@ class Predictions(ttk.Frame):
         prediction = tk.Label(self, text='Pourcentage de présence estimé,\nnbr. de personnes (par rapport au nombre actuel de personnes)')
         prediction.grid(row=0, column=3, padx=15, pady=15, sticky='W')
 
+        minimum = tk.Label(self, text='Min. :', justify='left')
+        minimum.grid(row=0, column=4, padx=15, pady=15, sticky='W')
+
+        maximum = tk.Label(self, text='Max. :', justify='left')
+        maximum.grid(row=0, column=5, padx=15, pady=15, sticky='W')
+
         # The list for the labels corresponding to activities
         self.activities_labels = [None] * self.nbr_activ
         self.activities_entries = [None] * self.nbr_activ
         self.activities_mdt = [None] * self.nbr_activ
         # self.activities_var_check = np.empty(self.nbr_activ, dtype=int)
         self.activities_predict = [None] * self.nbr_activ
+        self.activities_min = [None] * self.nbr_activ
+        self.activities_max = [None] * self.nbr_activ
 
         for i in range(self.nbr_activ):
             self.activities_labels[i] = tk.Label(self, text=self.name_list[i], justify='left')
@@ -143,10 +189,67 @@ class Predictions(ttk.Frame):
             self.activities_predict[i] = tk.Label(self, text='')
             self.activities_predict[i].grid(row=i + 1, column=3, padx=15, pady=15)
 
+            # Bounds of the points for the optimization, empty for no bound
+            self.activities_min[i] = tk.Entry(self, width=8)
+            self.activities_min[i].grid(row=i + 1, column=4, padx=15, pady=15)
+
+            self.activities_max[i] = tk.Entry(self, width=8)
+            self.activities_max[i].grid(row=i + 1, column=5, padx=15, pady=15)
+
         # Button to compute the predictions
         pred_but = tk.Button(self, text='Calculer', command=self.compute_predictions)
         pred_but.grid(row=self.nbr_activ + 1, column=4, padx=15, pady=15)
 
+        # Total of points and target presence of the mandatory activities for the optimization
+        budget = tk.Label(self, text='Total des points à répartir :', justify='left')
+        budget.grid(row=self.nbr_activ + 2, column=0, padx=15, pady=15, sticky='W')
+        self.budget_entry = tk.Entry(self, width=15)
+        self.budget_entry.grid(row=self.nbr_activ + 2, column=1, padx=15, pady=15)
+
+        target = tk.Label(self, text='Présence minimale visée aux activités obligatoires (%) :', justify='left')
+        target.grid(row=self.nbr_activ + 3, column=0, padx=15, pady=15, sticky='W')
+        self.target_entry = tk.Entry(self, width=15)
+        self.target_entry.grid(row=self.nbr_activ + 3, column=1, padx=15, pady=15)
+
+        # Button to find the best allocation of the points
+        optim_but = tk.Button(self, text='Optimiser', command=self.optimize_points)
+        optim_but.grid(row=self.nbr_activ + 3, column=4, padx=15, pady=15)
+
+    def load_training_data(self):
+        # Retrieve the cumulative data
+        self.last_year, self.data_full_cumul, self.society_size, self.last_points = fm.get_last_cumulative(db_path)
+
+        # Retrieve the mandatory list and names from the db
+        last_year, self.mdt, self.name_list = fm.get_last_mandatory_and_names_from_db(db_path)
+
+        self.nbr_activ = self.data_full_cumul.shape[1] // 3
+
+    def on_record_written(self, path, year, record, points, society_size, is_new):
+        # The tab was built without data (first use), it is only filled after a restart
+        if path != db_path or self.nbr_activ == 0:
+            return
+
+        # The activities of the year written (the widgets of this tab are built for the current activities)
+        last_year, mdt, names = fm.get_last_mandatory_and_names_from_db(db_path)
+        if not np.array_equal(names, self.name_list):
+            # The activities changed, the tab is only updated after a restart
+            return
+
+        if is_new and year == self.last_year + 1:
+            # New year following the last one : append it and update the fitted model in place
+            self.last_year = year
+            self.data_full_cumul = np.append(self.data_full_cumul, record / society_size, axis=0)
+            self.last_points = np.append(self.last_points, np.reshape(points, (1, -1)), axis=0)
+            self.society_size.append((society_size,))
+
+            if self.model is not None:
+                self.model.add_sample(np.append(points, 1), record[0, :self.nbr_activ] / society_size)
+                fm.save_model(self.model, db_path)
+        else:
+            # An older year was modified, reload the data and fit again on next use
+            self.load_training_data()
+            self.model = None
+
     def compute_predictions(self):
         # Get the data from input gui
         input_points = np.empty(self.nbr_activ, dtype=int)
@@ -166,22 +269,40 @@ class Predictions(ttk.Frame):
         # Expand the input with the bias term and put it into percentages
         x = np.append(input_points, np.ones((1, 1)))
 
-        # Construct matrix of input training data and expand the training data with the bias term
-        nbr_years = self.last_points.shape[0]
-        X = np.concatenate((self.last_points, np.ones((nbr_years, 1))), axis=1)
-
-        # Rename ground truth training data
-        Y = self.data_full_cumul[:, :self.nbr_activ]
-
-        # Check if the prediction matrix was already computed, if not compute it
-        if self.pred_matrix is None:
-            K = KRR.matrix_kernel(X, linear_kernel)
-            lambd = 0
-            self.pred_matrix = KRR.prediction_matrix(Y, K, lambd)
-
         # Compute the predictions
-        predictions = KRR.predict_KRR(X, x, Y, lambd=0, kernel_function=linear_kernel, pred_matrix=self.pred_matrix)
-
+        predictions = self.get_model().predict(x)
+
+        self.display_predictions(predictions)
+
+    def get_model(self):
+        # Check if the model was already fitted, if not fit it
+        if self.model is None:
+            # Only the years where all the current activities existed
+            complete = ~(np.isnan(self.last_points).any(axis=1) | np.isnan(self.data_full_cumul).any(axis=1))
+
+            # Construct matrix of input training data and expand the training data with the bias term
+            nbr_years = np.count_nonzero(complete)
+            X = np.concatenate((self.last_points[complete], np.ones((nbr_years, 1))), axis=1)
+
+            # Rename ground truth training data
+            Y = self.data_full_cumul[complete, :self.nbr_activ]
+
+            # Reuse the model fitted in a previous session if the data did not change, with the kernel selected then
+            self.model = fm.load_fitted_model(X, Y, db_path)
+            if self.model is None:
+                # Kernel and regularizer with the smallest leave-one-out error,
+                # the linear kernel without regularization if there are too few years to leave one out
+                if nbr_years > 2:
+                    best = select_hyperparameters(X, Y)
+                    kernel_function, kernel_args, lambd = best['kernel_function'], best['kernel_args'], best['lambd']
+                else:
+                    kernel_function, kernel_args, lambd = linear_kernel, (), 0
+
+                self.model = KRRModel(kernel_function, *kernel_args, lambd=lambd).fit(X, Y)
+                fm.save_model(self.model, db_path)
+        return self.model
+
+    def display_predictions(self, predictions):
         # Display the results, note that we display 0 % if the prediction is negative, as it is non sense to have negative presence
         for i in range(self.nbr_activ):
             presence = predictions[i,0]
@@ -189,6 +310,40 @@ class Predictions(ttk.Frame):
                 presence = 0
             self.activities_predict[i]['text'] = "{:.2f} %, {:d} personnes".format(presence, int(presence * self.society_size[-1][0]))
 
+    def optimize_points(self):
+        if self.budget_entry.get() == '':
+            messagebox.showerror('Erreur', 'Vous devez d\'abord spécifier le total des points à répartir !')
+            return
+        budget = int(self.budget_entry.get())
+
+        target = 0.
+        if self.target_entry.get() != '':
+            target = float(self.target_entry.get()) / 100.
+
+        # Get the bounds from input gui, no bound if the field is empty
+        lower = np.zeros(self.nbr_activ)
+        upper = np.full(self.nbr_activ, float(budget))
+        for i in range(self.nbr_activ):
+            if self.activities_min[i].get() != '':
+                lower[i] = int(self.activities_min[i].get())
+            if self.activities_max[i].get() != '':
+                upper[i] = int(self.activities_max[i].get())
+
+        try:
+            points, predictions, reached = optimize_allocation(self.get_model(), budget, lower, upper, self.mdt, target)
+        except ValueError:
+            messagebox.showerror('Erreur', 'Le total des points n\'est pas atteignable avec les minimums et maximums donnés !')
+            return
+
+        # Put the optimal points in the entries and display the corresponding predictions
+        for i in range(self.nbr_activ):
+            self.activities_entries[i].delete(0, 'end')
+            self.activities_entries[i].insert(0, str(points[i]))
+        self.display_predictions(predictions)
+
+        if not reached:
+            messagebox.showinfo('Optimisation', 'La présence visée n\'est pas atteinte pour toutes les activités obligatoires.')
+
 
 class DataForm(ttk.Frame):
     def __init__(self, parent, *args, **kwargs):
@@ -224,6 +379,10 @@ class DataForm(ttk.Frame):
         self.path_disp = tk.Label(self, text='')
         self.path_disp.grid(row=1, column=0, padx=15, pady=15, sticky='W')
 
+        # Button to import all the files of a directory
+        import_but = tk.Button(self, text='Importer un dossier', command=self.import_directory)
+        import_but.grid(row=5, column=2, padx=15, pady=15)
+
     def file_selection(self):
         # Select location of the data for current year
         self.parent.filename = filedialog.askopenfilename(initialdir='/',
@@ -240,14 +399,8 @@ class DataForm(ttk.Frame):
            and self.year_entry.get() != ''\
            and self.size_entry.get() != '':
 
-            # First read the data
-            data_full, nbr_activ, points = fm.read_data(self.parent.filename)
-            mandatory_list, names = fm.get_mandatory_and_name_list_from_file(self.parent.filename, nbr_activ)
-
-            print(db_path)
-
-            # Write the data (separate, cumulative) in the db
-            fm.write_record(data_full, int(self.year_entry.get()), mandatory_list, names, int(self.size_entry.get()), points, db_path)
+            # Read the data and write it (separate, cumulative) in the db, unless this file was already imported
+            written = fm.import_file(self.parent.filename, int(self.year_entry.get()), int(self.size_entry.get()), db_path)
 
             # Clear out the field
             self.year_entry.delete(0, 'end')
@@ -255,7 +408,10 @@ class DataForm(ttk.Frame):
             self.size_entry.delete(0, 'end')
 
             # Display success
-            messagebox.showinfo('Mise à jour des données', 'Les données ont bien été mises à jours ! Vous pouvez continuez !')
+            if written:
+                messagebox.showinfo('Mise à jour des données', 'Les données ont bien été mises à jours ! Vous pouvez continuez !')
+            else:
+                messagebox.showinfo('Mise à jour des données', 'Ce fichier avait déjà été importé pour cette année, rien n\'a changé !')
 
         else:
             if self.parent.filename is None or not(self.parent.filename.endswith('.xlsx') or self.parent.filename.endswith('.xls')):
@@ -269,6 +425,30 @@ class DataForm(ttk.Frame):
                 messagebox.showerror('Erreur', 'Vous devez d\'abord spécifier le nombre de personnes dans la société pour cette année !')
 
 
+    def import_directory(self):
+        # Select the directory containing the data files, and the csv file with the year and size of each file
+        directory = filedialog.askdirectory(title='Sélectionner le dossier des fichiers de données')
+        if not directory:
+            return
+        manifest = filedialog.askopenfilename(initialdir=directory,
+                                              title='Sélectionner le fichier .csv (nom du fichier, année, nombre de personnes)',
+                                              filetypes=(("Fichier CSV", "*.csv"), ("Tout les fichiers", "*.*")))
+        if not manifest:
+            return
+
+        years, skipped = fm.import_files(directory, manifest, db_path)
+
+        if years:
+            message = 'Les années ' + ', '.join(str(year) for year in years) + ' ont bien été importées !'
+            if skipped:
+                message += '\nLes années ' + ', '.join(str(year) for year in skipped) + ' étaient déjà importées (aucune modification).'
+            messagebox.showinfo('Mise à jour des données', message)
+        elif skipped:
+            messagebox.showinfo('Mise à jour des données', 'Les fichiers ont déjà été importés, aucune modification.')
+        else:
+            messagebox.showerror('Erreur', 'Aucun fichier du dossier ne se trouve dans le fichier .csv !')
+
+
 class MainApplication(tk.Frame):
     def __init__(self, parent, *args, **kwargs):
         tk.Frame.__init__(self, parent, *args, **kwargs)
@@ -3,25 +3,113 @@ import numpy as np
 import sqlite3
 import os.path
 import io
+import json
+import shutil
+import hashlib
+import csv
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import struct
+import time
+
+# Personal modules
+from points_system.KRR import KRRModel, KERNELS, data_fingerprint
+from points_system.members import pack_attendance, member_points, align_activities, derive_record, Leaderboard
 
 """
 The separate table contains the records for each year separately and in term of persons.
-The cumulative table contains the cumulative records for each year and in term of percentage w.r.t. to
-each of the years an entry corresponds to.
+The cumulative records (all the years, in term of percentage w.r.t. to the size of the society each year) are not
+stored, they are derived from the rows of the separate table, see get_cumulative.
+The activities and attendance tables contain the same records in a normalized form : one row per (year, activity),
+with indexes on the year and the activity, to query the history of some activities without decoding whole years.
+The models table contains the fitted KRR models, keyed by the fingerprint of their training data and kernel configuration.
+The version of the schema is stored in the user_version pragma, the older dbs are migrated when they are
+opened (see migrate_schema).
 """
 
 
+# Header of the encoded arrays : magic, version, number of dimensions, length of the dtype string,
+# then the dtype string, the shape (one int64 per dimension), padding to ARRAY_ALIGN bytes and the raw C-ordered buffer
+ARRAY_MAGIC = b'NPA'
+ARRAY_VERSION = 1
+ARRAY_HEADER = struct.Struct('<3sBBB')
+ARRAY_ALIGN = 16
+
+
 def adapt_array(arr):
-    out = io.BytesIO()
-    np.save(out, arr)
-    out.seek(0)
-    return sqlite3.Binary(out.read())
+    """
+    Encodes an array with a small fixed header (dtype, shape, version) followed by the raw buffer.
+    The arrays of objects have no raw buffer and are refused (they could only be stored pickled)
+    :param arr: np.array : the array to store
+    :return: sqlite3.Binary : the encoded array
+    """
+    if arr.dtype.hasobject:
+        raise TypeError('The arrays of objects can not be stored, convert them to a numeric or string dtype')
+
+    dtype = arr.dtype.str.encode()
+    header = ARRAY_HEADER.pack(ARRAY_MAGIC, ARRAY_VERSION, arr.ndim, len(dtype)) + dtype
+    header += struct.pack('<' + str(arr.ndim) + 'q', *arr.shape)
+    header += b'\0' * (-len(header) % ARRAY_ALIGN)
+
+    return sqlite3.Binary(header + np.ascontiguousarray(arr).tobytes())
 
 
 def convert_array(text):
-    out = io.BytesIO(text)
-    out.seek(0)
-    return np.load(out)
+    """
+    Decodes an array stored by adapt_array, directly on the blob (no copy, the array is read only).
+    The arrays stored in the .npy format by previous versions are still decoded (never with pickle)
+    :param text: bytes : the blob of the db
+    :return: np.array : the decoded array
+    """
+    if text[:len(ARRAY_MAGIC)] != ARRAY_MAGIC:
+        # Array in the .npy format
+        out = io.BytesIO(text)
+        out.seek(0)
+        return np.load(out)
+
+    magic, version, ndim, dtype_len = ARRAY_HEADER.unpack_from(text)
+    if version != ARRAY_VERSION:
+        raise ValueError('Unknown version of the array encoding : ' + str(version))
+
+    offset = ARRAY_HEADER.size
+    dtype = np.dtype(text[offset:offset + dtype_len].decode())
+    offset += dtype_len
+    shape = struct.unpack_from('<' + str(ndim) + 'q', text, offset)
+    offset += 8 * ndim
+    offset += -offset % ARRAY_ALIGN
+
+    return np.frombuffer(text, dtype=dtype, offset=offset).reshape(shape)
+
+
+def benchmark_array_codec(arr, repeat=1000):
+    """
+    Compares the time to encode and decode the array with adapt_array/convert_array and with the .npy format
+    :param arr: np.array : the array to encode
+    :param repeat: the number of encodings and decodings timed
+    :return: dict : the time (in seconds) of one encoding and one decoding for each codec
+    """
+    def npy_adapt(a):
+        out = io.BytesIO()
+        np.save(out, a)
+        return out.getvalue()
+
+    def npy_convert(blob):
+        return np.load(io.BytesIO(blob))
+
+    timings = {}
+    for name, adapt, convert in (('raw', adapt_array, convert_array), ('npy', npy_adapt, npy_convert)):
+        start = time.perf_counter()
+        for i in range(repeat):
+            blob = adapt(arr)
+        timings[name + '_encode'] = (time.perf_counter() - start) / repeat
+
+        blob = bytes(blob)
+        start = time.perf_counter()
+        for i in range(repeat):
+            convert(blob)
+        timings[name + '_decode'] = (time.perf_counter() - start) / repeat
+
+    return timings
 
 
 # Automatically executed when the modul (file_manager) is imported in another file
@@ -29,32 +117,123 @@ sqlite3.register_adapter(np.ndarray, adapt_array)
 sqlite3.register_converter("nparray", convert_array)
 
 
-def read_data(path):
+# Functions called after each record written by write_record, see register_write_listener
+write_listeners = []
+
+
+def register_write_listener(listener):
     """
-    Read the data in the specified excel file
-    :param path: the path where the excel file
-    containing the data of the current year is located
-    :return a np.array of dimensions (1 x 3*nbr of activities, for present, excused, and non-excused) with the data of the current year, and the number of activities this year,
-    and a np.array (nbr of activities, ) containing the attributed points (ith element represents the points attributed to the ith activity)
+    Registers a function to call each time a record is written in a db with write_record
+    :param listener: function (db_path, year, record, points, society_size, is_new), where is_new is
+    False if the record of this year already existed and was updated
+    :return: Nothing
+    """
+    write_listeners.append(listener)
+
+
+def _read_columns_xlsx(path, sheet_name, nbr_cols, start_row=1):
+    """
+    Reads the columns of a sheet of a .xlsx file by streaming it (xlrd does not read .xlsx files anymore)
+    :param path: the path of the excel file
+    :param sheet_name: the name of the sheet
+    :param nbr_cols: the number of columns to read, None for all of them
+    :param start_row: the index of the first row to read, by default 1 to skip the header row
+    :return: list of the columns, each one a list of the cell values
     """
-    # Open workbook
-    wb = xlrd.open_workbook(path)
-    sheet = wb.sheet_by_name("DataApp")
+    # Only needed for the .xlsx files
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = []
+        for row in wb[sheet_name].iter_rows(min_row=start_row + 1, max_col=nbr_cols, values_only=True):
+            # The empty rows at the end of the sheet are not data
+            if all(cell is None for cell in row):
+                break
+            rows.append(row)
+    finally:
+        wb.close()
+
+    if nbr_cols is None:
+        nbr_cols = max((len(row) for row in rows), default=0)
+    rows = [row + (None,) * (nbr_cols - len(row)) for row in rows]
+
+    return [list(col) for col in zip(*rows)] if rows else [[] for i in range(nbr_cols)]
+
+
+def _read_columns_xls(path, sheet_name, nbr_cols, start_row=1):
+    """
+    Reads the columns of a sheet with xlrd, one column at a time
+    :param path: the path of the excel file
+    :param sheet_name: the name of the sheet
+    :param nbr_cols: the number of columns to read, None for all of them
+    :param start_row: the index of the first row to read, by default 1 to skip the header row
+    :return: list of the columns, each one a list of the cell values
+    """
+    wb = xlrd.open_workbook(path, on_demand=True)
+    try:
+        sheet = wb.sheet_by_name(sheet_name)
+        if nbr_cols is None:
+            nbr_cols = sheet.ncols
+        return [sheet.col_values(i, start_rowx=start_row) for i in range(nbr_cols)]
+    finally:
+        wb.release_resources()
+
+
+def read_columns(path, sheet_name, nbr_cols=None, start_row=1):
+    """
+    Reads the columns of a sheet of an excel file (.xls or .xlsx)
+    :param path: the path of the excel file
+    :param sheet_name: the name of the sheet
+    :param nbr_cols: the number of columns to read, None (default) for all of them
+    :param start_row: the index of the first row to read, by default 1 to skip the header row
+    :return: list of the columns, each one a list of the cell values
+    """
+    if str(path).endswith('.xlsx'):
+        return _read_columns_xlsx(path, sheet_name, nbr_cols, start_row)
+    return _read_columns_xls(path, sheet_name, nbr_cols, start_row)
+
+
+def read_file(path):
+    """
+    Reads everything needed from the excel file, which is opened only once
+    :param path: the path where the excel file containing the data of the current year is located
+    :return: np.array (1, 3*nbr of activities) : the data of the current year (present, excused, and non-excused),
+    int : the number of activities this year,
+    np.array (nbr of activities, ) : the attributed points (ith element represents the points attributed to the ith activity),
+    np.array (nbr of activities, ) : whether the ith activity is mandatory or not,
+    np.array (nbr of activities, ) : the names of the activities
+    """
+    # Columns : names, points, present, excused, non-excused, mandatory
+    columns = read_columns(path, "DataApp", 6)
 
     # The number of activities this year
-    nbr_activ = sheet.nrows - 1
+    nbr_activ = len(columns[0])
 
     data = np.empty((1, 3 * nbr_activ))
     points = np.empty(nbr_activ, dtype=int)
+    # dtype('U50') for unicode of max 50 chars, with str it is by default only 1 char
+    names = np.empty(nbr_activ, dtype=np.dtype('U50'))
 
-    # Fill the numpy array
-    # Iterate over the columns (only 4 of them necessary)
-    for i in range(1, 5):
-        for j in range(1, sheet.nrows):
-            if i == 1:
-                points[j - 1] = sheet.cell_value(j, i)
-            else:
-                data[0, (i - 2) * nbr_activ + j - 1] = sheet.cell_value(j, i)
+    # Fill the numpy arrays, one column at a time
+    names[:] = columns[0]
+    points[:] = columns[1]
+    for i in range(3):
+        data[0, i * nbr_activ:(i + 1) * nbr_activ] = columns[i + 2]
+    mandatory = np.isin(columns[5], ("Oui", "oui"))
+
+    return data, nbr_activ, points, mandatory, names
+
+
+def read_data(path):
+    """
+    Read the data in the specified excel file
+    :param path: the path where the excel file
+    containing the data of the current year is located
+    :return a np.array of dimensions (1 x 3*nbr of activities, for present, excused, and non-excused) with the data of the current year, and the number of activities this year,
+    and a np.array (nbr of activities, ) containing the attributed points (ith element represents the points attributed to the ith activity)
+    """
+    data, nbr_activ, points, mandatory, names = read_file(path)
 
     return data, nbr_activ, points
 
@@ -67,38 +246,283 @@ def get_mandatory_and_name_list_from_file(path, nbr_activ):
     :return: a np.array containing booleans where at index i contains whether the ith activity is mandatory or not,
     and the name at ith index of the ith activity
     """
-    # Open workbook
-    wb = xlrd.open_workbook(path)
-    sheet = wb.sheet_by_name("DataApp")
+    data, nbr_activ, points, mandatory, names = read_file(path)
 
-    # Mandatory list
-    data = np.empty(nbr_activ, dtype=bool)
+    return mandatory, names
 
-    for i in range(1, sheet.nrows):
-        cell = sheet.cell_value(i, 5)
-        if cell == "Oui" or cell == "oui":
-            data[i - 1] = True
-        else:
-            data[i - 1] = False
-    # dtype('U50') for unicode of max 50 chars, with str it is by default only 1 char
-    names = np.empty(nbr_activ, dtype=np.dtype('U50'))
 
-    for i in range(1, sheet.nrows):
-        names[i - 1] = sheet.cell_value(i, 0)
+def sheet_names(path):
+    """
+    Returns the names of the sheets of an excel file (.xls or .xlsx)
+    :param path: the path of the excel file
+    :return: list of str
+    """
+    if str(path).endswith('.xlsx'):
+        import openpyxl
+
+        wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            return list(wb.sheetnames)
+        finally:
+            wb.close()
+
+    wb = xlrd.open_workbook(path, on_demand=True)
+    try:
+        return wb.sheet_names()
+    finally:
+        wb.release_resources()
+
+
+def read_member_file(path):
+    """
+    Reads the attendance of each member in the "Membres" sheet of the excel file : the first row contains the names
+    of the activities (from the second column), then one row per member with the name of the member in the first column
+    and for each activity "P" if the member was present, "E" if excused, anything else if non present
+    :param path: the path of the excel file
+    :return: np.array (nbr of members, ) : the names of the members, np.array (nbr of activities, ) : the names of the
+    activities, np.array (nbr of members, nbr of activities) of bool : present, the same for excused,
+    or None if the file has no "Membres" sheet
+    """
+    if "Membres" not in sheet_names(path):
+        return None
+
+    columns = read_columns(path, "Membres", start_row=0)
+
+    # Remove the empty columns at the end
+    while columns and all(cell in (None, '') for cell in columns[-1]):
+        columns.pop()
+
+    activities = np.array([col[0] for col in columns[1:]], dtype=np.dtype('U50'))
+    members = np.array(columns[0][1:], dtype=np.dtype('U50'))
+
+    codes = np.array([[str(cell).strip().upper() if cell is not None else '' for cell in col[1:]]
+                      for col in columns[1:]]).reshape((len(activities), len(members))).T
+
+    return members, activities, codes == 'P', codes == 'E'
+
+
+def read_year_file(path):
+    """
+    Reads the record of the year and, if the file has a "Membres" sheet, the attendance of each member. The counts of
+    the activities of the member sheet are then derived from the attendance (see members.derive_record).
+    Executed in a worker process by import_files
+    :param path: the path of the excel file
+    :return: the record, the number of activities, the points, the mandatory activities and the names of the
+    activities as returned by read_file, and (members, activities, present bitplane, excused bitplane) or None if
+    the file has no "Membres" sheet
+    """
+    data, nbr_activ, points, mandatory, names = read_file(path)
+
+    sheet = read_member_file(path)
+    if sheet is not None:
+        members, activities, present, excused = sheet
+        present_bits, excused_bits = pack_attendance(present, excused)
+        data = derive_record(data, names, activities, present_bits, excused_bits)
+        sheet = (members, activities, present_bits, excused_bits)
+
+    return data, nbr_activ, points, mandatory, names, sheet
+
+
+def create_member_table(c):
+    """
+    Creates the table of the attendance of each member if it does not exist
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS member_attendance (
+                 year INTEGER PRIMARY KEY,
+                 members nparray,
+                 nbr_activ INTEGER,
+                 present nparray,
+                 excused nparray,
+                 activities nparray
+                    )''')
+
+    # Total of points of each member and indexes of the members by decreasing total, for each year
+    c.execute('''CREATE TABLE IF NOT EXISTS member_points (
+                 year INTEGER PRIMARY KEY,
+                 members nparray,
+                 totals nparray,
+                 ranking nparray
+                    )''')
+
+
+def update_member_points(year, c):
+    """
+    Computes and stores the total of points of each member for the year, from the attendance of the members and the
+    points of the activities of the record, matched by name. Nothing is done if one of them is missing. If an activity
+    of the record is not in the attendance of the members, the totals can not be known and the stored totals of the
+    year are removed (an activity of the attendance which is not in the record gives no points). It does not commit,
+    the caller runs it in its transaction
+    :param year: the year
+    :param c: the cursor of the corresponding open connection to the db
+    :return: bool : True if the totals of the year are up to date, False if there are none
+    """
+    c.execute('''SELECT count(name) FROM sqlite_master WHERE type='table'
+                 AND name IN ('member_attendance', 'separate', 'mandatory')''')
+    if c.fetchone()[0] != 3:
+        return False
+
+    c.execute('''SELECT members, activities, nbr_activ, present, points, names FROM member_attendance
+                 JOIN separate ON member_attendance.year = separate.year
+                 JOIN mandatory ON member_attendance.year = mandatory.year WHERE member_attendance.year = ?''', (year,))
+    row = c.fetchone()
+    if row is None:
+        return False
+
+    members, activities, nbr_activ, present_bits, points, names = row
+    if activities is None and nbr_activ == len(names):
+        # Stored without the names of its activities, by previous versions : in the order of the record
+        activities = names
+
+    index = np.full(len(names), -1) if activities is None else align_activities(activities, names)
+    if np.any(index < 0):
+        c.execute('''DELETE FROM member_points WHERE year = ?''', (year,))
+        return False
+
+    # The points of the activities, in the order of the attendance of the members
+    sheet_points = np.zeros(nbr_activ, dtype=int)
+    sheet_points[index] = points
+
+    totals = member_points(present_bits, nbr_activ, sheet_points)
+
+    c.execute('''SELECT members, totals, ranking FROM member_points WHERE year = ?''', (year,))
+    stored = c.fetchone()
+    changed = None
+    if stored is not None and np.array_equal(stored[0], members) and len(np.unique(members)) == len(members):
+        leaderboard = Leaderboard(*stored)
+        changed = np.flatnonzero(leaderboard.totals != totals)
+
+    if changed is not None and changed.size == 0:
+        return True
+    if changed is not None and changed.size < np.log2(len(members)):
+        # Only a few totals changed (e.g. the attendance of one member was corrected) : these members are moved in the
+        # sorted index, in O(nbr of members) each, instead of sorting all the members again
+        for i in changed:
+            leaderboard.update(members[i], totals[i])
+        ranking = leaderboard.order
+    else:
+        ranking = np.argsort(-totals, kind='stable')
+
+    c.execute('''INSERT OR REPLACE INTO member_points (year, members, totals, ranking)
+                 VALUES(?, ?, ?, ?)''', (year, members, totals, ranking))
+    return True
+
+
+def get_leaderboard(year, db_path):
+    """
+    Returns the leaderboard of the members for the year, from the stored totals (nothing is recomputed)
+    :param year: the year
+    :param db_path: the path of the database
+    :return: members.Leaderboard, or None if the totals of this year are not known
+    """
+    conn, c = connect_db(db_path)
+    create_member_table(c)
+
+    c.execute('''SELECT members, totals, ranking FROM member_points WHERE year = ?''', (year,))
+    row = c.fetchone()
+
+    close_db(conn, c)
+
+    return None if row is None else Leaderboard(*row)
+
+
+def insert_member_attendance(year, members, activities, present_bits, excused_bits, c):
+    """
+    Writes the attendance of each member for the year and updates the totals of points of the members.
+    It does not commit, the caller runs it in its transaction
+    :param year: the year
+    :param members: np.array (nbr of members, ) : the names of the members
+    :param activities: np.array (nbr of activities, ) : the names of the activities
+    :param present_bits: the bitplane of the present members (see members.pack_attendance)
+    :param excused_bits: the bitplane of the excused members
+    :param c: the cursor of the corresponding open connection to the db
+    :return: bool : True if the totals of the year are up to date (see update_member_points)
+    """
+    create_member_table(c)
+
+    c.execute('''INSERT OR REPLACE INTO member_attendance (year, members, nbr_activ, present, excused, activities)
+                 VALUES(?, ?, ?, ?, ?, ?)''', (year, np.asarray(members, dtype=np.dtype('U50')), len(activities),
+                                                present_bits, excused_bits, np.asarray(activities, dtype=np.dtype('U50'))))
+
+    # The totals of points of the members of this year
+    return update_member_points(year, c)
 
-    return data, names
+
+def write_member_attendance(year, members, activities, present, excused, db_path):
+    """
+    Writes the attendance of each member for the year, as bit-packed matrices
+    :param year: the year
+    :param members: np.array (nbr of members, ) : the names of the members
+    :param activities: np.array (nbr of activities, ) : the names of the activities, matched by name with the
+    activities of the record of the year
+    :param present: np.array (nbr of members, nbr of activities) of bool : True if the member was present
+    :param excused: np.array (nbr of members, nbr of activities) of bool : True if the member was excused
+    :param db_path: the path of the database
+    :return: bool : True if the totals of the year are up to date (see update_member_points)
+    """
+    present_bits, excused_bits = pack_attendance(present, excused)
+
+    conn, c = connect_db(db_path)
+
+    with conn:
+        up_to_date = insert_member_attendance(year, members, activities, present_bits, excused_bits, c)
+
+    close_db(conn, c)
+
+    return up_to_date
+
+
+def get_member_attendance(year, db_path):
+    """
+    Returns the attendance of each member for the year
+    :param year: the year
+    :param db_path: the path of the database
+    :return: np.array (nbr of members, ), np.array (nbr of activities, ), int, np.array, np.array : the names of the
+    members, the names of the activities (None if stored by a previous version), the number of activities, the bitplanes
+    of the present and excused members (see members.unpack_bits), or None if there is no attendance for this year
+    """
+    conn, c = connect_db(db_path)
+    create_member_table(c)
+
+    c.execute('''SELECT members, activities, nbr_activ, present, excused FROM member_attendance WHERE year = ?''',
+              (year,))
+    row = c.fetchone()
+
+    close_db(conn, c)
+
+    return row
+
+
+# Open connections, one per db path, shared by all the helpers of this module
+connections = {}
+
+# Pragmas set on each new connection : WAL journal (readers do not block the writer, one fsync per transaction
+# at checkpoint), fewer fsyncs (still safe with WAL), temporary tables in memory and a larger page cache
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+)
 
 
 def connect_db(db_path):
     """
-    Connects to the db specified
+    Connects to the db specified, the connection is opened once per db path and then reused
     :param db_path: the db we want to connect to
     :return: the connection and cursor variable
     """
-    conn = None
+    conn = connections.get(db_path)
+    c = None
     try:
-        # Connects to the db
-        conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+        if conn is None:
+            # Connects to the db
+            conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            migrate_schema(conn)
+            connections[db_path] = conn
 
         # Creates the cursor
         c = conn.cursor()
@@ -109,13 +533,139 @@ def connect_db(db_path):
 
 def close_db(conn, cursor):
     """
-    Close the connection given to the db
+    Close the cursor given, the connection stays open to be reused (see close_all_db)
     :param conn: the connection to the db
     :param cursor: the cursor of the connection
     :return: Nothing
     """
     cursor.close()
-    conn.close()
+
+
+def close_all_db():
+    """
+    Close all the open connections
+    :return: Nothing
+    """
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+def _drop_cumulative_table(c):
+    """
+    Migration 0 -> 1 : the cumulative records used to be stored as a full copy of all the previous years
+    for each year, they are now derived from the separate table
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    c.execute('''DROP TABLE IF EXISTS cumulative''')
+
+
+def _backfill_attendance(c):
+    """
+    Migration 1 -> 2 : creates the normalized tables and fills them for the years written by previous versions
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    write_missing_attendance(c)
+
+
+def _add_models_data_key(c):
+    """
+    Migration 2 -> 3 : the fitted models are also keyed by the fingerprint of their training data only, to reuse
+    a model without selecting its kernel again. The models stored before have no such key and are fitted again
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    c.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name='models' ''')
+    if c.fetchone() is not None:
+        c.execute('''ALTER TABLE models ADD COLUMN data_key TEXT''')
+
+
+def _add_member_activities(c):
+    """
+    Migration 3 -> 4 : the names of the activities of the attendance of the members are stored, to match them with
+    the activities of the record by name. The attendances stored before are matched by position
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    c.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name='member_attendance' ''')
+    if c.fetchone() is not None:
+        c.execute('''ALTER TABLE member_attendance ADD COLUMN activities nparray''')
+
+
+# Schema migrations, MIGRATIONS[i] migrates a db from the version i to the version i + 1.
+# The version of a db is stored in its user_version pragma
+MIGRATIONS = (
+    _drop_cumulative_table,
+    _backfill_attendance,
+    _add_models_data_key,
+    _add_member_activities,
+)
+
+
+def migrate_schema(conn):
+    """
+    Runs the migrations not yet applied to the db, once, when the connection is opened
+    :param conn: the connection to the db
+    :return: Nothing
+    """
+    c = conn.cursor()
+    c.execute('PRAGMA user_version')
+    version = c.fetchone()[0]
+
+    if version < len(MIGRATIONS):
+        # The migrations and the new version are committed together. The transaction is opened explicitly, sqlite3
+        # only opens one implicitly before an INSERT, UPDATE or DELETE, so the DROP, CREATE and ALTER statements
+        # would otherwise be committed one by one
+        with conn:
+            c.execute('BEGIN')
+            for migration in MIGRATIONS[version:]:
+                migration(c)
+            c.execute('PRAGMA user_version = ' + str(len(MIGRATIONS)))
+
+        # Gives back to the file system the space freed by the dropped tables (outside of a transaction)
+        c.execute('PRAGMA freelist_count')
+        if c.fetchone()[0] > 0:
+            c.execute('VACUUM')
+
+    c.close()
+
+
+def migrate_arrays(db_path):
+    """
+    Rewrites the arrays stored in the .npy format by previous versions with the current encoding.
+    Not needed to read the db (both formats are decoded), it only avoids the slower decoding
+    :param db_path: the path of the database
+    :return: int : the number of rows rewritten
+    """
+    conn, c = connect_db(db_path)
+
+    # Columns of type nparray of each table
+    columns = {}
+    c.execute('''SELECT name FROM sqlite_master WHERE type='table' ''')
+    for table, in c.fetchall():
+        c.execute('PRAGMA table_info(' + table + ')')
+        columns[table] = [col[1] for col in c.fetchall() if col[2] == 'nparray']
+
+    nbr_rows = 0
+    with conn:
+        for table, cols in columns.items():
+            if not cols:
+                continue
+            # Read the raw blobs, the cast avoids the converter
+            c.execute('SELECT rowid, ' + ', '.join('CAST(' + col + ' AS BLOB)' for col in cols) + ' FROM ' + table)
+            for row in c.fetchall():
+                if all(blob is None or blob[:len(ARRAY_MAGIC)] == ARRAY_MAGIC for blob in row[1:]):
+                    continue
+                arrays = [None if blob is None else convert_array(blob) for blob in row[1:]]
+                c.execute('UPDATE ' + table + ' SET ' + ', '.join(col + ' = ?' for col in cols) + ' WHERE rowid = ?',
+                          (*arrays, row[0]))
+                nbr_rows += 1
+
+    close_db(conn, c)
+
+    return nbr_rows
 
 
 def check_existence_tables(db_path):
@@ -130,14 +680,14 @@ def check_existence_tables(db_path):
 
     conn, c = connect_db(db_path)
 
-    # Query the number of tables with the name cumulative
+    # Query the number of tables with the name mandatory
     c.execute('''SELECT count(name) FROM sqlite_master
-    WHERE type='table' AND name='cumulative' ''')
+    WHERE type='table' AND name='mandatory' ''')
 
     # Fetch the result
-    cumul = False
+    mdt = False
     if c.fetchone()[0] == 1:
-        cumul = True
+        mdt = True
 
     # Query the number of tables with the name separate
     c.execute('''SELECT count(name) FROM sqlite_master
@@ -150,7 +700,7 @@ def check_existence_tables(db_path):
 
     close_db(conn, c)
 
-    return cumul and sep
+    return mdt and sep
 
 
 def check_existence_record(year, c):
@@ -168,10 +718,10 @@ def check_existence_record(year, c):
     return exists
 
 
-def update_record(new_record, year, mdt, society_size, points, c, conn):
+def update_record(new_record, year, mdt, society_size, points, c, conn, names=None):
     """
     Update the record of the current year in the database containing the records for each year
-    and the record in the table containing all years
+    and the mandatory data of that year. It does not commit, the caller runs it in its transaction
     :param new_record: the new record for this year
     :param year: the current year
     :param mdt: the mandatory data for this year
@@ -179,6 +729,7 @@ def update_record(new_record, year, mdt, society_size, points, c, conn):
     :param points: np.array of the points attributed to the activities for this year
     :param c: the cursor of the corresponding open connection to the db
     :param conn: the connection to the corresponding db
+    :param names: the names of the activities, if None they are not updated
     :return:
     """
     # Query to update the separate table
@@ -189,61 +740,24 @@ def update_record(new_record, year, mdt, society_size, points, c, conn):
               WHERE year = ?'''
 
     c.execute(sql, (new_record, points, society_size, year))
-    conn.commit()
 
     # Query to update the mandatory table
     c.execute('''UPDATE mandatory
                  SET mdt = ?
                  WHERE year = ?''', (mdt, year))
-    conn.commit()
-
-    # Query to update in the cumulative table
-    c.execute('''SELECT * FROM cumulative WHERE year=?''', (year,))
-    last_year, current, cur_points = c.fetchone()
-
-    current = current[:-1]
-    cur_points = cur_points[:-1]
-
-    if current.size == 0:
-        new = new_record / society_size
-        new_points = points
-    else:
-        new = np.append(current, new_record / society_size, axis=0)
-        new_points = np.append(cur_points, points, axis=0)
-
-    # Write the updated record into the cumulative table
-    c.execute('''UPDATE cumulative
-                 SET data = ?,
-                 points = ?
-                 WHERE year = ?''', (new, new_points, year))
 
-    conn.commit()
+    if names is not None:
+        c.execute('''UPDATE mandatory
+                     SET names = ?
+                     WHERE year = ?''', (names, year))
 
 
-def write_record(record, year, mdt, names, society_size, points, db_path):
+def create_tables(c):
     """
-    Write the new record for the current year in the database containing the records for each year
-    and update the record in the table containing all years. Checks if a record for this year already exists,
-    if yes, it updates it, if not it adds it. It also checks if the tables exists, if not it creates them.
-    :param record: np.array () : the new record of the current year
-    :param year: the current year
-    :param mdt: the mandatory data for this year
-    :param names: the names of the activities
-    :param society_size: the size of the society for that year
-    :param points: np.array of the points attributed to the activities for this year
-    :param db_path: the path of the database
-    :return:
+    Creates the tables of the records if they do not exist
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
     """
-    # Open connection to the db
-    conn, c = connect_db(db_path)
-
-    # If the tables does not exist, we create them
-    c.execute('''CREATE TABLE IF NOT EXISTS cumulative (
-                year INTEGER PRIMARY KEY,
-                data nparray,
-                points nparray
-                  )''')
-
     c.execute('''CREATE TABLE IF NOT EXISTS separate (
                  year INTEGER PRIMARY KEY,
                  data nparray,
@@ -257,14 +771,36 @@ def write_record(record, year, mdt, names, society_size, points, db_path):
                   names nparray
                     )''')
 
-    conn.commit()
+    # Hash of the file imported for each year, to skip the files already imported
+    c.execute('''CREATE TABLE IF NOT EXISTS imports (
+                  year INTEGER PRIMARY KEY,
+                  file_hash TEXT,
+                  size INTEGER
+                    )''')
+
+    create_attendance_tables(c)
+
 
+def insert_or_update_record(record, year, mdt, names, society_size, points, c, conn):
+    """
+    Writes the record of one year in all the tables, it is added or updated if there is already a record for this year.
+    It does not commit, the caller runs it in its transaction
+    :param record: np.array () : the new record of the current year
+    :param year: the current year
+    :param mdt: the mandatory data for this year
+    :param names: the names of the activities
+    :param society_size: the size of the society for that year
+    :param points: np.array of the points attributed to the activities for this year
+    :param c: the cursor of the corresponding open connection to the db
+    :param conn: the connection to the corresponding db
+    :return: bool : True if the record is new, False if it was updated
+    """
     # Checks if there is already a record for this year
     record_exist = check_existence_record(year, c)
 
     if record_exist:
         print("Updating the entry")
-        update_record(record, year, mdt, society_size, c, conn)
+        update_record(record, year, mdt, society_size, points, c, conn, names)
     else:
         print("Writing new entry")
 
@@ -272,61 +808,734 @@ def write_record(record, year, mdt, names, society_size, points, db_path):
         c.execute('''INSERT INTO separate (year, data, points, size)
                      VALUES(?, ?, ?, ?)''', (year, record, points, society_size))
 
-        conn.commit()
-
         # Write new record of mandatory data into the mandatory table
         c.execute('''INSERT INTO mandatory (year, mdt, names)
                      VALUES(?, ?, ?)''', (year, mdt, names))
-        conn.commit()
 
-        # Query cumulative record of previous year
-        c.execute('''SELECT * FROM cumulative WHERE year=?''', (year - 1,))
+    # Normalized rows of this year
+    write_attendance(record, year, mdt, names, points, c)
 
-        prev_data = c.fetchone()
+    # The points may have changed, so the totals of the members too
+    update_member_points(year, c)
 
-        # Add to the array the record of this year if previous is not empty
-        if prev_data is None:
-            prev_data = record / society_size
-            prev_points = np.reshape(points, (1, -1))
-        else:
-            # Returns the rows corresponding to our query i.e. with (year, data presence, points), so we take the second one
-            prev_points = prev_data[2]
-            prev_data = prev_data[1]
-            prev_data = np.append(prev_data, record / society_size, axis=0)
+    return not record_exist
 
-            prev_points = np.append(prev_points, np.reshape(points, (1, -1)), axis=0)
 
+def write_records(records, db_path, file_hashes=None, member_sheets=None):
+    """
+    Writes the records of several years in one transaction, in increasing order of the years
+    :param records: list of (record, year, mdt, names, society_size, points), as the arguments of write_record
+    :param db_path: the path of the database
+    :param file_hashes: list of the hashes of the files the records come from (see file_hash), in the same order
+    as the records, if None no hash is recorded
+    :param member_sheets: list of the attendances of the members of each year, as (members, activities, present
+    bitplane, excused bitplane) or None, in the same order as the records (see read_year_file), if None no
+    attendance is written
+    :return: Nothing
+    """
+    if file_hashes is None:
+        file_hashes = [None] * len(records)
+    if member_sheets is None:
+        member_sheets = [None] * len(records)
+    order = sorted(range(len(records)), key=lambda i: records[i][1])
+    records = [records[i] for i in order]
+    file_hashes = [file_hashes[i] for i in order]
+    member_sheets = [member_sheets[i] for i in order]
 
-        print("new cumulative record " + str(prev_data))
-        print("points cumul " + str(prev_points))
+    # Open connection to the db
+    conn, c = connect_db(db_path)
 
-        # Write new cumulative record into the cumulative table
-        c.execute('''INSERT INTO cumulative (year, data, points)
-                     VALUES(?, ?, ?)''', (year, prev_data, prev_points))
-        conn.commit()
+    # If the tables does not exist, we create them
+    create_tables(c)
+    conn.commit()
 
-    close_db(conn, c)
+    # All the tables are written in one transaction : committed at the end, or rolled back on error
+    with conn:
+        is_new = []
+        for entry, sheet in zip(records, member_sheets):
+            if sheet is not None:
+                # Before the record, which then updates the totals of points of the members
+                insert_member_attendance(entry[1], *sheet, c)
+            is_new.append(insert_or_update_record(*entry, c, conn))
+
+        for (record, year, mdt, names, society_size, points), hash_value in zip(records, file_hashes):
+            if hash_value is None:
+                # Written from data which does not come from a file, the previous hash is not valid anymore
+                c.execute('''DELETE FROM imports WHERE year = ?''', (year,))
+            else:
+                c.execute('''INSERT OR REPLACE INTO imports (year, file_hash, size)
+                             VALUES(?, ?, ?)''', (year, hash_value, society_size))
+
+    close_db(conn, c)
+
+    # Notify the listeners, e.g. to update the fitted models
+    for (record, year, mdt, names, society_size, points), new in zip(records, is_new):
+        for listener in write_listeners:
+            listener(db_path, year, record, points, society_size, new)
+
+
+def write_record(record, year, mdt, names, society_size, points, db_path):
+    """
+    Write the new record for the current year in the database containing the records for each year
+    and the mandatory data of the year. Checks if a record for this year already exists,
+    if yes, it updates it, if not it adds it. It also checks if the tables exists, if not it creates them.
+    :param record: np.array () : the new record of the current year
+    :param year: the current year
+    :param mdt: the mandatory data for this year
+    :param names: the names of the activities
+    :param society_size: the size of the society for that year
+    :param points: np.array of the points attributed to the activities for this year
+    :param db_path: the path of the database
+    :return:
+    """
+    write_records([(record, year, mdt, names, society_size, points)], db_path)
+
+
+def file_hash(path):
+    """
+    Computes the hash of the content of a file
+    :param path: the path of the file
+    :return: str : the hexadecimal sha256 digest
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_already_imported(year, society_size, hash_value, db_path):
+    """
+    Checks whether the same file was already imported for this year, with the same society size
+    :param year: the year
+    :param society_size: the size of the society for that year
+    :param hash_value: the hash of the file (see file_hash)
+    :param db_path: the path of the database
+    :return: bool
+    """
+    if not os.path.isfile(db_path):
+        return False
+
+    conn, c = connect_db(db_path)
+
+    c.execute('''SELECT count(name) FROM sqlite_master WHERE type='table' AND name='imports' ''')
+    imported = False
+    if c.fetchone()[0] == 1:
+        c.execute('''SELECT file_hash, size FROM imports WHERE year = ?''', (year,))
+        imported = c.fetchone() == (hash_value, society_size)
+
+    close_db(conn, c)
+
+    return imported
+
+
+def import_file(path, year, society_size, db_path):
+    """
+    Imports the excel file of one year, with the attendance of each member if it has a "Membres" sheet (see
+    read_year_file). If the same file was already imported for this year, nothing is done, if it changed only the rows
+    of that year are rewritten
+    :param path: the path of the excel file
+    :param year: the year the data corresponds to
+    :param society_size: the size of the society for that year
+    :param db_path: the path of the database
+    :return: bool : True if the file was written, False if it was already imported
+    """
+    hash_value = file_hash(path)
+    if is_already_imported(year, society_size, hash_value, db_path):
+        return False
+
+    data, nbr_activ, points, mandatory, names, sheet = read_year_file(path)
+    write_records([(data, year, mandatory, names, society_size, points)], db_path, [hash_value], [sheet])
+
+    return True
+
+
+def read_manifest(path):
+    """
+    Reads the manifest of a bulk import : a csv file with one line per excel file, containing the name of the file,
+    the year and the size of the society that year. A header line is allowed
+    :param path: the path of the csv file
+    :return: dict file name -> (year, society size)
+    """
+    with open(path, newline='') as f:
+        sample = f.read(1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+
+        manifest = {}
+        for row in csv.reader(f, dialect):
+            if len(row) < 3 or not row[1].strip().isdigit():
+                # Header or empty line
+                continue
+            manifest[row[0].strip()] = (int(row[1]), int(row[2]))
+    return manifest
+
+
+def import_files(files, manifest, db_path, max_workers=None):
+    """
+    Imports many excel files at once : the files are read in parallel on a process pool and all the years
+    are written in one transaction, in increasing order of the years whatever the order of the files
+    :param files: a directory (all its .xls and .xlsx files) or a glob pattern
+    :param manifest: dict file name -> (year, society size), or the path of a manifest csv file (see read_manifest)
+    :param db_path: the path of the database
+    :param max_workers: the number of worker processes, by default the number of processors
+    :return: list, list : the years imported and the years skipped because their file was already imported unchanged
+    """
+    if not isinstance(manifest, dict):
+        manifest = read_manifest(manifest)
+
+    if os.path.isdir(files):
+        paths = glob.glob(os.path.join(files, '*.xls')) + glob.glob(os.path.join(files, '*.xlsx'))
+    else:
+        paths = glob.glob(files)
+
+    # Only the files listed in the manifest, and not already imported
+    paths = [path for path in sorted(paths) if os.path.basename(path) in manifest]
+    hashes = [file_hash(path) for path in paths]
+    imported = [is_already_imported(*manifest[os.path.basename(path)], hash_value, db_path)
+                for path, hash_value in zip(paths, hashes)]
+    skipped = sorted(manifest[os.path.basename(path)][0] for path, done in zip(paths, imported) if done)
+    hashes = [hash_value for hash_value, done in zip(hashes, imported) if not done]
+    paths = [path for path, done in zip(paths, imported) if not done]
+
+    if not paths:
+        return [], skipped
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        contents = list(executor.map(read_year_file, paths))
+
+    records = []
+    sheets = []
+    for path, (data, nbr_activ, points, mandatory, names, sheet) in zip(paths, contents):
+        year, society_size = manifest[os.path.basename(path)]
+        records.append((data, year, mandatory, names, society_size, points))
+        sheets.append(sheet)
+
+    write_records(records, db_path, hashes, sheets)
+
+    return sorted(record[1] for record in records), skipped
+
+
+# Columns of the attendance table for each category, in the order of the records (present, excused, non present)
+CATEGORIES = ('present', 'excused', 'absent')
+
+
+def create_attendance_tables(c):
+    """
+    Creates the normalized tables (activities and attendance) and their indexes if they do not exist
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS activities (
+                 activity_id INTEGER PRIMARY KEY,
+                 name TEXT UNIQUE
+                    )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS attendance (
+                 year INTEGER,
+                 activity_id INTEGER REFERENCES activities (activity_id),
+                 position INTEGER,
+                 present REAL,
+                 excused REAL,
+                 absent REAL,
+                 points INTEGER,
+                 mandatory INTEGER,
+                 PRIMARY KEY (year, activity_id)
+                    )''')
+
+    # The primary key already indexes the year, this one is for the history of an activity
+    c.execute('''CREATE INDEX IF NOT EXISTS attendance_activity ON attendance (activity_id, year)''')
+
+
+def get_activity_ids(names, c):
+    """
+    Returns the ids of the activities, the unknown activities are added to the activities table
+    :param names: the names of the activities
+    :param c: the cursor of the corresponding open connection to the db
+    :return: np.array (nbr of activities, ) : the id of each activity
+    """
+    names = [str(name) for name in names]
+    c.executemany('''INSERT OR IGNORE INTO activities (name) VALUES(?)''', [(name,) for name in names])
+
+    c.execute('''SELECT name, activity_id FROM activities''')
+    ids = dict(c.fetchall())
+
+    return np.array([ids[name] for name in names], dtype=int)
+
+
+def write_attendance(record, year, mdt, names, points, c):
+    """
+    Writes the normalized rows of one year in the attendance table, replacing the previous ones of that year.
+    It does not commit, the caller runs it in its transaction
+    :param record: np.array (1, 3*nbr of activities) : the record of the year
+    :param year: the year
+    :param mdt: the mandatory data for this year
+    :param names: the names of the activities
+    :param points: np.array of the points attributed to the activities for this year
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    nbr_activ = len(names)
+    counts = np.reshape(record, (3, nbr_activ))
+    ids = get_activity_ids(names, c)
+
+    c.execute('''DELETE FROM attendance WHERE year = ?''', (year,))
+    c.executemany('''INSERT INTO attendance (year, activity_id, position, present, excused, absent, points, mandatory)
+                     VALUES(?, ?, ?, ?, ?, ?, ?, ?)''',
+                  zip([year] * nbr_activ, ids.tolist(), range(nbr_activ), counts[0].tolist(), counts[1].tolist(),
+                      counts[2].tolist(), np.asarray(points, dtype=int).tolist(), np.asarray(mdt, dtype=int).tolist()))
+
+
+def write_missing_attendance(c):
+    """
+    Fills the normalized tables from the separate and mandatory tables, for the years which are not in the attendance
+    table yet (written by previous versions). It does not commit, the caller runs it in its transaction
+    :param c: the cursor of the corresponding open connection to the db
+    :return: int : the number of years written
+    """
+    create_attendance_tables(c)
+
+    # Nothing to fill in a new db
+    c.execute('''SELECT count(name) FROM sqlite_master WHERE type='table' AND name IN ('separate', 'mandatory')''')
+    if c.fetchone()[0] < 2:
+        return 0
+
+    c.execute('''SELECT separate.year, data, points, mdt, names FROM separate
+                 JOIN mandatory ON separate.year = mandatory.year
+                 WHERE separate.year NOT IN (SELECT DISTINCT year FROM attendance)''')
+    rows = c.fetchall()
+
+    for year, record, points, mdt, names in rows:
+        write_attendance(record, year, mdt, names, points, c)
+
+    return len(rows)
+
+
+def populate_attendance(db_path):
+    """
+    Fills the normalized tables for the years which are not in them yet. Done once by the schema migration
+    when a db written by a previous version is opened (see migrate_schema)
+    :param db_path: the path of the database
+    :return: int : the number of years written
+    """
+    conn, c = connect_db(db_path)
+
+    with conn:
+        nbr_years = write_missing_attendance(c)
+
+    close_db(conn, c)
+
+    return nbr_years
+
+
+def get_activity_history(name, db_path):
+    """
+    Returns the history of one activity, with one indexed query
+    :param name: the name of the activity
+    :param db_path: the path of the database
+    :return: np.array (nbr of years, ), np.array (nbr of years, 3), np.array (nbr of years, ), np.array (nbr of years, ) :
+    the years, the number of present, excused and non present people, the points and whether the activity was mandatory
+    """
+    conn, c = connect_db(db_path)
+
+    c.execute('''SELECT year, present, excused, absent, points, mandatory FROM attendance
+                 JOIN activities ON attendance.activity_id = activities.activity_id
+                 WHERE activities.name = ? ORDER BY year''', (str(name),))
+    rows = np.array(c.fetchall(), dtype=float).reshape((-1, 6))
+
+    close_db(conn, c)
+
+    return rows[:, 0].astype(int), rows[:, 1:4], rows[:, 4].astype(int), rows[:, 5].astype(bool)
+
+
+def get_attendance_matrix(category, db_path):
+    """
+    Returns one category for all the years and activities, as a dense (nbr of years, nbr of activities) array
+    built from one query. The activities are ordered by id, the missing (year, activity) pairs are NaN
+    :param category: 'present', 'excused' or 'absent'
+    :param db_path: the path of the database
+    :return: np.array (nbr of years, ), np.array (nbr of activities, ), np.array (nbr of years, nbr of activities) :
+    the years, the names of the activities and the values
+    """
+    if category not in CATEGORIES:
+        raise ValueError('Unknown category : ' + str(category))
+
+    conn, c = connect_db(db_path)
+
+    c.execute('''SELECT activity_id, name FROM activities ORDER BY activity_id''')
+    activities = c.fetchall()
+
+    c.execute('SELECT year, activity_id, ' + category + ' FROM attendance ORDER BY year')
+    rows = np.array(c.fetchall(), dtype=float).reshape((-1, 3))
+
+    close_db(conn, c)
+
+    ids = np.array([activity[0] for activity in activities], dtype=int)
+    names = np.array([activity[1] for activity in activities], dtype=np.dtype('U50'))
+
+    years, year_index = np.unique(rows[:, 0].astype(int), return_inverse=True)
+    activ_index = np.searchsorted(ids, rows[:, 1].astype(int))
+
+    values = np.full((years.shape[0], ids.shape[0]), np.nan)
+    values[year_index, activ_index] = rows[:, 2]
+
+    return years, names, values
+
+
+# Maximum number of fitted models kept in the models table, the least recently used are evicted
+MAX_CACHED_MODELS = 10
+
+
+def create_models_table(c):
+    """
+    Creates the table of the fitted models if it does not exist
+    :param c: the cursor of the corresponding open connection to the db
+    :return: Nothing
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS models (
+                 key TEXT PRIMARY KEY,
+                 kernel TEXT,
+                 kernel_args nparray,
+                 lambd REAL,
+                 X nparray,
+                 Y nparray,
+                 L nparray,
+                 jitter REAL,
+                 alpha nparray,
+                 last_used REAL,
+                 data_key TEXT
+                    )''')
+
+
+def save_model(model, db_path, max_models=MAX_CACHED_MODELS):
+    """
+    Stores the fitted model (training data, kernel configuration and factorization) in the db, and evicts
+    the least recently used models above max_models
+    :param model: the fitted KRRModel
+    :param db_path: the path of the database
+    :param max_models: the maximum number of models kept
+    :return: str : the key of the model
+    """
+    key = model.fingerprint()
+
+    conn, c = connect_db(db_path)
+    create_models_table(c)
+
+    c.execute('''INSERT OR REPLACE INTO models (key, kernel, kernel_args, lambd, X, Y, L, jitter, alpha, last_used,
+                 data_key) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+              (key, model.kernel_function.__name__, np.asarray(model.kernel_args, dtype=float), model.lambd,
+               model.X, model.Y, model.L, model.jitter, model.alpha, time.time(), data_fingerprint(model.X, model.Y)))
+
+    c.execute('''DELETE FROM models WHERE key NOT IN
+                 (SELECT key FROM models ORDER BY last_used DESC LIMIT ?)''', (max_models,))
+    conn.commit()
+
+    close_db(conn, c)
+
+    return key
+
+
+def load_model(X, Y, kernel_function, *kernel_args, lambd=0, db_path):
+    """
+    Returns the stored model fitted on the given data with the given kernel configuration, if there is one
+    :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+    :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+    :param kernel_function: the kernel function
+    :param kernel_args: the arguments for the kernel function if needed
+    :param lambd: the regularizer influence
+    :param db_path: the path of the database
+    :return: the fitted KRRModel, or None if it is not in the db
+    """
+    model = KRRModel(kernel_function, *kernel_args, lambd=lambd)
+    key = model.fingerprint(X, Y)
+
+    conn, c = connect_db(db_path)
+    create_models_table(c)
+
+    c.execute('''SELECT kernel, X, Y, L, jitter, alpha FROM models WHERE key=?''', (key,))
+    row = c.fetchone()
+
+    if row is not None and KERNELS.get(row[0]) is kernel_function:
+        # Mark the model as recently used
+        c.execute('''UPDATE models SET last_used = ? WHERE key = ?''', (time.time(), key))
+        conn.commit()
+        model.X, model.Y, model.L, model.jitter, model.alpha = row[1:]
+    else:
+        model = None
+
+    close_db(conn, c)
+
+    return model
+
+
+def load_fitted_model(X, Y, db_path):
+    """
+    Returns the most recently used stored model fitted on the given data, whatever its kernel configuration,
+    so that the kernel selected when it was fitted is reused without selecting it again
+    :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+    :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+    :param db_path: the path of the database
+    :return: the fitted KRRModel, or None if there is none in the db
+    """
+    conn, c = connect_db(db_path)
+    create_models_table(c)
+
+    c.execute('''SELECT key, kernel, kernel_args, lambd, X, Y, L, jitter, alpha FROM models WHERE data_key=?
+                 ORDER BY last_used DESC''', (data_fingerprint(X, Y),))
+    model = None
+    for row in c.fetchall():
+        # Only the kernels known by this version
+        if row[1] in KERNELS:
+            model = KRRModel(KERNELS[row[1]], *row[2].tolist(), lambd=row[3])
+            model.X, model.Y, model.L, model.jitter, model.alpha = row[4:]
+
+            # Mark the model as recently used
+            with conn:
+                c.execute('''UPDATE models SET last_used = ? WHERE key = ?''', (time.time(), row[0]))
+            break
+
+    close_db(conn, c)
+
+    return model
+
+
+def get_aligned_records(c):
+    """
+    Builds the records of all the years from the separate and mandatory tables, with one query and one array
+    per quantity. The columns are the activities of the last year : the activities of the other years are matched
+    by name, so that added, removed or reordered activities stay aligned. The activities missing in a year are NaN
+    (False for the mandatory flags)
+    :param c: the cursor of the corresponding open connection to the db
+    :return: np.array (nbr of years), np.array (nbr of years, 3*nbr of activities), np.array (nbr of years),
+    np.array (nbr of years, nbr of activities), np.array (nbr of years, nbr of activities), np.array (nbr of activities) :
+    the years, the records in term of persons, the society sizes, the points, the mandatory flags and the names of the
+    activities, or None if the separate table is empty
+    """
+    c.execute('''SELECT separate.year, data, points, size, mdt, names FROM separate
+                 LEFT JOIN mandatory ON separate.year = mandatory.year ORDER BY separate.year''')
+    rows = c.fetchall()
+
+    if not rows:
+        return None
+
+    nbr_years = len(rows)
+    last_names = rows[-1][5]
+    nbr_activ = rows[-1][2].shape[0]
+    columns = {name: i for i, name in enumerate(last_names)} if last_names is not None else {}
+
+    years = np.empty(nbr_years, dtype=int)
+    data = np.full((nbr_years, 3, nbr_activ), np.nan)
+    sizes = np.empty(nbr_years, dtype=int)
+    points = np.full((nbr_years, nbr_activ), np.nan)
+    mandatory = np.zeros((nbr_years, nbr_activ), dtype=bool)
+
+    for i, (year, record, year_points, size, mdt, names) in enumerate(rows):
+        years[i] = year
+        sizes[i] = size
+        record = np.reshape(record, (3, -1))
+
+        if names is None or last_names is None or np.array_equal(names, last_names):
+            # Same activities as the last year
+            if record.shape[1] != nbr_activ:
+                raise ValueError('The activities of the year ' + str(year) + ' are unknown and differ from the last year')
+            index = slice(None)
+            keep = slice(None)
+        else:
+            # Position of each activity of this year among the activities of the last year, -1 if it does not exist anymore
+            index = np.array([columns.get(name, -1) for name in names], dtype=int)
+            keep = index >= 0
+            index = index[keep]
+
+        data[i][:, index] = record[:, keep]
+        points[i, index] = year_points[keep]
+        if mdt is not None:
+            mandatory[i, index] = mdt[keep]
+
+    return years, data.reshape((nbr_years, -1)), sizes, points, mandatory, last_names
+
+
+def get_cumulative(c):
+    """
+    Builds the cumulative records from the separate table, aligned on the activities of the last year
+    (see get_aligned_records)
+    :param c: the cursor of the corresponding open connection to the db
+    :return: np.array (nbr of years), np.array (nbr of years, 3*nbr of activities), np.array (nbr of years),
+    np.array (nbr of years, nbr of activities) : the years, the records in term of percentage of the society size
+    (NaN where the activity did not exist), the society sizes and the points (NaN where the activity did not exist),
+    or None if the separate table is empty
+    """
+    aligned = get_aligned_records(c)
+    if aligned is None:
+        return None
+
+    years, data, sizes, points, mandatory, names = aligned
+
+    # In term of percentage w.r.t. the size of the society of each year
+    data /= sizes[:, None]
+
+    return years, data, sizes, points
+
+
+def get_aligned_history(db_path, names=None):
+    """
+    Returns the history of the activities from the normalized tables, with one query. The activities are identified
+    by their id (i.e. their name), whatever their position in each year
+    :param db_path: the path of the database
+    :param names: the names of the activities wanted, in this order, by default all the activities in the order of
+    their first appearance
+    :return: np.array (nbr of years), np.array (nbr of activities), np.ma.MaskedArray (nbr of years, 3*nbr of activities),
+    np.ma.MaskedArray (nbr of years, nbr of activities), np.ma.MaskedArray (nbr of years, nbr of activities) :
+    the years, the names of the activities, the records in term of persons, the points and the mandatory flags,
+    masked where the activity did not exist
+    """
+    conn, c = connect_db(db_path)
+
+    c.execute('''SELECT activity_id, name FROM activities ORDER BY activity_id''')
+    ids = {name: activity_id for activity_id, name in c.fetchall()}
+
+    c.execute('''SELECT year, activity_id, present, excused, absent, points, mandatory FROM attendance ORDER BY year''')
+    rows = np.array(c.fetchall(), dtype=float).reshape((-1, 7))
+
+    close_db(conn, c)
+
+    if names is None:
+        names = list(ids)
+    names = np.asarray(names, dtype=np.dtype('U50'))
+
+    # Column of each activity id, -1 for the activities not wanted
+    column_of_id = np.full(max(ids.values(), default=0) + 1, -1)
+    for i, name in enumerate(names):
+        if str(name) in ids:
+            column_of_id[ids[str(name)]] = i
+
+    years, year_index = np.unique(rows[:, 0].astype(int), return_inverse=True)
+    columns = column_of_id[rows[:, 1].astype(int)]
+    keep = columns >= 0
+    year_index = year_index[keep]
+    columns = columns[keep]
+    rows = rows[keep]
+
+    nbr_years = years.shape[0]
+    nbr_activ = names.shape[0]
+
+    data = np.full((nbr_years, 3, nbr_activ), np.nan)
+    points = np.full((nbr_years, nbr_activ), np.nan)
+    mandatory = np.full((nbr_years, nbr_activ), np.nan)
+    for cat in range(3):
+        data[year_index, cat, columns] = rows[:, 2 + cat]
+    points[year_index, columns] = rows[:, 5]
+    mandatory[year_index, columns] = rows[:, 6]
+
+    data = data.reshape((nbr_years, -1))
+
+    return (years, names, np.ma.masked_invalid(data), np.ma.masked_invalid(points),
+            np.ma.masked_array(mandatory == 1, mask=np.isnan(mandatory)))
+
+
+def query_history(db_path, first_year=None, last_year=None, names=None, category=None):
+    """
+    Returns a part of the history with one query on the normalized tables : only the years in [first_year, last_year],
+    only some activities and only one category if wanted
+    :param db_path: the path of the database
+    :param first_year: the first year wanted, by default the first one
+    :param last_year: the last year wanted, by default the last one
+    :param names: the names of the activities wanted, in this order, by default all of them
+    in the order of their first appearance
+    :param category: 'present', 'excused' or 'absent', by default the three
+    :return: np.array (nbr of years), np.array (nbr of activities), np.array (nbr of years, nbr of activities) for one
+    category or (nbr of years, 3*nbr of activities) for the three, in term of persons, NaN where the activity did not
+    exist, and np.array (nbr of years) the society sizes of the years
+    """
+    if category is not None and category not in CATEGORIES:
+        raise ValueError('Unknown category : ' + str(category))
+    categories = CATEGORIES if category is None else (category,)
+
+    first_year = -2**62 if first_year is None else int(first_year)
+    last_year = 2**62 if last_year is None else int(last_year)
+
+    # Activities filter, in the join so that the years without any of the activities are still returned
+    name_filter = ''
+    params = []
+    if names is not None:
+        names = [str(name) for name in names]
+        name_filter = ' AND activities.name IN (' + ', '.join('?' * len(names)) + ')'
+        params += names
+
+    conn, c = connect_db(db_path)
+
+    c.execute('SELECT separate.year, separate.size, activities.name, '
+              + ', '.join('attendance.' + cat for cat in categories)
+              + ' FROM separate LEFT JOIN (attendance JOIN activities ON attendance.activity_id = activities.activity_id'
+              + name_filter + ') ON attendance.year = separate.year'
+              + ' WHERE separate.year BETWEEN ? AND ? ORDER BY separate.year, attendance.activity_id',
+              params + [first_year, last_year])
+    rows = c.fetchall()
+
+    close_db(conn, c)
+
+    if names is None:
+        # dict keeps the order of first appearance
+        names = list(dict.fromkeys(row[2] for row in rows if row[2] is not None))
+    column_of_name = {name: i for i, name in enumerate(names)}
+
+    years, first_rows = np.unique(np.array([row[0] for row in rows], dtype=int), return_index=True)
+    sizes = np.array([rows[i][1] for i in first_rows], dtype=int)
+
+    nbr_years = years.shape[0]
+    nbr_activ = len(names)
+    nbr_cat = len(categories)
+    values = np.full((nbr_years, nbr_cat, nbr_activ), np.nan)
+
+    # Rows with an activity (a year without any of the activities gives one row with NULLs)
+    filled = [row for row in rows if row[2] is not None]
+    if filled:
+        year_index = np.searchsorted(years, np.array([row[0] for row in filled], dtype=int))
+        columns = np.array([column_of_name[row[2]] for row in filled], dtype=int)
+        counts = np.array([row[3:] for row in filled], dtype=float)
+        for cat in range(nbr_cat):
+            values[year_index, cat, columns] = counts[:, cat]
+
+    return years, np.array(names, dtype=np.dtype('U50')), values.reshape((nbr_years, nbr_cat * nbr_activ)), sizes
+
+
+def get_society_sizes(db_path, first_year=None, last_year=None):
+    """
+    Returns the society sizes of the years in [first_year, last_year]
+    :param db_path: the path of the database
+    :param first_year: the first year wanted, by default the first one
+    :param last_year: the last year wanted, by default the last one
+    :return: np.array (nbr of years), np.array (nbr of years) : the years and the society sizes
+    """
+    first_year = -2**62 if first_year is None else int(first_year)
+    last_year = 2**62 if last_year is None else int(last_year)
+
+    conn, c = connect_db(db_path)
+
+    c.execute('''SELECT year, size FROM separate WHERE year BETWEEN ? AND ? ORDER BY year''', (first_year, last_year))
+    rows = np.array(c.fetchall(), dtype=int).reshape((-1, 2))
+
+    close_db(conn, c)
+
+    return rows[:, 0], rows[:, 1]
 
 
 def get_last_cumulative(db_path):
     """
-    Returns the last entry in the cumulative table in the specified db
+    Returns the cumulative records of all the years in the specified db
     :param db_path: the location of the db
-    :return: int, np.array, array, np.array : the last year, the last cumulative entry or None if the cumulative table is empty
+    :return: int, np.array, array, np.array : the last year, the cumulative entry (nbr of years, 3*nbr of activities),
+    the society sizes (list of 1-tuples, one per year) and the points (nbr of years, nbr of activities)
     """
     conn, c = connect_db(db_path)
 
-    # Query the last cumulative entry in the table cumulative
-    c.execute('''SELECT * FROM cumulative ORDER BY year DESC LIMIT 1''')
-    last_year, last_entry, last_points = c.fetchone()
-
-    # Query the society sizes in the separate table
-    c.execute('''SELECT size FROM separate''')
-    society_size = c.fetchall()
+    years, data, sizes, points = get_cumulative(c)
 
     close_db(conn, c)
 
-    return last_year, last_entry, society_size, last_points
+    return int(years[-1]), data, [(int(size),) for size in sizes], points
 
 
 def get_last_separate(db_path):
@@ -363,6 +1572,120 @@ def get_last_mandatory_and_names_from_db(db_path):
     return last_year, last_entry, last_names
 
 
+# Version of the layout of the archives written by export_archive
+ARCHIVE_VERSION = 1
+ARCHIVE_COLUMNS = ('years', 'data', 'points', 'sizes', 'mandatory', 'names')
+
+
+def _check_archive_directory(directory):
+    """
+    Checks that a directory can be replaced by an archive : it does not exist, is empty or is an archive
+    :param directory: the directory
+    :return: Nothing, raises ValueError if the directory contains something else than an archive
+    """
+    if os.path.exists(directory) and os.listdir(directory) and \
+            not os.path.isfile(os.path.join(directory, 'manifest.json')):
+        raise ValueError('The directory is not an archive, it is not overwritten : ' + directory)
+
+
+def export_archive(db_path, directory):
+    """
+    Exports the full history in a directory of .npy column files and a manifest (manifest.json), which can be
+    memory-mapped by load_archive without going through the db. The new archive is written aside, then renamed
+    in place of the previous one, which is only deleted after. Only a previous archive (or an empty directory)
+    is replaced
+    :param db_path: the path of the database
+    :param directory: the directory of the archive
+    :return: dict : the manifest
+    """
+    conn, c = connect_db(db_path)
+
+    years, data, sizes, points, mandatory, names = get_aligned_records(c)
+
+    close_db(conn, c)
+
+    columns = {
+        'years': years,
+        # In term of persons, as in the separate table, NaN where the activity did not exist
+        'data': data,
+        'points': points,
+        'sizes': sizes,
+        'mandatory': mandatory,
+        'names': np.asarray(names),
+    }
+
+    manifest = {
+        'version': ARCHIVE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'columns': {name: {'file': name + '.npy', 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+                    for name, arr in columns.items()},
+    }
+
+    directory = os.path.abspath(directory)
+    tmp_directory = directory + '.tmp'
+    old_directory = directory + '.old'
+    for path in (directory, tmp_directory, old_directory):
+        _check_archive_directory(path)
+
+    # Write everything in a temporary directory. The manifest comes first, so that a temporary directory
+    # left by an interrupted export is recognized as an archive and can be removed
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+    with open(os.path.join(tmp_directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    for name, arr in columns.items():
+        np.save(os.path.join(tmp_directory, name + '.npy'), np.ascontiguousarray(arr))
+
+    # Move the previous archive aside, put the new one in place, and only then delete the previous one.
+    # If the process stops in between, load_archive still finds the previous archive
+    if os.path.exists(old_directory):
+        shutil.rmtree(old_directory)
+    if os.path.exists(directory):
+        os.replace(directory, old_directory)
+    os.replace(tmp_directory, directory)
+    if os.path.exists(old_directory):
+        shutil.rmtree(old_directory)
+
+    return manifest
+
+
+def load_archive(directory):
+    """
+    Loads an archive written by export_archive, the columns are memory-mapped (read only) so nothing is read until used
+    :param directory: the directory of the archive
+    :return: dict column name -> np.array : 'years' (nbr of years), 'data' (nbr of years, 3*nbr of activities) in term
+    of persons, 'points' (nbr of years, nbr of activities), 'sizes' (nbr of years), 'mandatory' (nbr of years,
+    nbr of activities) and 'names' (nbr of activities)
+    """
+    # Export interrupted after the previous archive was moved aside
+    if not os.path.exists(directory) and os.path.exists(directory.rstrip(os.sep) + '.old'):
+        directory = directory.rstrip(os.sep) + '.old'
+
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    if manifest['version'] != ARCHIVE_VERSION:
+        raise ValueError('Unknown version of the archive : ' + str(manifest['version']))
+
+    return {name: np.load(os.path.join(directory, column['file']), mmap_mode='r')
+            for name, column in manifest['columns'].items()}
+
+
+def get_last_cumulative_from_archive(directory):
+    """
+    Same as get_last_cumulative, from an archive written by export_archive
+    :param directory: the directory of the archive
+    :return: int, np.array, array, np.array : the last year, the cumulative entry (nbr of years, 3*nbr of activities),
+    the society sizes (list of 1-tuples, one per year) and the points (nbr of years, nbr of activities)
+    """
+    archive = load_archive(directory)
+
+    data = archive['data'] / archive['sizes'][:, None]
+
+    return int(archive['years'][-1]), data, [(int(size),) for size in archive['sizes']], archive['points']
+
+
 #data = read_data("/home/cpittet/jeunesse_app/presence.xlsx", 22)
 # print(data)
 # print(data.shape)
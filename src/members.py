@@ -0,0 +1,161 @@
+import numpy as np
+
+"""
+Attendance of each member of the society to each activity of a year, stored as two bit-packed matrices
+(nbr of members, nbr of activities) : one bitplane for the present members, one for the excused members.
+A member neither present nor excused is non present. Each bitplane takes nbr of members * nbr of activities / 8 bytes,
+e.g. 5 KB for 500 members and 80 activities.
+"""
+
+
+def pack_attendance(present, excused):
+    """
+    Packs the attendance matrices into bitplanes
+    :param present: np.array (nbr of members, nbr of activities) of bool : True if the member was present
+    :param excused: np.array (nbr of members, nbr of activities) of bool : True if the member was excused
+    :return: np.array (nbr of members, ceil(nbr of activities / 8)) of uint8, the same for excused
+    """
+    present = np.asarray(present, dtype=bool)
+    excused = np.asarray(excused, dtype=bool)
+    if np.any(present & excused):
+        raise ValueError('A member can not be both present and excused to an activity')
+    return np.packbits(present, axis=1), np.packbits(excused, axis=1)
+
+
+def unpack_bits(bits, nbr_activ):
+    """
+    Unpacks a bitplane
+    :param bits: np.array (nbr of members, ceil(nbr of activities / 8)) of uint8 : the bitplane
+    :param nbr_activ: the number of activities
+    :return: np.array (nbr of members, nbr of activities) of bool
+    """
+    return np.unpackbits(bits, axis=1, count=nbr_activ).view(bool)
+
+
+def member_points(present_bits, nbr_activ, points):
+    """
+    Computes the total of points of each member, i.e. the points of the activities the member was present to
+    :param present_bits: the bitplane of the present members
+    :param nbr_activ: the number of activities
+    :param points: np.array (nbr of activities, ) : the points attributed to each activity
+    :return: np.array (nbr of members, )
+    """
+    return unpack_bits(present_bits, nbr_activ).astype(np.int64) @ np.asarray(points, dtype=np.int64)
+
+
+def align_activities(activities, names):
+    """
+    Matches activities by name (the identity of an activity, as in file_manager.get_activity_ids)
+    :param activities: the names of the activities of the attendance of the members
+    :param names: the names of the activities to find among them
+    :return: np.array (len(names), ) of int : the position of each activity of names in activities, -1 if it is not there
+    """
+    index = {str(name): i for i, name in enumerate(activities)}
+    return np.array([index.get(str(name), -1) for name in names], dtype=int)
+
+
+def aggregate_record(present_bits, excused_bits, nbr_activ):
+    """
+    Computes the number of present, excused and non present members for each activity, as returned by
+    file_manager.read_data
+    :param present_bits: the bitplane of the present members
+    :param excused_bits: the bitplane of the excused members
+    :param nbr_activ: the number of activities
+    :return: np.array (1, 3*nbr of activities)
+    """
+    nbr_members = present_bits.shape[0]
+    present = unpack_bits(present_bits, nbr_activ).sum(axis=0)
+    excused = unpack_bits(excused_bits, nbr_activ).sum(axis=0)
+
+    return np.concatenate((present, excused, nbr_members - present - excused)).reshape((1, -1)).astype(float)
+
+
+def derive_record(record, names, activities, present_bits, excused_bits):
+    """
+    Derives the counts of a record from the attendance of the members : the counts of the activities of the record
+    which are in the attendance (matched by name) are replaced by the counts of the bitplanes
+    :param record: np.array (1, 3*nbr of activities) : the record, as returned by file_manager.read_data
+    :param names: the names of the activities of the record
+    :param activities: the names of the activities of the attendance of the members
+    :param present_bits: the bitplane of the present members
+    :param excused_bits: the bitplane of the excused members
+    :return: np.array (1, 3*nbr of activities) : the new record
+    """
+    counts = aggregate_record(present_bits, excused_bits, len(activities)).reshape((3, -1))
+    index = align_activities(activities, names)
+    found = index >= 0
+
+    record = np.array(record, dtype=float).reshape((3, -1))
+    record[:, found] = counts[:, index[found]]
+    return record.reshape((1, -1))
+
+
+class Leaderboard:
+    """
+    Members of one year sorted by decreasing total of points, to answer the top-k, threshold and rank queries
+    with slices and binary searches instead of recomputing and sorting the totals
+    """
+
+    def __init__(self, members, totals, order=None):
+        """
+        :param members: np.array (nbr of members, ) : the names of the members
+        :param totals: np.array (nbr of members, ) : the total of points of each member
+        :param order: np.array (nbr of members, ) : the indexes of the members by decreasing total, computed if None
+        """
+        self.members = np.asarray(members)
+        self.totals = np.asarray(totals)
+        if order is None:
+            order = np.argsort(-self.totals, kind='stable')
+        self.order = np.asarray(order)
+
+        # Negated so that the sorted totals are increasing, as needed by np.searchsorted
+        self.neg_sorted_totals = -self.totals[self.order]
+        self.index = {name: i for i, name in enumerate(self.members)}
+
+    def top(self, k):
+        """
+        Returns the k members with the most points
+        :param k: the number of members
+        :return: np.array (k, ), np.array (k, ) : the names and totals, by decreasing total
+        """
+        return self.members[self.order[:k]], -self.neg_sorted_totals[:k]
+
+    def below(self, threshold):
+        """
+        Returns the members with strictly less points than the threshold
+        :param threshold: the minimum of points
+        :return: np.array, np.array : the names and totals, by decreasing total
+        """
+        start = np.searchsorted(self.neg_sorted_totals, -threshold, side='right')
+        return self.members[self.order[start:]], -self.neg_sorted_totals[start:]
+
+    def rank(self, member):
+        """
+        Returns the rank of the member, 1 for the most points (the members with the same total have the same rank)
+        :param member: the name of the member
+        :return: int
+        """
+        total = self.totals[self.index[member]]
+        return int(np.searchsorted(self.neg_sorted_totals, -total, side='left')) + 1
+
+    def update(self, member, total):
+        """
+        Changes the total of one member, and moves the member in the sorted index, in O(nbr of members). The members
+        with the same total stay in the order of their indexes, as in the sorted index computed from scratch
+        :param member: the name of the member
+        :param total: the new total of points
+        :return: Nothing
+        """
+        i = self.index[member]
+        position = np.flatnonzero(self.order == i)[0]
+        order = np.delete(self.order, position)
+        neg_sorted_totals = np.delete(self.neg_sorted_totals, position)
+
+        start = np.searchsorted(neg_sorted_totals, -total, side='left')
+        end = np.searchsorted(neg_sorted_totals, -total, side='right')
+        new_position = start + np.searchsorted(order[start:end], i)
+        self.order = np.insert(order, new_position, i)
+        self.neg_sorted_totals = np.insert(neg_sorted_totals, new_position, -total)
+
+        self.totals = self.totals.copy()
+        self.totals[i] = total
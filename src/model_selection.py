@@ -0,0 +1,138 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from points_system.KRR import linear_kernel, polynomial_kernel, rbf_kernel, matrix_kernel
+
+"""
+Selection of the hyperparameters of the kernel ridge regression (regularizer lambda, sigma of the RBF kernel,
+degree of the polynomial kernel) by leave-one-out cross validation.
+For a fixed kernel, K = V diag(w) V^T is decomposed once. The hat matrix for any lambda is then
+H = V diag(w / (w + lambda)) V^T and the leave-one-out residuals have the closed form (Y - H Y) / (1 - diag(H)),
+so no refit is needed, neither per lambda nor per left out year.
+"""
+
+DEFAULT_LAMBDAS = (1e-4, 1e-3, 1e-2, 1e-1, 1., 10.)
+DEFAULT_SIGMAS = (0.5, 1., 2., 5., 10., 20.)
+DEFAULT_DEGREES = (2, 3)
+
+
+def kernel_grid(sigmas=DEFAULT_SIGMAS, degrees=DEFAULT_DEGREES):
+    """
+    Lists the kernel configurations to evaluate
+    :param sigmas: the sigma values of the RBF kernel
+    :param degrees: the degrees of the polynomial kernel
+    :return: list of (kernel function, tuple of kernel arguments)
+    """
+    grid = [(linear_kernel, ())]
+    grid += [(polynomial_kernel, (d,)) for d in degrees]
+    grid += [(rbf_kernel, (sigma,)) for sigma in sigmas]
+    return grid
+
+
+def loo_errors(K, Y, lambdas):
+    """
+    Computes the leave-one-out mean squared error for each lambda from one eigendecomposition of K
+    :param K: np.array (nbr of years, nbr of years) : the kernel matrix
+    :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+    :param lambdas: the regularizer values to evaluate
+    :return: np.array (nbr of lambdas, ) : the LOO mean squared error, inf where it is not defined
+    """
+    w, V = np.linalg.eigh(K)
+    # K is positive semi definite, negative eigenvalues are only rounding errors
+    w = np.maximum(w, 0.)
+    VtY = V.T @ Y
+
+    errors = np.full(len(lambdas), np.inf)
+    for i, lambd in enumerate(lambdas):
+        shrink = w / (w + lambd)
+        residuals = Y - V @ (shrink[:, None] * VtY)
+        diag_H = (V**2) @ shrink
+
+        # With no regularization the hat matrix can be the identity, the LOO residual is then undefined
+        denom = 1. - diag_H
+        if np.any(denom <= 1e-12):
+            continue
+        errors[i] = np.mean((residuals / denom[:, None])**2)
+    return errors
+
+
+def _evaluate_kernel(X, Y, kernel_function, kernel_args, lambdas):
+    """
+    Evaluates all the lambdas for one kernel configuration, executed in a worker process
+    :return: np.array (nbr of lambdas, ) : the LOO mean squared errors
+    """
+    K = matrix_kernel(X, kernel_function, *kernel_args)
+    return loo_errors(K, Y, lambdas)
+
+
+def _best_configuration(grid, lambdas, all_errors):
+    """
+    Gathers the LOO errors of the full grid and picks the best configuration
+    :param grid: list of (kernel function, tuple of kernel arguments)
+    :param lambdas: the regularizer values evaluated
+    :param all_errors: list of np.array (nbr of lambdas, ), one per kernel configuration
+    :return: dict as returned by select_hyperparameters
+    """
+    results = []
+    for (kernel_function, kernel_args), errors in zip(grid, all_errors):
+        for lambd, error in zip(lambdas, errors):
+            results.append((kernel_function, kernel_args, lambd, error))
+
+    best = min(results, key=lambda result: result[3])
+
+    return {'kernel_function': best[0], 'kernel_args': best[1], 'lambd': best[2], 'loo_error': best[3],
+            'results': results}
+
+
+def select_hyperparameters(X, Y, lambdas=DEFAULT_LAMBDAS, sigmas=DEFAULT_SIGMAS, degrees=DEFAULT_DEGREES,
+                           max_workers=None):
+    """
+    Finds the kernel, kernel arguments and lambda with the smallest leave-one-out error.
+    The kernel configurations are evaluated in parallel on a process pool
+    :param X: np.array (nbr of years, nbr of activities + 1) : the input data
+    :param Y: np.array (nbr of years, nbr of activities) : the ground truth outputs of the training data
+    :param lambdas: the regularizer values to evaluate
+    :param sigmas: the sigma values of the RBF kernel
+    :param degrees: the degrees of the polynomial kernel
+    :param max_workers: the number of worker processes, by default the number of processors
+    :return: dict with the keys 'kernel_function', 'kernel_args', 'lambd' and 'loo_error' for the best configuration,
+    and 'results' with the list of (kernel function, kernel arguments, lambda, LOO error) for the full grid
+    """
+    return select_hyperparameters_per_society({None: (X, Y)}, lambdas, sigmas, degrees, max_workers)[None]
+
+
+def select_hyperparameters_per_society(societies, lambdas=DEFAULT_LAMBDAS, sigmas=DEFAULT_SIGMAS,
+                                       degrees=DEFAULT_DEGREES, max_workers=None):
+    """
+    Runs the hyperparameter selection for each society, all the (society, kernel configuration) pairs
+    share the same process pool
+    :param societies: dict society name -> (X, Y) training data of the society
+    :param lambdas: the regularizer values to evaluate
+    :param sigmas: the sigma values of the RBF kernel
+    :param degrees: the degrees of the polynomial kernel
+    :param max_workers: the number of worker processes, by default the number of processors
+    :return: dict society name -> best configuration, as returned by select_hyperparameters
+    """
+    grid = kernel_grid(sigmas, degrees)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: [executor.submit(_evaluate_kernel, X, Y, kernel_function, kernel_args, lambdas)
+                          for kernel_function, kernel_args in grid]
+                   for name, (X, Y) in societies.items()}
+
+        return {name: _best_configuration(grid, lambdas, [future.result() for future in society_futures])
+                for name, society_futures in futures.items()}
+
+
+def report(best_per_society):
+    """
+    Formats the best configuration of each society
+    :param best_per_society: dict as returned by select_hyperparameters_per_society
+    :return: str : one line per society
+    """
+    lines = []
+    for name, best in best_per_society.items():
+        args = ', '.join(str(arg) for arg in best['kernel_args'])
+        lines.append('{} : {}({}), lambda = {:g}, LOO error = {:.4g}'.format(
+            name, best['kernel_function'].__name__, args, best['lambd'], best['loo_error']))
+    return '\n'.join(lines)
@@ -0,0 +1,193 @@
+import numpy as np
+
+from points_system.KRR import linear_kernel, polynomial_kernel
+
+"""
+Allocation of the points to the activities with the fitted kernel ridge regression model (see KRR.KRRModel).
+Given a total points budget, lower and upper bounds on the points of each activity and a target presence for the
+mandatory activities, we look for the allocation that maximizes the average predicted presence.
+The feasible set {lower <= p <= upper, sum(p) = budget} is handled by projection, the targets of the mandatory
+activities by a quadratic penalty.
+"""
+
+
+def project_budget(v, budget, lower, upper, tol=1e-9, max_iter=100):
+    """
+    Projects v on the set {lower <= p <= upper, sum(p) = budget}, by bisection on the shift t of p = clip(v - t)
+    :param v: np.array (nbr of activities, ) : the point to project
+    :param budget: the total number of points
+    :param lower: np.array (nbr of activities, ) : the minimum points of each activity
+    :param upper: np.array (nbr of activities, ) : the maximum points of each activity
+    :return: np.array (nbr of activities, ) : the projection
+    """
+    t_low = np.min(v - upper)
+    t_high = np.max(v - lower)
+    for i in range(max_iter):
+        t = 0.5 * (t_low + t_high)
+        total = np.clip(v - t, lower, upper).sum()
+        if abs(total - budget) <= tol:
+            break
+        if total > budget:
+            t_low = t
+        else:
+            t_high = t
+    return np.clip(v - t, lower, upper)
+
+
+def round_allocation(p, budget, lower, upper):
+    """
+    Rounds the allocation to integer points while keeping the budget, the largest fractional parts are rounded up
+    :param p: np.array (nbr of activities, ) : the allocation
+    :param budget: the total number of points (integer)
+    :param lower: np.array (nbr of activities, ) : the minimum points of each activity
+    :param upper: np.array (nbr of activities, ) : the maximum points of each activity
+    :return: np.array (nbr of activities, ) of int
+    """
+    rounded = np.floor(p)
+    missing = int(round(budget - rounded.sum()))
+    # Activities that can still receive one point, by decreasing fractional part
+    order = np.argsort(-(p - rounded))
+    order = order[rounded[order] + 1 <= upper[order]]
+    rounded[order[:missing]] += 1
+    return np.clip(rounded, np.ceil(lower), np.floor(upper)).astype(int)
+
+
+def _jacobian(model, x):
+    """
+    Analytic jacobian of the predictions of the model w.r.t. the points, for the linear and polynomial kernels
+    :param model: the fitted KRR.KRRModel
+    :param x: np.array (nbr of activities + 1, ) : the input, with the bias term
+    :return: np.array (nbr of activities, nbr of activities) : J[i, j] = d prediction_i / d points_j
+    """
+    X = model.X
+    if model.kernel_function is linear_kernel:
+        # k(X, x) = X x
+        dk = X
+    else:
+        # k(X, x) = (X x + 1)^d
+        d = model.kernel_args[0] if model.kernel_args else 2
+        dk = (d * (X @ x + 1)**(d - 1))[:, None] * X
+    # The last column corresponds to the bias, which is not a variable
+    return model.alpha.T @ dk[:, :-1]
+
+
+def _objective(predictions, mdt_list, target, penalty):
+    """
+    Average predicted presence minus the penalty for the mandatory activities under the target
+    :param predictions: np.array (nbr of activities, nbr of candidates) : the predictions
+    :return: np.array (nbr of candidates, )
+    """
+    shortfall = np.maximum(target - predictions[mdt_list], 0.)
+    return predictions.mean(axis=0) - penalty * (shortfall**2).sum(axis=0)
+
+
+def _gradient_ascent(model, p, budget, lower, upper, mdt_list, target, penalty, nbr_iter):
+    """
+    Projected gradient ascent with backtracking, for the kernels with an analytic gradient
+    :return: np.array (nbr of activities, ) : the allocation
+    """
+    nbr_activ = p.shape[0]
+    step = max(budget, 1.) / nbr_activ
+    x = np.append(p, 1.)
+    value = _objective(model.predict(x), mdt_list, target, penalty)[0]
+
+    for i in range(nbr_iter):
+        predictions = model.predict(x)[:, 0]
+        J = _jacobian(model, x)
+
+        # Gradient of the objective
+        weights = np.full(nbr_activ, 1. / nbr_activ)
+        weights[mdt_list] += 2. * penalty * np.maximum(target - predictions[mdt_list], 0.)
+        grad = weights @ J
+
+        # Backtracking on the step size
+        while step > 1e-6:
+            p_new = project_budget(p + step * grad, budget, lower, upper)
+            x_new = np.append(p_new, 1.)
+            value_new = _objective(model.predict(x_new), mdt_list, target, penalty)[0]
+            if value_new > value:
+                break
+            step /= 2.
+        else:
+            break
+
+        converged = np.abs(p_new - p).max() < 1e-4
+        p, x, value = p_new, x_new, value_new
+        step *= 2.
+        if converged:
+            break
+    return p
+
+
+def _batched_search(model, p, budget, lower, upper, mdt_list, target, penalty, nbr_iter):
+    """
+    Local search by transfers of points between two activities, all the transfers of one iteration
+    are evaluated in a single batched prediction. Used for the kernels without an analytic gradient (e.g. RBF)
+    :return: np.array (nbr of activities, ) : the allocation
+    """
+    nbr_activ = p.shape[0]
+    step = max(budget, 1.) / nbr_activ
+    value = _objective(model.predict(np.append(p, 1.)), mdt_list, target, penalty)[0]
+    src, dst = np.nonzero(~np.eye(nbr_activ, dtype=bool))
+
+    for i in range(nbr_iter):
+        # Candidate (i -> j) transfers of step points, limited by the bounds
+        amount = np.minimum(np.minimum(p[src] - lower[src], upper[dst] - p[dst]), step)
+        candidates = np.repeat(p[None, :], src.shape[0], axis=0)
+        rows = np.arange(src.shape[0])
+        candidates[rows, src] -= amount
+        candidates[rows, dst] += amount
+
+        X_candidates = np.concatenate((candidates, np.ones((src.shape[0], 1))), axis=1)
+        values = _objective(model.predict_batch(X_candidates), mdt_list, target, penalty)
+
+        best = np.argmax(values)
+        if values[best] > value and amount[best] > 0:
+            p, value = candidates[best], values[best]
+        elif step > 1e-2:
+            step /= 2.
+        else:
+            break
+    return p
+
+
+def optimize_allocation(model, budget, lower=None, upper=None, mdt_list=None, target=0., penalty=100.,
+                        nbr_iter=200, integer=True):
+    """
+    Finds the points allocation that maximizes the average predicted presence
+    :param model: the fitted KRR.KRRModel
+    :param budget: the total number of points to attribute
+    :param lower: np.array (nbr of activities, ) : the minimum points of each activity, by default 0
+    :param upper: np.array (nbr of activities, ) : the maximum points of each activity, by default the budget
+    :param mdt_list: np.array (nbr of activities, ) : True if the activity is mandatory, by default none is
+    :param target: the minimum predicted presence (same unit as the training outputs) for the mandatory activities
+    :param penalty: the weight of the penalty for mandatory activities under the target
+    :param nbr_iter: the maximum number of iterations
+    :param integer: whether to round the allocation to integer points
+    :return: np.array (nbr of activities, ), np.array (nbr of activities, 1), bool : the allocation,
+    its predictions and whether all the mandatory activities reach the target
+    """
+    nbr_activ = model.X.shape[1] - 1
+
+    lower = np.zeros(nbr_activ) if lower is None else np.asarray(lower, dtype=float)
+    upper = np.full(nbr_activ, float(budget)) if upper is None else np.asarray(upper, dtype=float)
+    mdt_list = np.zeros(nbr_activ, dtype=bool) if mdt_list is None else np.asarray(mdt_list, dtype=bool)
+
+    if lower.sum() > budget or upper.sum() < budget:
+        raise ValueError('The budget is not reachable with the given bounds')
+
+    # Start from the uniform allocation
+    p = project_budget(np.full(nbr_activ, budget / nbr_activ), budget, lower, upper)
+
+    if model.kernel_function is linear_kernel or model.kernel_function is polynomial_kernel:
+        p = _gradient_ascent(model, p, budget, lower, upper, mdt_list, target, penalty, nbr_iter)
+    else:
+        p = _batched_search(model, p, budget, lower, upper, mdt_list, target, penalty, nbr_iter)
+
+    if integer:
+        p = round_allocation(p, budget, lower, upper)
+
+    predictions = model.predict(np.append(p, 1.))
+    reached = bool(np.all(predictions[mdt_list, 0] >= target))
+
+    return p, predictions, reached
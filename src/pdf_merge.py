@@ -0,0 +1,135 @@
+import re
+
+"""
+Merges single page pdf files, as written by the pdf backend of matplotlib (Figure.savefig(..., format='pdf')), into one
+pdf with the pages in the given order. Only this kind of pdf is supported : a classic cross-reference table, no object
+streams and no incremental updates. The objects of each page are copied as they are and renumbered, the streams
+(drawings, fonts) are never decoded. The same pages always give the same file.
+"""
+
+HEADER = b'%PDF-1.4\n%\xac\xdc \xab\xba\n'
+OBJECT_HEADER = re.compile(rb'(\d+) 0 obj\s')
+# Indirect reference "N 0 R", not preceded by a name or a number
+REFERENCE = re.compile(rb'(?<![\w/.])(\d+) 0 R(?!\w)')
+STREAM = b'\nstream\n'
+
+
+def _string(value):
+    """
+    Encodes a text as a pdf string (UTF-16 with byte order mark, in hexadecimal)
+    :param value: str
+    :return: bytes
+    """
+    return b'<FEFF' + value.encode('utf-16-be').hex().upper().encode() + b'>'
+
+
+def read_objects(pdf):
+    """
+    Reads the objects of a pdf from its cross-reference table
+    :param pdf: bytes : the content of the pdf
+    :return: dict object number -> bytes (the object between "N 0 obj" and "endobj"), and the trailer (bytes)
+    """
+    start = int(pdf[pdf.rindex(b'startxref') + len(b'startxref'):].split()[0])
+    if not pdf.startswith(b'xref', start):
+        raise ValueError('Unsupported pdf : no cross-reference table')
+
+    lines = pdf[start:pdf.index(b'trailer', start)].split(b'\n')
+    first, count = (int(v) for v in lines[1].split())
+    offsets = {}
+    for i, entry in enumerate(lines[2:2 + count]):
+        offset, generation, kind = entry.split()
+        if kind == b'n':
+            offsets[first + i] = int(offset)
+
+    # The objects follow each other, an object ends where the next one starts
+    ends = sorted(offsets.values()) + [start]
+    objects = {}
+    for number, offset in offsets.items():
+        match = OBJECT_HEADER.match(pdf, offset)
+        if match is None or int(match.group(1)) != number:
+            raise ValueError('Unsupported pdf : object ' + str(number) + ' is not at its offset')
+        end = ends[ends.index(offset) + 1]
+        body = pdf[match.end():end].rstrip()
+        if not body.endswith(b'endobj'):
+            raise ValueError('Unsupported pdf : object ' + str(number) + ' does not end with endobj')
+        objects[number] = body[:-len(b'endobj')]
+
+    return objects, pdf[pdf.index(b'trailer', start):]
+
+
+def _reference(trailer_or_dict, key):
+    """
+    Returns the object number of the reference stored under a key of a dictionary
+    :param trailer_or_dict: bytes : the dictionary
+    :param key: bytes : the key, with its slash
+    :return: int
+    """
+    return int(re.search(re.escape(key) + rb'\s+(\d+) 0 R', trailer_or_dict).group(1))
+
+
+def _renumber(body, numbers):
+    """
+    Renumbers the references of an object, the stream (if any) is left untouched
+    :param body: bytes : the object
+    :param numbers: dict old object number -> new object number
+    :return: bytes
+    """
+    split = body.find(STREAM)
+    head, stream = (body, b'') if split < 0 else (body[:split], body[split:])
+    return REFERENCE.sub(lambda m: str(numbers[int(m.group(1))]).encode() + b' 0 R', head) + stream
+
+
+def merge_pages(pages, metadata=None):
+    """
+    Merges single page pdfs into one pdf
+    :param pages: list of bytes : the pdfs, in the order of the pages
+    :param metadata: dict str -> str : entries added to the document information (e.g. 'Subject')
+    :return: bytes : the merged pdf
+    """
+    # 1 : catalog, 2 : page tree, 3 : document information, then the objects of each page
+    objects = []
+    kids = []
+    info = b'<< '
+    for i, pdf in enumerate(pages):
+        page_objects, trailer = read_objects(pdf)
+        root = _reference(trailer, b'/Root')
+        tree = _reference(page_objects[root], b'/Pages')
+        kid = _reference(page_objects[tree], b'/Kids [')
+        # The creator and producer of the first page
+        skipped = {root, tree}
+        if b'/Info' in trailer:
+            skipped.add(_reference(trailer, b'/Info'))
+            if i == 0:
+                info += page_objects[_reference(trailer, b'/Info')].strip()[2:-2].strip() + b'\n'
+
+        numbers = {tree: 2}
+        for number in sorted(page_objects):
+            if number not in skipped:
+                numbers[number] = 4 + len(objects) + len(numbers) - 1
+        for number in sorted(page_objects):
+            if number not in skipped:
+                objects.append(_renumber(page_objects[number], numbers))
+        kids.append(numbers[kid])
+
+    for key, value in (metadata or {}).items():
+        info += b'/' + key.encode('ascii') + b' ' + _string(value) + b'\n'
+    info += b'>>\n'
+
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>\n',
+               b'<< /Type /Pages /Kids [ ' + b' '.join(str(k).encode() + b' 0 R' for k in kids) + b' ] /Count ' +
+               str(len(kids)).encode() + b' >>\n', info] + objects
+
+    out = bytearray(HEADER)
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += str(number).encode() + b' 0 obj\n' + body.strip(b'\n') + b'\nendobj\n'
+
+    start = len(out)
+    out += b'xref\n0 ' + str(len(objects) + 1).encode() + b'\n0000000000 65535 f \n'
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += (b'trailer\n<< /Size ' + str(len(objects) + 1).encode() + b' /Root 1 0 R /Info 3 0 R >>\nstartxref\n' +
+            str(start).encode() + b'\n%%EOF\n')
+
+    return bytes(out)
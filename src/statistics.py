@@ -1,172 +1,346 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+import matplotlib
+from matplotlib.figure import Figure
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
 import os
 
-
-def average(data, society_size):
-    """
-    Average the data
-    :param data: np.array (nbr of activities x 1): the data (number of people of a category (present, excused, non present)
-    at each activity) to average
-    :param society_size: the current size of the society
-    :return: the average (as percent)
-    """
-    return (1.0 / data.shape[0] * data.sum()) / society_size
-
-
-def create_pdf(data, mandatory_list, last_year, names_list, society_size, path):
+# Personal modules
+from points_system.summary import compute_summary
+from points_system.trends import compute_trends, alerts
+from points_system.pdf_merge import merge_pages
+
+"""
+The pdf report has one page per category (present, excused, non present) with the evolution of each activity,
+one page with the averages of the last year and one page with the trends (see trends.compute_trends).
+Each page is drawn on its own Figure (no pyplot global state) and saved as a single page vector pdf, the pages are
+then merged in their order (see pdf_merge.merge_pages). With several processors and many activities, the pages are
+drawn and saved in worker processes.
+The pages can be cached on disk, keyed by the hash of what they show (see page_key) : after a correction of the last
+year or of one category only the pages that changed are drawn again.
+The pdfs have no creation date, so the same data always gives the same file.
+"""
+
+# Set A4 portait (in inches...)
+PAGE_SIZE = (11.93, 15.98)
+CATEGORIES = ["présentes", "excusées", "non excusées"]
+
+# Drawing the pages in worker processes only pays off from this number of activities, below the
+# start of the workers (which import matplotlib) costs more than it saves
+PARALLEL_MIN_ACTIVITIES = 40
+
+# Maximum number of pages kept in the cache directory, the least recently used are removed
+MAX_CACHED_PAGES = 50
+# To change when the drawing of the pages changes, so that the cached pages are not reused
+REPORT_VERSION = 1
+
+
+def _activities_figure(data, cat, mandatory_list, last_year, names_list, society_size):
     """
-    Creates a pdf with the evolution graphs for each activity and each category (present, excused, non present),
-    add to this pdf:
-        - the average (of the current year) of present people at mandatory activities
-        - the average (of the current year) of excused people at mandatory activities
-        - the average (of the current year) of non present people at mandatory activities
-        - the average (of the current year) of present people at non mandatory activities
-        - the average (of the current year) of excused people at non mandatory activities
-        - the average (of the current year) of non present people overall
-        - the average (of the current year) of excused people overall
-        - the average (of the current year) of non present people overall
-    :param data: np.array (nbr of years x 3*nbr of activities) : the full (three category) data
-    :param mandatory_list: the list of the activities that are mandatory or not
-    (work by the index of the activity)
-    :param last_year: the last year of the data
-    :param names_list: the names of the activities
-    :param society_size: the current size of the society
-    :param path: the location where to save the pdf (only folder path, the name of the file is automatic)
-    :return: the path where the file was saved
+    Draws the page with the evolution graphs of each activity for one category
+    :param data: np.array (nbr of years x nbr of activities) : the data of the category
+    :param cat: the index of the category (present, excused, non present)
+    :return: the matplotlib Figure
     """
     # Number of activities
-    nbr_activ = data.shape[1] // 3
-    path_pdf = os.path.join(str(path), 'Jeunesse_statistiques_' + str(last_year) +'.pdf')
-    with PdfPages(path_pdf) as pdf:
-
-        # Iterate over the categories
-        categories = ["présentes", "excusées", "non excusées"]
-
-        for cat in range(len(categories)):
-
-            # Set A4 portait (in inches...)
-            fig = plt.figure(figsize=(11.93, 15.98))
-
-            # Adjust the spacing between the plots
-            fig.subplots_adjust(hspace=1.75, wspace=0.5)
+    nbr_activ = data.shape[1]
+    years = np.arange(last_year - data.shape[0] + 1, last_year + 1, dtype=int)
 
-            # Compute number of columns and rows in the subplots
-            cols = 2
-            rows = np.ceil(nbr_activ / cols)
+    fig = Figure(figsize=PAGE_SIZE)
 
-            # General title
-            plt.suptitle(
-                "Evolution du nombre de personnes " + categories[cat] + " pour chaque activités\n(activités obligatoires en rouge)",
-                fontsize=14, color='black', fontweight='bold')
+    # Adjust the spacing between the plots
+    fig.subplots_adjust(hspace=1.75, wspace=0.5)
 
-            # Iterate over each activity
-            for i in range(nbr_activ):
-                plt.subplot(rows, cols, i + 1)
+    # Compute number of columns and rows in the subplots
+    cols = 2
+    rows = int(np.ceil(nbr_activ / cols))
 
-                # Choose the color according if the activity is mandatory or not :
-                # Red for mandatory, blue for non mandatory
-                if mandatory_list[i]:
-                    color = 'r'
-                else:
-                    color = 'b'
+    # General title
+    fig.suptitle(
+        "Evolution du nombre de personnes " + CATEGORIES[cat] + " pour chaque activités\n(activités obligatoires en rouge)",
+        fontsize=14, color='black', fontweight='bold')
 
-                plt.plot(np.arange(last_year - data.shape[0] + 1, last_year + 1, dtype=int), data[:, i + cat*nbr_activ], marker='.', color=color,
-                         linestyle='-')
+    # Iterate over each activity
+    for i in range(nbr_activ):
+        ax = fig.add_subplot(rows, cols, i + 1)
 
-                # Fix the same limits for all subplots
-                plt.xlim(last_year - data.shape[0], last_year + 1)
-                plt.ylim(0, society_size)
+        # Choose the color according if the activity is mandatory or not :
+        # Red for mandatory, blue for non mandatory
+        if mandatory_list[i]:
+            color = 'r'
+        else:
+            color = 'b'
 
-                # Format the x ticks
-                plt.xticks(np.arange(last_year - data.shape[0] + 1, last_year + 1, dtype=int))
+        values = data[:, i]
+        ax.plot(years, values, marker='.', color=color, linestyle='-')
 
-                # Add a grid
-                plt.grid(True, which='major', axis='y')
+        # Fix the same limits for all subplots
+        ax.set_xlim(last_year - data.shape[0], last_year + 1)
+        ax.set_ylim(0, society_size)
 
-                # Title for the subplot
-                plt.title(names_list[i], loc='center', fontsize=11, color=color)
+        # Format the x ticks
+        ax.set_xticks(years)
 
-                # Annotate with the values
-                for x, y in zip(np.arange(last_year - data.shape[0] + 1, last_year + 1), data[:, i + cat*nbr_activ]):
-                    label = "{:d}".format(int(y))
+        # Add a grid
+        ax.grid(True, which='major', axis='y')
 
-                    plt.annotate(label, (x, y), textcoords='offset points', xytext=(0, 6), ha='center')
+        # Title for the subplot
+        ax.set_title(names_list[i], loc='center', fontsize=11, color=color)
 
-            # Save figure to the pdf
-            pdf.savefig()
-            plt.close()
+        # Annotate with the values
+        for x, y in zip(years, values):
+            # No value for the years where the activity did not exist
+            if np.isnan(y):
+                continue
+            label = "{:d}".format(int(y))
 
-        # Add the averages
+            ax.annotate(label, (x, y), textcoords='offset points', xytext=(0, 6), ha='center')
 
-        mdt_list_index = np.argwhere(mandatory_list == True)
+    return fig
 
-        mdt_data_present = data[-1, :nbr_activ][mdt_list_index]
-        avg_mdt_present = average(mdt_data_present, society_size)
 
-        mdt_data_excused = data[-1,nbr_activ:2*nbr_activ][mdt_list_index]
-        avg_mdt_excused = average(mdt_data_excused, society_size)
-
-        mdt_data_non_present = data[-1, 2 * nbr_activ:][mdt_list_index]
-        avg_mdt_non_present = average(mdt_data_non_present, society_size)
-
-        non_mdt_list_index = np.argwhere(mandatory_list == False)
-
-        non_mdt_data_present = data[-1, :nbr_activ][non_mdt_list_index]
-        avg_non_mdt_present = average(non_mdt_data_present, society_size)
-
-        non_mdt_data_excused = data[-1, nbr_activ:2 * nbr_activ][non_mdt_list_index]
-        avg_non_mdt_excused = average(non_mdt_data_excused, society_size)
-
-        non_mdt_data_non_present = data[-1, 2 * nbr_activ:][non_mdt_list_index]
-        avg_non_mdt_non_present = average(non_mdt_data_non_present, society_size)
-
-        all_data_present = data[-1, :nbr_activ]
-        avg_all_present = average(all_data_present, society_size)
-
-        all_data_excused = data[-1, nbr_activ:2*nbr_activ]
-        avg_all_excused = average(all_data_excused, society_size)
+def _averages_figure(rates, society_size):
+    """
+    Draws the page with the averages of the last year
+    :param rates: np.array (3 groups, 3 categories) : the average rates of the last year (see summary.compute_summary)
+    :param society_size: the current size of the society
+    :return: the matplotlib Figure
+    """
+    fig = Figure(figsize=PAGE_SIZE)
 
-        all_data_non_present = data[-1, 2*nbr_activ:]
-        avg_all_non_present = average(all_data_non_present, society_size)
+    titles = ['Activités obligatoires :', 'Activités pas obligatoires :', 'Toutes les activités :']
+    labels = ['présentes', 'excusées', 'non présentes']
+    for g, top in enumerate([0.90, 0.70, 0.50]):
+        fig.text(0.10, top, titles[g], size=14, fontweight='bold')
 
-        # Add the averages to the file
-        fig = plt.figure(figsize=(11.93, 15.98))
-        fig.text(0.10, 0.90, 'Activités obligatoires :', size=14, fontweight='bold')
+        for cat in range(len(labels)):
+            avg = rates[g, cat]
+            fig.text(0.10, top - 0.03 * (cat + 1), 'Moyenne des personnes ' + labels[cat] + ' : ' + "{:.2f}".format(100 * avg) + '%, ' + str(
+                int(np.around(avg * society_size))) + ' personnes', size=11)
 
-        fig.text(0.10, 0.87, 'Moyenne des personnes présentes : ' + "{:.2f}".format(100 * avg_mdt_present) + '%, ' + str(int(np.around(avg_mdt_present * society_size))) + ' personnes', size=11)
+    return fig
 
-        fig.text(0.10, 0.84, 'Moyenne des personnes excusées : ' + "{:.2f}".format(100 * avg_mdt_excused) + '%, ' + str(int(np.around(avg_mdt_excused * society_size))) + ' personnes', size=11)
 
-        fig.text(0.10, 0.81, 'Moyenne des personnes non présentes : ' + "{:.2f}".format(100 * avg_mdt_non_present) + '%, ' + str(int(np.around(avg_mdt_non_present * society_size))) + ' personnes', size=11)
+def _trends_figure(trends, names_list, nbr_lines=20):
+    """
+    Draws the page with the activities whose presence dropped sharply the last year, and the activities
+    with the most decreasing presence
+    :param trends: the trends of the data (see trends.compute_trends)
+    :param names_list: the names of the activities
+    :param nbr_lines: the maximum number of activities in each list
+    :return: the matplotlib Figure
+    """
+    fig = Figure(figsize=PAGE_SIZE)
+    nbr_activ = len(names_list)
+
+    fig.text(0.10, 0.90, 'Baisses marquées de la présence en ' + str(trends['years'][-1]) + ' :', size=14,
+             fontweight='bold')
+    alert_list = alerts(trends, names_list)[:nbr_lines]
+    if not alert_list:
+        fig.text(0.10, 0.87, 'Aucune', size=11)
+    for i, (name, rate, change, z, slope) in enumerate(alert_list):
+        fig.text(0.10, 0.87 - 0.02 * i, name + ' : ' + "{:.2f}".format(100 * rate) +
+                 '% des personnes présentes (z = ' + "{:.1f}".format(z) + ')', size=11)
+
+    # Present category, by increasing slope
+    slopes = trends['slope'][:nbr_activ]
+    order = np.argsort(slopes)[:nbr_lines]
+    order = order[slopes[order] < 0]
+    top = 0.85 - 0.02 * max(len(alert_list), 1)
+    fig.text(0.10, top, 'Présence en baisse (moyenne sur les dernières années, tendance par année) :', size=14,
+             fontweight='bold')
+    if order.size == 0:
+        fig.text(0.10, top - 0.03, 'Aucune', size=11)
+    for line, i in enumerate(order):
+        fig.text(0.10, top - 0.03 - 0.02 * line, names_list[i] + ' : ' +
+                 "{:.2f}".format(100 * trends['rolling'][-1, i]) + '%, ' + "{:+.2f}".format(100 * slopes[i]) +
+                 ' points', size=11)
+
+    return fig
+
+
+def report_pages(data, mandatory_list, last_year, names_list, society_size, summary, trends):
+    """
+    Lists the pages of the report, each as the function that draws it and its arguments. The arguments are only what
+    the page shows, so that they also identify the page in the cache
+    :param data: np.array (nbr of years x 3*nbr of activities) : the full (three category) data
+    :param summary: the summary statistics of the data (see summary.compute_summary)
+    :param trends: the trends of the data (see trends.compute_trends)
+    :return: list of (function, tuple of arguments)
+    """
+    nbr_activ = data.shape[1] // 3
 
-        fig.text(0.10, 0.70, 'Activités pas obligatoires :', size=14, fontweight='bold')
+    pages = [(_activities_figure, (data[:, cat*nbr_activ:(cat + 1)*nbr_activ], cat, mandatory_list, last_year,
+                                   names_list, society_size))
+             for cat in range(len(CATEGORIES))]
+    pages.append((_averages_figure, (summary['rate'][-1], society_size)))
+    pages.append((_trends_figure, (trends, names_list)))
+    return pages
 
-        fig.text(0.10, 0.67, 'Moyenne des personnes présentes : ' + "{:.2f}".format(100 * avg_non_mdt_present) + '%, ' + str(int(np.around(avg_non_mdt_present * society_size))) + ' personnes', size=11)
 
-        fig.text(0.10, 0.64, 'Moyenne des personnes excusées : ' + "{:.2f}".format(100 * avg_non_mdt_excused) + '%, ' + str(int(np.around(avg_non_mdt_excused * society_size))) + ' personnes', size=11)
+def _update_hash(h, value):
+    """
+    Adds a value to a hash : dicts, lists and tuples are hashed element by element, the rest as numpy arrays
+    (dtype, shape and content)
+    :param h: the hashlib object
+    :param value: the value
+    :return: Nothing
+    """
+    if isinstance(value, dict):
+        h.update(b'd%d' % len(value))
+        for key in sorted(value):
+            _update_hash(h, str(key))
+            _update_hash(h, value[key])
+    elif isinstance(value, (list, tuple)):
+        h.update(b'l%d' % len(value))
+        for v in value:
+            _update_hash(h, v)
+    elif isinstance(value, str):
+        encoded = value.encode()
+        h.update(b's%d' % len(encoded) + encoded)
+    else:
+        arr = np.asarray(value)
+        if arr.dtype == object:
+            _update_hash(h, arr.tolist())
+            return
+        arr = np.ascontiguousarray(arr)
+        h.update(arr.dtype.str.encode() + np.asarray(arr.shape, dtype=np.int64).tobytes())
+        h.update(arr.tobytes())
+
+
+def page_key(function, args):
+    """
+    Hash of a page of the report : the function that draws it, its arguments, and the versions of the drawing
+    :param function: the function that draws the page
+    :param args: the arguments of the function
+    :return: str : the hexadecimal digest
+    """
+    h = hashlib.sha256()
+    _update_hash(h, (str(REPORT_VERSION), matplotlib.__version__, function.__name__, tuple(args)))
+    return h.hexdigest()
 
-        fig.text(0.10, 0.61, 'Moyenne des personnes non présentes : ' + "{:.2f}".format(100 * avg_non_mdt_non_present) + '%, ' + str(
-            int(np.around(avg_non_mdt_non_present * society_size))) + ' personnes', size=11)
 
-        fig.text(0.10, 0.50, 'Toutes les activités :', size=14, fontweight='bold')
+def render_page(function, args):
+    """
+    Draws a page of the report and saves it as a single page pdf, executed in a worker process when the report is
+    drawn in parallel
+    :param function: the function that draws the page
+    :param args: the arguments of the function
+    :return: bytes : the pdf
+    """
+    out = io.BytesIO()
+    # No creation date, so that the pdf only depends on the data
+    function(*args).savefig(out, format='pdf', metadata={'CreationDate': None})
+    return out.getvalue()
 
-        fig.text(0.10, 0.47, 'Moyenne des personnes présentes : ' + "{:.2f}".format(100 * avg_all_present) + '%, ' + str(
-            int(np.around(avg_all_present * society_size))) + ' personnes', size=11)
 
-        fig.text(0.10, 0.44, 'Moyenne des personnes excusées : ' + "{:.2f}".format(100 * avg_all_excused) + '%, ' + str(
-            int(np.around(avg_all_excused * society_size))) + ' personnes', size=11)
+def load_cached_page(cache_dir, key):
+    """
+    Returns a page from the cache directory, and marks it as recently used
+    :param cache_dir: the cache directory
+    :param key: the key of the page (see page_key)
+    :return: bytes : the pdf of the page, or None if it is not in the cache
+    """
+    path = os.path.join(cache_dir, key + '.pdf')
+    try:
+        with open(path, 'rb') as f:
+            pdf = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return pdf
 
-        fig.text(0.10, 0.41, 'Moyenne des personnes non présentes : ' + "{:.2f}".format(100 * avg_all_non_present) + '%, ' + str(
-            int(np.around(avg_all_non_present * society_size))) + ' personnes', size=11)
 
-        pdf.savefig()
-        plt.close()
+def save_cached_pages(cache_dir, pages, max_pages=MAX_CACHED_PAGES):
+    """
+    Stores pages in the cache directory, and removes the least recently used pages above max_pages
+    :param cache_dir: the cache directory, created if needed
+    :param pages: dict key -> bytes : the pdfs of the pages
+    :param max_pages: the maximum number of pages kept
+    :return: Nothing
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    for key, pdf in pages.items():
+        # Written aside and then renamed, so that a page is never read half written
+        path = os.path.join(cache_dir, key + '.pdf')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(pdf)
+        os.replace(path + '.tmp', path)
+
+    cached = [entry for entry in os.scandir(cache_dir) if entry.is_file() and entry.name.endswith('.pdf')]
+    cached.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+    for entry in cached[max_pages:]:
+        os.remove(entry.path)
+
+
+def create_pdf(data, mandatory_list, last_year, names_list, society_size, path, summary=None, max_workers=None,
+               trends=None, cache_dir=None):
+    """
+    Creates a pdf with the evolution graphs for each activity and each category (present, excused, non present),
+    add to this pdf:
+        - the average (of the current year) of present people at mandatory activities
+        - the average (of the current year) of excused people at mandatory activities
+        - the average (of the current year) of non present people at mandatory activities
+        - the average (of the current year) of present people at non mandatory activities
+        - the average (of the current year) of excused people at non mandatory activities
+        - the average (of the current year) of non present people overall
+        - the average (of the current year) of excused people overall
+        - the average (of the current year) of non present people overall
+        - the activities whose presence dropped sharply the current year, and the activities with a decreasing presence
+    The pages are drawn on a process pool when there are several processors and at least PARALLEL_MIN_ACTIVITIES
+    activities
+    :param data: np.array (nbr of years x 3*nbr of activities) : the full (three category) data
+    :param mandatory_list: the list of the activities that are mandatory or not
+    (work by the index of the activity)
+    :param last_year: the last year of the data
+    :param names_list: the names of the activities
+    :param society_size: the current size of the society
+    :param path: the location where to save the pdf (only folder path, the name of the file is automatic)
+    :param summary: the summary statistics of the data (see summary.compute_summary), computed if None
+    :param max_workers: the maximum number of worker processes, by default the number of processors,
+    1 draws the pages in the current process
+    :param trends: the trends of the data (see trends.compute_trends), computed if None
+    :param cache_dir: the directory where the drawn pages are cached, None (default) for no cache
+    :return: the path where the file was saved
+    """
+    # Number of activities
+    nbr_activ = data.shape[1] // 3
+    path_pdf = os.path.join(str(path), 'Jeunesse_statistiques_' + str(last_year) +'.pdf')
 
-        #Set the file's metadata
-        d = pdf.infodict()
-        d['Subject'] = 'Evolution des présences - Jeunesse Marsens'
+    if summary is None:
+        summary = compute_summary(data, mandatory_list, society_size)
+    if trends is None:
+        trends = compute_trends(data, society_size, np.arange(last_year - data.shape[0] + 1, last_year + 1))
+
+    pages = report_pages(data, mandatory_list, last_year, names_list, society_size, summary, trends)
+
+    # The pages already drawn for the same inputs
+    rendered = {}
+    if cache_dir is not None:
+        keys = [page_key(function, args) for function, args in pages]
+        for page, key in enumerate(keys):
+            pdf = load_cached_page(cache_dir, key)
+            if pdf is not None:
+                rendered[page] = pdf
+    missing = [page for page in range(len(pages)) if page not in rendered]
+
+    nbr_workers = min(max_workers or os.cpu_count() or 1, os.cpu_count() or 1, len(missing))
+    if nbr_workers > 1 and nbr_activ >= PARALLEL_MIN_ACTIVITIES:
+        with ProcessPoolExecutor(max_workers=nbr_workers) as executor:
+            futures = {page: executor.submit(render_page, *pages[page]) for page in missing}
+            rendered.update({page: future.result() for page, future in futures.items()})
+    else:
+        for page in missing:
+            rendered[page] = render_page(*pages[page])
+
+    if cache_dir is not None and missing:
+        save_cached_pages(cache_dir, {keys[page]: rendered[page] for page in missing})
+
+    # Merged in the order of the pages, whatever the order the workers finish
+    with open(path_pdf, 'wb') as f:
+        f.write(merge_pages([rendered[page] for page in range(len(pages))],
+                            {'Subject': 'Evolution des présences - Jeunesse Marsens'}))
     return path_pdf
 
 
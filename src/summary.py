@@ -0,0 +1,92 @@
+import argparse
+import numpy as np
+
+"""
+Summary statistics of the presence, computed in one vectorized pass over the whole history, independently of the
+rendering : the PDF (statistics.create_pdf), the command line (python -m points_system.summary) and the GUI
+consume the same result.
+The data is an np.array (nbr of years, 3*nbr of activities) in term of persons, with the present, excused and
+non present people of each activity (NaN where the activity did not exist that year).
+"""
+
+CATEGORIES = ('present', 'excused', 'absent')
+GROUPS = ('mandatory', 'non_mandatory', 'all')
+
+
+def compute_summary(data, mandatory_list, society_sizes, years=None):
+    """
+    Computes for each year, each group of activities (mandatory, non mandatory, all) and each category
+    (present, excused, non present) : the total number of people over the activities, the mean number of people
+    per activity and the rate (mean w.r.t. the society size)
+    :param data: np.array (nbr of years, 3*nbr of activities) : the full (three category) data
+    :param mandatory_list: np.array (nbr of activities, ) : True if the activity is mandatory
+    :param society_sizes: the society size of each year (np.array (nbr of years, )), or one size for all the years
+    :param years: np.array (nbr of years, ) : the years, by default 0, 1, ...
+    :return: dict with 'years', 'groups', 'categories', and np.array (nbr of years, nbr of groups, nbr of categories)
+    for 'total', 'count' (the number of activities), 'mean' and 'rate' (NaN for a group without activity)
+    """
+    data = np.asarray(data, dtype=float)
+    nbr_years = data.shape[0]
+    counts = data.reshape((nbr_years, len(CATEGORIES), -1))
+
+    mandatory_list = np.asarray(mandatory_list, dtype=bool)
+    groups = np.stack((mandatory_list, ~mandatory_list, np.ones_like(mandatory_list))).astype(float)
+
+    # The missing activities count neither in the totals nor in the number of activities
+    valid = ~np.isnan(counts)
+    total = np.einsum('ycn,gn->ygc', np.where(valid, counts, 0.), groups)
+    count = np.einsum('ycn,gn->ygc', valid.astype(float), groups)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    sizes = np.broadcast_to(np.asarray(society_sizes, dtype=float).reshape(-1), (nbr_years,))
+    rate = mean / sizes[:, None, None]
+
+    return {
+        'years': np.arange(nbr_years) if years is None else np.asarray(years),
+        'groups': GROUPS,
+        'categories': CATEGORIES,
+        'total': total,
+        'count': count,
+        'mean': mean,
+        'rate': rate,
+    }
+
+
+def format_summary(summary, year_index=-1):
+    """
+    Formats the summary of one year as text
+    :param summary: dict as returned by compute_summary
+    :param year_index: the index of the year, by default the last one
+    :return: str
+    """
+    lines = [str(summary['years'][year_index])]
+    for g, group in enumerate(summary['groups']):
+        lines.append('  ' + group + ' :')
+        for cat, category in enumerate(summary['categories']):
+            lines.append('    {:<8} mean {:8.2f} persons, {:6.2f} %, total {:8.0f}'.format(
+                category, summary['mean'][year_index, g, cat], 100 * summary['rate'][year_index, g, cat],
+                summary['total'][year_index, g, cat]))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summary statistics of the presence')
+    parser.add_argument('db_path', help='the path of the database')
+    parser.add_argument('--all-years', action='store_true', help='print every year, not only the last one')
+    args = parser.parse_args()
+
+    # Only needed to read the db
+    import points_system.file_manager as fm
+
+    conn, c = fm.connect_db(args.db_path)
+    years, data, sizes, points, mandatory, names = fm.get_aligned_records(c)
+    fm.close_db(conn, c)
+
+    summary = compute_summary(data, mandatory[-1], sizes, years)
+    indexes = range(len(years)) if args.all_years else [-1]
+    print('\n'.join(format_summary(summary, i) for i in indexes))
+
+
+if __name__ == "__main__":
+    main()
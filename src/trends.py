@@ -0,0 +1,154 @@
+import numpy as np
+
+"""
+Trends of the presence over the whole history, computed for all the activities and categories at once.
+The series are taken as rates (number of people w.r.t. the society size of the year), so that the years with
+different society sizes are comparable. The years where an activity did not exist (NaN) are ignored.
+Every quantity is an np.array (nbr of years, 3*nbr of activities), or (3*nbr of activities, ) for the slopes,
+with the same columns as the data.
+"""
+
+DEFAULT_WINDOW = 3
+DEFAULT_THRESHOLD = 2.
+# Minimum standard deviation of the rates for the z-scores, so that a drop after constant years is not infinite
+MIN_STD = 0.01
+
+
+def _cumulative(values, valid):
+    """
+    Cumulative sums over the years, with a row of zeros in front, ignoring the missing values
+    :return: np.array (nbr of years + 1, nbr of series)
+    """
+    sums = np.cumsum(np.where(valid, values, 0.), axis=0)
+    return np.concatenate((np.zeros((1, values.shape[1])), sums), axis=0)
+
+
+def rolling_mean(rates, window=DEFAULT_WINDOW):
+    """
+    Mean over the last window years (fewer for the first years), of the years where the activity existed
+    :param rates: np.array (nbr of years, nbr of series)
+    :param window: the number of years
+    :return: np.array (nbr of years, nbr of series), NaN where no year of the window has a value
+    """
+    valid = ~np.isnan(rates)
+    sums = _cumulative(rates, valid)
+    counts = _cumulative(valid, valid)
+
+    end = np.arange(1, rates.shape[0] + 1)
+    start = np.maximum(end - window, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[end] - sums[start]) / (counts[end] - counts[start])
+
+
+def slopes(rates, years):
+    """
+    Least squares slope of each series w.r.t. the years
+    :param rates: np.array (nbr of years, nbr of series)
+    :param years: np.array (nbr of years, )
+    :return: np.array (nbr of series, ) : the change of the rate per year, NaN for less than two years with a value
+    """
+    valid = ~np.isnan(rates)
+    # Centered years, for the precision
+    x = np.where(valid, (np.asarray(years, dtype=float) - np.mean(years))[:, None], 0.)
+    y = np.where(valid, rates, 0.)
+
+    n = valid.sum(axis=0)
+    sx, sy = x.sum(axis=0), y.sum(axis=0)
+    sxx, sxy = (x**2).sum(axis=0), (x * y).sum(axis=0)
+
+    denom = n * sxx - sx**2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where((n >= 2) & (denom > 0), (n * sxy - sx * sy) / denom, np.nan)
+
+
+def year_over_year(rates):
+    """
+    Change of the rate since the previous year
+    :param rates: np.array (nbr of years, nbr of series)
+    :return: np.array (nbr of years, nbr of series), NaN for the first year and where one of the two years is missing
+    """
+    change = np.full(rates.shape, np.nan)
+    change[1:] = rates[1:] - rates[:-1]
+    return change
+
+
+def zscores(rates, min_std=MIN_STD):
+    """
+    Standardized distance of each year to the mean of all the previous years of the series
+    :param rates: np.array (nbr of years, nbr of series)
+    :param min_std: the minimum standard deviation
+    :return: np.array (nbr of years, nbr of series), NaN where there are less than two previous years
+    """
+    valid = ~np.isnan(rates)
+    sums = _cumulative(rates, valid)[:-1]
+    squares = _cumulative(rates**2, valid)[:-1]
+    counts = _cumulative(valid, valid)[:-1]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+        # Sample variance of the previous years
+        var = (squares - counts * mean**2) / (counts - 1)
+        std = np.maximum(np.sqrt(np.maximum(var, 0.)), min_std)
+        return np.where(counts >= 2, (rates - mean) / std, np.nan)
+
+
+def compute_trends(data, society_sizes, years, window=DEFAULT_WINDOW, threshold=DEFAULT_THRESHOLD):
+    """
+    Computes the trends of all the series of the data
+    :param data: np.array (nbr of years, 3*nbr of activities) : the full (three category) data, in term of persons
+    :param society_sizes: the society size of each year (np.array (nbr of years, )), or one size for all the years
+    :param years: np.array (nbr of years, ) : the years
+    :param window: the number of years of the rolling means
+    :param threshold: the z-score under -threshold that flags a drop
+    :return: dict with 'years', 'rates', 'rolling', 'yoy', 'zscore', 'drops' (bool, the flagged years)
+    as np.array (nbr of years, 3*nbr of activities) and 'slope' as np.array (3*nbr of activities, )
+    """
+    data = np.asarray(data, dtype=float)
+    sizes = np.broadcast_to(np.asarray(society_sizes, dtype=float).reshape(-1), (data.shape[0],))
+    rates = data / sizes[:, None]
+    z = zscores(rates)
+
+    return {
+        'years': np.asarray(years),
+        'rates': rates,
+        'rolling': rolling_mean(rates, window),
+        'slope': slopes(rates, years),
+        'yoy': year_over_year(rates),
+        'zscore': z,
+        'drops': z < -threshold,
+    }
+
+
+def alerts(trends, names_list):
+    """
+    Lists the activities whose presence dropped sharply the last year
+    :param trends: dict as returned by compute_trends
+    :param names_list: the names of the activities
+    :return: list of (name, rate of the last year, change since the previous year, z-score, slope),
+    by increasing z-score
+    """
+    nbr_activ = len(names_list)
+    # The presence is the first category
+    flagged = np.flatnonzero(trends['drops'][-1, :nbr_activ])
+    flagged = flagged[np.argsort(trends['zscore'][-1, flagged])]
+
+    return [(names_list[i], trends['rates'][-1, i], trends['yoy'][-1, i], trends['zscore'][-1, i], trends['slope'][i])
+            for i in flagged]
+
+
+def format_alerts(alert_list):
+    """
+    Formats the alerts as text, one line per activity
+    :param alert_list: list as returned by alerts
+    :return: str
+    """
+    if not alert_list:
+        return 'Aucune baisse marquée de la présence'
+
+    lines = []
+    for name, rate, change, z, slope in alert_list:
+        # No change when the activity did not exist the previous year
+        change = '' if np.isnan(change) else '{:+.2f} points depuis l\'année passée, '.format(100 * change)
+        lines.append('{} : {:.2f}% ({}z = {:.1f}, tendance {:+.2f} points par année)'.format(
+            name, 100 * rate, change, z, 100 * slope))
+    return '\n'.join(lines)
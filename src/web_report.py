@@ -0,0 +1,169 @@
+import numpy as np
+import json
+import html
+import os
+
+# Personal modules
+from points_system.summary import compute_summary
+
+"""
+Light version of the statistics report for the members' portal : a self contained html page with one inline svg
+sparkline per activity and category, and a json file with the series and the averages. Only numpy is needed
+(no matplotlib), the coordinates of all the sparklines are computed at once.
+"""
+
+CATEGORIES = ["présentes", "excusées", "non excusées"]
+KEYS = ('present', 'excused', 'absent')
+SPARKLINE_SIZE = (160, 40)
+# Red for mandatory, blue for non mandatory (as in the pdf)
+COLORS = {True: '#d62728', False: '#1f77b4'}
+
+STYLE = '''body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; }
+th, td { padding: 4px 10px; border-bottom: 1px solid #ddd; text-align: left; }
+td.value { text-align: right; }
+.mandatory { color: #d62728; }
+.non_mandatory { color: #1f77b4; }
+svg { vertical-align: middle; }'''
+
+
+def _to_json_list(values):
+    """
+    Converts an array to nested lists, with None where the array is NaN (NaN is not valid json)
+    :param values: np.array of float
+    :return: nested lists of float and None
+    """
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+def report_payload(data, mandatory_list, last_year, names_list, society_size, summary=None):
+    """
+    Gathers the series of each activity and the averages of the last year
+    :param data: np.array (nbr of years x 3*nbr of activities) : the full (three category) data, in term of persons
+    :param mandatory_list: the list of the activities that are mandatory or not
+    :param last_year: the last year of the data
+    :param names_list: the names of the activities
+    :param society_size: the current size of the society
+    :param summary: the summary statistics of the data (see summary.compute_summary), computed if None
+    :return: dict, serializable in json
+    """
+    nbr_years = data.shape[0]
+    nbr_activ = data.shape[1] // 3
+    if summary is None:
+        summary = compute_summary(data, mandatory_list, society_size)
+
+    series = _to_json_list(np.asarray(data, dtype=float).reshape((nbr_years, len(KEYS), nbr_activ)).transpose(2, 1, 0))
+    activities = [dict({'name': str(names_list[i]), 'mandatory': bool(mandatory_list[i])}, **dict(zip(KEYS, series[i])))
+                  for i in range(nbr_activ)]
+
+    rates = _to_json_list(summary['rate'][-1])
+    means = _to_json_list(summary['mean'][-1])
+    averages = {group: {key: {'rate': rates[g][k], 'mean': means[g][k]} for k, key in enumerate(KEYS)}
+                for g, group in enumerate(summary['groups'])}
+
+    return {
+        'years': list(range(int(last_year) - nbr_years + 1, int(last_year) + 1)),
+        'society_size': float(society_size),
+        'activities': activities,
+        'averages': averages,
+    }
+
+
+def sparklines(data, society_size, size=SPARKLINE_SIZE):
+    """
+    Computes the svg polylines of all the series at once. A missing year (NaN) interrupts the line
+    :param data: np.array (nbr of years x nbr of series) : the series, in term of persons
+    :param society_size: the current size of the society, top of the y axis
+    :param size: (width, height) of a sparkline in pixels
+    :return: list of the svg paths (the 'd' attribute), one per series
+    """
+    width, height = size
+    nbr_years = data.shape[0]
+    xs = np.linspace(2., width - 2., nbr_years) if nbr_years > 1 else np.full(1, width / 2.)
+    ys = height - 2. - np.clip(data / float(society_size), 0., 1.) * (height - 4.)
+
+    valid = ~np.isnan(ys)
+    # A point starts a new sub path (M) if the previous year is missing, else it continues it (L)
+    starts = valid & ~np.vstack((np.zeros((1, data.shape[1]), dtype=bool), valid[:-1]))
+    commands = np.where(starts, 'M', 'L')
+
+    paths = []
+    for j in range(data.shape[1]):
+        rows = np.flatnonzero(valid[:, j])
+        paths.append(' '.join('{}{:.1f},{:.1f}'.format(commands[i, j], xs[i], ys[i, j]) for i in rows))
+    return paths
+
+
+def render_html(payload, size=SPARKLINE_SIZE):
+    """
+    Renders the self contained html page of the report
+    :param payload: dict as returned by report_payload
+    :param size: (width, height) of a sparkline in pixels
+    :return: str
+    """
+    width, height = size
+    years = payload['years']
+
+    # All the series in one array (nbr of years, nbr of activities * nbr of categories)
+    data = np.array([[np.nan if v is None else v for v in activity[key]]
+                     for activity in payload['activities'] for key in KEYS], dtype=float).reshape((-1, len(years))).T
+    paths = sparklines(data, payload['society_size'], size)
+
+    lines = ['<!DOCTYPE html>', '<html lang="fr">', '<head>', '<meta charset="utf-8">',
+             '<title>Statistiques - {}</title>'.format(years[-1]), '<style>', STYLE, '</style>', '</head>', '<body>',
+             '<h1>Evolution des présences {} - {}</h1>'.format(years[0], years[-1]),
+             '<p>Activités obligatoires en rouge</p>', '<table>',
+             '<tr><th>Activité</th>' + ''.join('<th>{}</th><th></th>'.format(c.capitalize()) for c in CATEGORIES)
+             + '</tr>']
+    for i, activity in enumerate(payload['activities']):
+        color = COLORS[activity['mandatory']]
+        cells = []
+        for k, key in enumerate(KEYS):
+            last = activity[key][-1]
+            cells.append('<td><svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">'
+                         '<path d="{d}" fill="none" stroke="{c}" stroke-width="1.5"/></svg></td>'
+                         '<td class="value">{v}</td>'.format(w=width, h=height, d=paths[i * len(KEYS) + k], c=color,
+                                                            v='' if last is None else int(last)))
+        row_class = 'mandatory' if activity['mandatory'] else 'non_mandatory'
+        lines.append('<tr><td class="{}">{}</td>{}</tr>'.format(row_class, html.escape(activity['name']),
+                                                              ''.join(cells)))
+    lines.append('</table>')
+
+    titles = {'mandatory': 'Activités obligatoires', 'non_mandatory': 'Activités pas obligatoires',
+              'all': 'Toutes les activités'}
+    labels = ['présentes', 'excusées', 'non présentes']
+    lines += ['<h2>Moyennes {}</h2>'.format(years[-1]), '<table>']
+    for group, averages in payload['averages'].items():
+        for key, label in zip(KEYS, labels):
+            rate = averages[key]['rate']
+            value = '-' if rate is None else '{:.2f}%, {} personnes'.format(
+                100 * rate, int(np.around(rate * payload['society_size'])))
+            lines.append('<tr><td>{}</td><td>Moyenne des personnes {}</td><td class="value">{}</td></tr>'.format(
+                titles[group], label, value))
+    lines += ['</table>', '</body>', '</html>']
+
+    return '\n'.join(lines)
+
+
+def create_html(data, mandatory_list, last_year, names_list, society_size, path, summary=None):
+    """
+    Creates the html page and the json file of the report
+    :param data: np.array (nbr of years x 3*nbr of activities) : the full (three category) data, in term of persons
+    :param mandatory_list: the list of the activities that are mandatory or not
+    :param last_year: the last year of the data
+    :param names_list: the names of the activities
+    :param society_size: the current size of the society
+    :param path: the location where to save the files (only folder path, the names of the files are automatic)
+    :param summary: the summary statistics of the data (see summary.compute_summary), computed if None
+    :return: the paths where the html and the json files were saved
+    """
+    payload = report_payload(data, mandatory_list, last_year, names_list, society_size, summary)
+
+    base = os.path.join(str(path), 'Jeunesse_statistiques_' + str(last_year))
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False)
+    with open(base + '.html', 'w', encoding='utf-8') as f:
+        f.write(render_html(payload))
+
+    return base + '.html', base + '.json'
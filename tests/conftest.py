@@ -0,0 +1,10 @@
+import importlib.util
+import os
+import sys
+
+# The sources are the points_system package, make it importable when it is not installed
+if importlib.util.find_spec('points_system') is None:
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+    spec = importlib.util.spec_from_file_location('points_system', os.path.join(src, '__init__.py'),
+                                                  submodule_search_locations=[src])
+    sys.modules['points_system'] = importlib.util.module_from_spec(spec)
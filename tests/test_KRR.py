@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+
+import points_system.KRR as KRR
+
+
+def training_data(nbr_years=12, nbr_activ=4, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.concatenate((rng.integers(0, 10, (nbr_years, nbr_activ)), np.ones((nbr_years, 1))), axis=1)
+    Y = rng.uniform(0., 1., (nbr_years, nbr_activ))
+    return X, Y
+
+
+@pytest.mark.parametrize('kernel', [(KRR.linear_kernel, 1.), (KRR.rbf_kernel, 5., 0.1), (KRR.polynomial_kernel, 2, 1.)])
+def test_add_sample_matches_full_fit(kernel):
+    *kernel, lambd = kernel
+    X, Y = training_data()
+
+    model = KRR.KRRModel(*kernel, lambd=lambd).fit(X[:8], Y[:8])
+    for i in range(8, X.shape[0]):
+        model.add_sample(X[i], Y[i])
+    full = KRR.KRRModel(*kernel, lambd=lambd).fit(X, Y)
+
+    np.testing.assert_allclose(model.L, full.L, atol=1e-8)
+    np.testing.assert_allclose(model.alpha, full.alpha, atol=1e-8)
+
+
+def test_add_sample_does_not_refactorize(monkeypatch):
+    X, Y = training_data()
+    model = KRR.KRRModel(KRR.rbf_kernel, 5., lambd=0.1).fit(X[:-1], Y[:-1])
+
+    def cholesky(*args):
+        raise AssertionError('The factor must be extended, not recomputed')
+
+    monkeypatch.setattr(np.linalg, 'cholesky', cholesky)
+    model.add_sample(X[-1], Y[-1])
+    assert model.L.shape == (X.shape[0], X.shape[0])
+
+
+KERNELS = [(KRR.linear_kernel,), (KRR.polynomial_kernel, 2), (KRR.polynomial_kernel, 3), (KRR.rbf_kernel, 5.)]
+
+
+@pytest.mark.parametrize('kernel', KERNELS)
+def test_batched_kernel_matches_pairwise_loop(kernel):
+    kernel_function, *kernel_args = kernel
+    A, _ = training_data(7)
+    B, _ = training_data(5, seed=1)
+
+    expected = np.array([[kernel_function(a, b, *kernel_args) for b in B] for a in A])
+    np.testing.assert_allclose(KRR.cross_kernel(A, B, kernel_function, *kernel_args), expected, rtol=1e-10)
+    np.testing.assert_allclose(KRR.matrix_kernel(A, kernel_function, *kernel_args),
+                               np.array([[kernel_function(a, b, *kernel_args) for b in A] for a in A]), rtol=1e-10)
+
+
+def test_custom_kernel_is_evaluated_for_each_pair():
+    def kernel(xi, xj, scale):
+        return scale * np.abs(xi - xj).sum()
+
+    A, _ = training_data(4)
+    np.testing.assert_allclose(KRR.cross_kernel(A, A[:2], kernel, 2.),
+                               [[2. * np.abs(a - b).sum() for b in A[:2]] for a in A])
+
+
+@pytest.mark.parametrize('kernel', KERNELS)
+def test_predict_batch_matches_predict(kernel):
+    X, Y = training_data()
+    X_candidates, _ = training_data(6, seed=1)
+
+    batch = KRR.predict_KRR_batch(X, X_candidates, Y, 0.1, *kernel)
+    for j, x in enumerate(X_candidates):
+        np.testing.assert_allclose(batch[:, j:j + 1], KRR.predict_KRR(X, x, Y, 0.1, *kernel), rtol=1e-8, atol=1e-10)
+
+
+@pytest.mark.parametrize('kernel', KERNELS)
+def test_model_matches_the_closed_form(kernel):
+    X, Y = training_data()
+    X_candidates, _ = training_data(6, seed=1)
+    model = KRR.KRRModel(*kernel, lambd=0.1).fit(X, Y)
+
+    K = KRR.matrix_kernel(X, *kernel)
+    expected = Y.T @ np.linalg.inv(K + 0.1 * np.eye(X.shape[0])) @ KRR.cross_kernel(X, X_candidates, *kernel)
+    np.testing.assert_allclose(model.predict_batch(X_candidates), expected, rtol=1e-6, atol=1e-8)
+    np.testing.assert_allclose(model.predict(X_candidates[0]), expected[:, :1], rtol=1e-6, atol=1e-8)
+
+
+@pytest.mark.parametrize('n', [1, 63, 64, 65, 200])
+def test_triangular_solves_match_solve(n):
+    rng = np.random.default_rng(n)
+    A = rng.normal(size=(n, n))
+    L = np.linalg.cholesky(A @ A.T + n * np.eye(n))
+    B = rng.normal(size=(n, 3))
+
+    np.testing.assert_allclose(KRR._forward_substitution(L, B), np.linalg.solve(L, B), rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(KRR._back_substitution(L.T, B), np.linalg.solve(L.T, B), rtol=1e-8, atol=1e-10)
+
+
+def test_singular_kernel_matrix_gets_a_jitter():
+    X, Y = training_data()
+    # Duplicated year and no regularization
+    X, Y = np.vstack((X, X[:1])), np.vstack((Y, Y[:1]))
+
+    model = KRR.KRRModel(KRR.rbf_kernel, 5.).fit(X, Y)
+    assert model.jitter > 0
+    assert np.all(np.isfinite(model.alpha))
+
+
+def test_predict_before_fit_fails():
+    with pytest.raises(ValueError):
+        KRR.KRRModel().predict(np.ones(5))
+
+
+def test_fingerprint_depends_on_data_and_configuration():
+    X, Y = training_data()
+    model = KRR.KRRModel(KRR.rbf_kernel, 5., lambd=0.1).fit(X, Y)
+
+    assert model.fingerprint() == KRR.KRRModel(KRR.rbf_kernel, 5., lambd=0.1).fingerprint(X, Y)
+    assert model.fingerprint() != KRR.KRRModel(KRR.rbf_kernel, 2., lambd=0.1).fingerprint(X, Y)
+    assert model.fingerprint() != model.fingerprint(X, Y + 1.)
+    assert KRR.data_fingerprint(X, Y) == KRR.data_fingerprint(X.copy(), Y.copy())
+
+
+@pytest.mark.parametrize('method', ['nystrom', 'rff'])
+def test_approximate_model_converges_to_exact(method):
+    X, Y = training_data(60, seed=2)
+    X_test, _ = training_data(10, seed=3)
+    errors = [entry['relative_error'] for entry in KRR.approximation_report(
+        X, Y, KRR.rbf_kernel, 10., lambd=0.1, ranks=(5, 2000), method=method, X_test=X_test, seed=0)[1:]]
+
+    assert errors[1] < errors[0]
+    assert errors[1] < 0.05
+
+
+def test_nystrom_with_all_landmarks_is_exact():
+    X, Y = training_data(30, seed=2)
+    exact = KRR.KRRModel(KRR.polynomial_kernel, 2, lambd=1.).fit(X, Y)
+    approx = KRR.ApproxKRRModel(KRR.polynomial_kernel, 2, lambd=1., rank=30, seed=0).fit(X, Y)
+
+    np.testing.assert_allclose(approx.predict_batch(X), exact.predict_batch(X), rtol=1e-4, atol=1e-6)
+
+
+def test_random_features_need_the_rbf_kernel():
+    with pytest.raises(ValueError):
+        KRR.ApproxKRRModel(KRR.linear_kernel, method='rff')
+    with pytest.raises(ValueError):
+        KRR.ApproxKRRModel(method='svd')
@@ -0,0 +1,48 @@
+import io
+import sqlite3
+
+import numpy as np
+import pytest
+
+import points_system.file_manager as fm
+
+ARRAYS = [
+    np.arange(9, dtype=float).reshape((1, -1)),
+    np.array([1, 2, 3]),
+    np.array([True, False, True]),
+    np.array(['Loto', 'Souper é'], dtype=np.dtype('U50')),
+    np.arange(24, dtype=np.int16).reshape((2, 3, 4))[:, ::2],
+    np.array(3.5),
+    np.empty((0, 4)),
+]
+
+
+@pytest.mark.parametrize('arr', ARRAYS)
+def test_round_trip(arr):
+    decoded = fm.convert_array(bytes(fm.adapt_array(arr)))
+
+    assert decoded.dtype == arr.dtype
+    np.testing.assert_array_equal(decoded, arr)
+
+
+@pytest.mark.parametrize('arr', ARRAYS)
+def test_legacy_npy_format_is_decoded(arr):
+    out = io.BytesIO()
+    np.save(out, arr)
+
+    np.testing.assert_array_equal(fm.convert_array(out.getvalue()), arr)
+
+
+def test_object_arrays_are_refused():
+    with pytest.raises(TypeError):
+        fm.adapt_array(np.array(['Loto', None], dtype=object))
+
+
+def test_nparray_column(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'codec.db'), detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute('CREATE TABLE arrays (id INTEGER PRIMARY KEY, arr nparray)')
+    conn.executemany('INSERT INTO arrays VALUES(?, ?)', list(enumerate(ARRAYS)))
+
+    for (i, decoded), arr in zip(conn.execute('SELECT id, arr FROM arrays ORDER BY id'), ARRAYS):
+        np.testing.assert_array_equal(decoded, arr)
+    conn.close()
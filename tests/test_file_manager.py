@@ -0,0 +1,292 @@
+import io
+import itertools
+import sqlite3
+
+import numpy as np
+import pytest
+
+import points_system.file_manager as fm
+from points_system.KRR import KRRModel, rbf_kernel
+
+YEARS = (2017, 2018, 2019)
+NAMES = np.array(['Loto', 'Souper', 'Giron'])
+MANDATORY = np.array([True, False, True])
+
+
+def npy(arr):
+    """
+    Encodes an array as the versions before the schema migrations stored it (.npy format)
+    """
+    out = io.BytesIO()
+    np.save(out, arr)
+    return sqlite3.Binary(out.getvalue())
+
+
+def record(year):
+    return (np.arange(9, dtype=float) + year - YEARS[0]).reshape((1, -1))
+
+
+def size(year):
+    return 20 + year - YEARS[0]
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """
+    A db written before the normalized tables : separate, mandatory and cumulative tables only, no schema version
+    """
+    db_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE cumulative (year INTEGER PRIMARY KEY, data nparray, points nparray)')
+    conn.execute('CREATE TABLE separate (year INTEGER PRIMARY KEY, data nparray, points nparray, size INTEGER)')
+    conn.execute('CREATE TABLE mandatory (year INTEGER PRIMARY KEY, mdt nparray, names nparray)')
+    for year in YEARS:
+        conn.execute('INSERT INTO separate VALUES(?, ?, ?, ?)',
+                     (year, npy(record(year)), npy(np.array([1, 2, 3]) + year - YEARS[0]), size(year)))
+        conn.execute('INSERT INTO mandatory VALUES(?, ?, ?)', (year, npy(MANDATORY), npy(NAMES)))
+    conn.commit()
+    conn.close()
+
+    yield db_path
+
+    fm.close_all_db()
+
+
+def test_query_history_of_legacy_db(legacy_db):
+    years, names, values, sizes = fm.query_history(legacy_db)
+
+    np.testing.assert_array_equal(years, YEARS)
+    np.testing.assert_array_equal(names, NAMES)
+    np.testing.assert_array_equal(values, np.concatenate([record(year) for year in YEARS]))
+    np.testing.assert_array_equal(sizes, [size(year) for year in YEARS])
+
+
+def test_query_history_of_legacy_db_after_write(legacy_db):
+    fm.write_record(record(2020), 2020, MANDATORY, NAMES, size(2020), np.array([1, 2, 3]), legacy_db)
+
+    years, names, values, sizes = fm.query_history(legacy_db, category='present')
+
+    np.testing.assert_array_equal(years, YEARS + (2020,))
+    assert not np.isnan(values).any()
+    np.testing.assert_array_equal(values[:, 0], [record(year)[0, 0] for year in YEARS + (2020,)])
+
+    years, sizes = fm.get_society_sizes(legacy_db, first_year=2018)
+    np.testing.assert_array_equal(years, (2018, 2019, 2020))
+    np.testing.assert_array_equal(sizes, [size(year) for year in (2018, 2019, 2020)])
+
+
+def test_legacy_db_is_migrated_once(legacy_db):
+    conn, c = fm.connect_db(legacy_db)
+    c.execute('PRAGMA user_version')
+    assert c.fetchone()[0] == len(fm.MIGRATIONS)
+    c.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name='cumulative' ''')
+    assert c.fetchone() is None
+    fm.close_db(conn, c)
+
+
+
+def test_fitted_model_is_found_by_its_data(tmp_path):
+    db_path = str(tmp_path / 'models.db')
+    rng = np.random.default_rng(0)
+    X = np.concatenate((rng.integers(0, 10, (6, 3)), np.ones((6, 1))), axis=1)
+    Y = rng.uniform(0., 1., (6, 3))
+
+    model = KRRModel(rbf_kernel, 5., lambd=0.1).fit(X, Y)
+    fm.save_model(model, db_path)
+
+    loaded = fm.load_fitted_model(X, Y, db_path)
+    assert loaded.kernel_function is rbf_kernel
+    assert loaded.kernel_args == (5.,) and loaded.lambd == 0.1
+    np.testing.assert_array_equal(loaded.alpha, model.alpha)
+    assert fm.load_fitted_model(X, Y + 1., db_path) is None
+
+    fm.close_all_db()
+
+
+def test_least_recently_used_model_is_evicted(tmp_path, monkeypatch):
+    db_path = str(tmp_path / 'models.db')
+    clock = itertools.count()
+    monkeypatch.setattr(fm.time, 'time', lambda: next(clock))
+    rng = np.random.default_rng(0)
+    X = np.concatenate((rng.integers(0, 10, (6, 3)), np.ones((6, 1))), axis=1)
+    Y = rng.uniform(0., 1., (6, 3))
+
+    for sigma in (1., 2.):
+        fm.save_model(KRRModel(rbf_kernel, sigma, lambd=0.1).fit(X, Y), db_path, max_models=2)
+    # Used again, so the second model is the least recently used one
+    loaded = fm.load_model(X, Y, rbf_kernel, 1., lambd=0.1, db_path=db_path)
+    np.testing.assert_allclose(loaded.predict(X[0]), KRRModel(rbf_kernel, 1., lambd=0.1).fit(X, Y).predict(X[0]))
+    fm.save_model(KRRModel(rbf_kernel, 3., lambd=0.1).fit(X, Y), db_path, max_models=2)
+
+    assert fm.load_model(X, Y, rbf_kernel, 1., lambd=0.1, db_path=db_path) is not None
+    assert fm.load_model(X, Y, rbf_kernel, 2., lambd=0.1, db_path=db_path) is None
+    assert fm.load_model(X, Y, rbf_kernel, 1., lambd=1., db_path=db_path) is None
+
+    fm.close_all_db()
+
+
+def test_models_table_of_older_db_gets_the_data_key(legacy_db):
+    conn = sqlite3.connect(legacy_db)
+    conn.execute('''CREATE TABLE models (key TEXT PRIMARY KEY, kernel TEXT, kernel_args nparray, lambd REAL, X nparray,
+                    Y nparray, L nparray, jitter REAL, alpha nparray, last_used REAL)''')
+    conn.commit()
+    conn.close()
+
+    X = np.concatenate((np.arange(8.).reshape((4, 2)), np.ones((4, 1))), axis=1)
+    Y = np.arange(4.).reshape((4, 1))
+    fm.save_model(KRRModel(lambd=1.).fit(X, Y), legacy_db)
+    assert fm.load_fitted_model(X, Y, legacy_db).lambd == 1.
+
+
+def test_failed_migration_is_rolled_back(legacy_db, monkeypatch):
+    def failing_migration(c):
+        raise sqlite3.OperationalError('migration failed')
+
+    monkeypatch.setattr(fm, 'MIGRATIONS', fm.MIGRATIONS[:1] + (failing_migration,))
+    conn = sqlite3.connect(legacy_db)
+    with pytest.raises(sqlite3.OperationalError):
+        fm.migrate_schema(conn)
+
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+    # The cumulative table dropped by the first migration is still there
+    assert conn.execute('''SELECT name FROM sqlite_master WHERE type='table' AND name='cumulative' ''').fetchone()
+    conn.close()
+
+
+def test_records_are_aligned_on_the_activities_of_the_last_year(tmp_path):
+    db_path = str(tmp_path / 'aligned.db')
+    fm.write_record(record(2018), 2018, MANDATORY, NAMES, size(2018), np.array([1, 2, 4]), db_path)
+    # Souper removed, Concert added, the activities reordered
+    names = np.array(['Giron', 'Loto', 'Concert'])
+    fm.write_record(record(2019), 2019, np.array([True, False, False]), names, size(2019), np.array([8, 16, 32]),
+                    db_path)
+
+    conn, c = fm.connect_db(db_path)
+    years, data, sizes, points, mandatory, last_names = fm.get_aligned_records(c)
+    fm.close_db(conn, c)
+
+    np.testing.assert_array_equal(years, [2018, 2019])
+    np.testing.assert_array_equal(last_names, names)
+    np.testing.assert_array_equal(sizes, [size(2018), size(2019)])
+    # Columns Giron, Loto, Concert of each category, from the columns Loto, Souper, Giron of 2018
+    np.testing.assert_array_equal(data[0], [3, 1, np.nan, 6, 4, np.nan, 9, 7, np.nan])
+    np.testing.assert_array_equal(data[1], record(2019)[0])
+    np.testing.assert_array_equal(points, [[4, 1, np.nan], [8, 16, 32]])
+    np.testing.assert_array_equal(mandatory, [[True, True, False], [True, False, False]])
+
+    fm.close_all_db()
+
+
+MEMBERS = np.array(['Anne', 'Bruno', 'Chloé'])
+# Attendance of the members to Giron, Loto and Souper (not in the order of the record)
+SHEET = np.array(['Giron', 'Loto', 'Souper'])
+PRESENT = np.array([[True, True, False], [False, True, True], [True, False, False]])
+EXCUSED = np.array([[False, False, True], [False, False, False], [False, True, False]])
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    yield str(tmp_path / 'members.db')
+
+    fm.close_all_db()
+
+
+def test_member_points_match_activities_by_name(db_path):
+    # Points of Loto, Souper, Giron
+    fm.write_record(record(2019), 2019, MANDATORY, NAMES, size(2019), np.array([1, 2, 4]), db_path)
+    assert fm.write_member_attendance(2019, MEMBERS, SHEET, PRESENT, EXCUSED, db_path)
+
+    leaderboard = fm.get_leaderboard(2019, db_path)
+    np.testing.assert_array_equal(leaderboard.totals, [4 + 1, 1 + 2, 4])
+    assert leaderboard.rank('Anne') == 1
+
+
+def test_record_with_an_added_activity_is_written(db_path):
+    fm.write_record(record(2019), 2019, MANDATORY, NAMES, size(2019), np.array([1, 2, 4]), db_path)
+    fm.write_member_attendance(2019, MEMBERS, SHEET, PRESENT, EXCUSED, db_path)
+
+    # Corrected file of the year, with an activity the attendance of the members does not have
+    names = np.append(NAMES, 'Concert')
+    fm.write_record(np.arange(12, dtype=float).reshape((1, -1)), 2019, np.append(MANDATORY, False), names, size(2019),
+                    np.array([1, 2, 4, 8]), db_path)
+
+    np.testing.assert_array_equal(fm.get_last_mandatory_and_names_from_db(db_path)[2], names)
+    # The totals of the members can not be known anymore
+    assert fm.get_leaderboard(2019, db_path) is None
+
+
+def test_corrected_member_is_moved_in_the_leaderboard(db_path, monkeypatch):
+    members = np.array(['member ' + str(i) for i in range(20)])
+    present = np.zeros((20, 3), dtype=bool)
+    present[:, 0] = np.arange(20) % 2 == 0
+    present[:5, 1] = True
+    fm.write_record(record(2019), 2019, MANDATORY, NAMES, size(2019), np.array([1, 2, 4]), db_path)
+    fm.write_member_attendance(2019, members, SHEET, present, np.zeros_like(present), db_path)
+
+    updated = []
+    update = fm.Leaderboard.update
+    monkeypatch.setattr(fm.Leaderboard, 'update', lambda self, *args: updated.append(args[0]) or update(self, *args))
+
+    # Attendance of one member corrected
+    present[13, 2] = True
+    fm.write_member_attendance(2019, members, SHEET, present, np.zeros_like(present), db_path)
+
+    assert updated == ['member 13']
+    leaderboard = fm.get_leaderboard(2019, db_path)
+    totals = present.astype(int) @ np.array([4, 1, 2])
+    np.testing.assert_array_equal(leaderboard.totals, totals)
+    np.testing.assert_array_equal(leaderboard.order, np.argsort(-totals, kind='stable'))
+
+
+def write_year_file(path, members=True):
+    """
+    Excel file of a year with a DataApp sheet (the counts are not the ones of the members) and a Membres sheet
+    """
+    openpyxl = pytest.importorskip('openpyxl')
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.title = 'DataApp'
+    sheet.append(['Activité', 'Points', 'Présents', 'Excusés', 'Non excusés', 'Obligatoire'])
+    for name, points, mdt in zip(NAMES, (1, 2, 4), MANDATORY):
+        sheet.append([str(name), points, 9, 9, 9, 'Oui' if mdt else 'Non'])
+
+    if members:
+        sheet = wb.create_sheet('Membres')
+        sheet.append(['Membre'] + SHEET.tolist())
+        for member, present, excused in zip(MEMBERS, PRESENT, EXCUSED):
+            sheet.append([str(member)] + ['P' if p else 'E' if e else '' for p, e in zip(present, excused)])
+    wb.save(path)
+    return path
+
+
+def test_import_file_with_members(db_path, tmp_path):
+    path = write_year_file(str(tmp_path / '2019.xlsx'))
+    assert fm.import_file(path, 2019, 3, db_path)
+
+    # Counts of Loto, Souper, Giron derived from the attendance of the members
+    last_year, data, sizes, points = fm.get_last_separate(db_path)
+    np.testing.assert_array_equal(data, [[2, 1, 2, 1, 1, 0, 0, 1, 1]])
+
+    np.testing.assert_array_equal(fm.get_leaderboard(2019, db_path).totals, [4 + 1, 1 + 2, 4])
+    members, activities = fm.get_member_attendance(2019, db_path)[:2]
+    np.testing.assert_array_equal(activities, SHEET)
+
+
+def test_import_file_without_members(db_path, tmp_path):
+    path = write_year_file(str(tmp_path / '2019.xlsx'), members=False)
+    assert fm.import_file(path, 2019, 3, db_path)
+
+    np.testing.assert_array_equal(fm.get_last_separate(db_path)[1], [[9] * 9])
+    assert fm.get_leaderboard(2019, db_path) is None
+
+
+def test_import_files_with_members(db_path, tmp_path):
+    write_year_file(str(tmp_path / '2019.xlsx'))
+    write_year_file(str(tmp_path / '2018.xlsx'), members=False)
+
+    years, skipped = fm.import_files(str(tmp_path), {'2018.xlsx': (2018, 3), '2019.xlsx': (2019, 3)}, db_path,
+                                     max_workers=2)
+
+    assert years == [2018, 2019] and skipped == []
+    assert fm.get_leaderboard(2018, db_path) is None
+    np.testing.assert_array_equal(fm.get_leaderboard(2019, db_path).totals, [4 + 1, 1 + 2, 4])
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from points_system.members import (pack_attendance, unpack_bits, member_points, align_activities, aggregate_record,
+                                   derive_record, Leaderboard)
+
+MEMBERS = np.array(['Anne', 'Bruno', 'Chloé', 'David'])
+# 10 activities, so that the bitplanes take two bytes per member
+PRESENT = np.zeros((4, 10), dtype=bool)
+PRESENT[0, [0, 1, 9]] = True
+PRESENT[1, [1, 2]] = True
+PRESENT[2, 9] = True
+EXCUSED = np.zeros((4, 10), dtype=bool)
+EXCUSED[3, [0, 9]] = True
+
+
+def test_bitplanes_round_trip():
+    present_bits, excused_bits = pack_attendance(PRESENT, EXCUSED)
+
+    assert present_bits.shape == (4, 2) and present_bits.dtype == np.uint8
+    np.testing.assert_array_equal(unpack_bits(present_bits, 10), PRESENT)
+    np.testing.assert_array_equal(unpack_bits(excused_bits, 10), EXCUSED)
+
+
+def test_present_and_excused_member_is_refused():
+    with pytest.raises(ValueError):
+        pack_attendance(PRESENT, PRESENT)
+
+
+def test_member_points():
+    present_bits, _ = pack_attendance(PRESENT, EXCUSED)
+    points = np.arange(1, 11)
+
+    np.testing.assert_array_equal(member_points(present_bits, 10, points), PRESENT.astype(int) @ points)
+
+
+def test_aggregate_record():
+    record = aggregate_record(*pack_attendance(PRESENT, EXCUSED), 10)
+
+    assert record.shape == (1, 30)
+    np.testing.assert_array_equal(record[0, :10], PRESENT.sum(axis=0))
+    np.testing.assert_array_equal(record[0, 10:20], EXCUSED.sum(axis=0))
+    np.testing.assert_array_equal(record[0, 20:], 4 - PRESENT.sum(axis=0) - EXCUSED.sum(axis=0))
+
+
+def test_derive_record_matches_activities_by_name():
+    activities = np.array(['Giron', 'Loto'])
+    present_bits, excused_bits = pack_attendance([[True, False], [True, True], [False, False]],
+                                                 [[False, True], [False, False], [True, False]])
+    # Loto, Concert (not in the attendance), Giron
+    record = np.arange(9, dtype=float).reshape((1, -1))
+
+    np.testing.assert_array_equal(align_activities(activities, ['Loto', 'Concert', 'Giron']), [1, -1, 0])
+    np.testing.assert_array_equal(derive_record(record, ['Loto', 'Concert', 'Giron'], activities, present_bits,
+                                                excused_bits), [[1, 1, 2, 1, 4, 1, 1, 7, 0]])
+
+
+def test_leaderboard_queries():
+    leaderboard = Leaderboard(MEMBERS, np.array([5, 9, 5, 2]))
+
+    names, totals = leaderboard.top(2)
+    np.testing.assert_array_equal(names, ['Bruno', 'Anne'])
+    np.testing.assert_array_equal(totals, [9, 5])
+    np.testing.assert_array_equal(leaderboard.below(5)[0], ['David'])
+    assert [leaderboard.rank(name) for name in MEMBERS] == [2, 1, 2, 4]
+
+
+def test_updated_leaderboard_matches_a_new_one():
+    rng = np.random.default_rng(0)
+    members = np.array(['member ' + str(i) for i in range(50)])
+    # Few distinct totals, so that many members are tied
+    totals = rng.integers(0, 8, size=50)
+
+    leaderboard = Leaderboard(members, totals)
+    for i in rng.integers(0, 50, size=30):
+        totals[i] = rng.integers(0, 8)
+        leaderboard.update(members[i], totals[i])
+
+        expected = Leaderboard(members, totals)
+        np.testing.assert_array_equal(leaderboard.order, expected.order)
+        np.testing.assert_array_equal(leaderboard.neg_sorted_totals, expected.neg_sorted_totals)
+        np.testing.assert_array_equal(leaderboard.totals, totals)
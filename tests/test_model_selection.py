@@ -0,0 +1,42 @@
+import numpy as np
+
+import points_system.KRR as KRR
+import points_system.model_selection as ms
+from test_KRR import training_data
+
+
+def brute_force_loo(X, Y, lambd, kernel_function, *kernel_args):
+    errors = []
+    for i in range(X.shape[0]):
+        keep = np.arange(X.shape[0]) != i
+        prediction = KRR.KRRModel(kernel_function, *kernel_args, lambd=lambd).fit(X[keep], Y[keep]).predict(X[i])
+        errors.append((Y[i] - prediction[:, 0])**2)
+    return np.mean(errors)
+
+
+def test_loo_closed_form_matches_refits():
+    X, Y = training_data(10)
+    lambdas = (1e-2, 1e-1, 1., 10.)
+    for kernel_function, kernel_args in ms.kernel_grid(sigmas=(2., 10.), degrees=(2,)):
+        K = KRR.matrix_kernel(X, kernel_function, *kernel_args)
+        expected = [brute_force_loo(X, Y, lambd, kernel_function, *kernel_args) for lambd in lambdas]
+        np.testing.assert_allclose(ms.loo_errors(K, Y, lambdas), expected, rtol=1e-6)
+
+
+def test_undefined_loo_error_is_inf():
+    X, Y = training_data(5)
+    # Sharp RBF kernel and no regularization : the model interpolates the training data
+    K = KRR.matrix_kernel(X, KRR.rbf_kernel, 1e-3)
+    assert np.isinf(ms.loo_errors(K, Y, [0.])[0])
+
+
+def test_select_hyperparameters_picks_the_smallest_loo_error():
+    X, Y = training_data(10)
+    lambdas = (1e-2, 1.)
+    best = ms.select_hyperparameters(X, Y, lambdas=lambdas, sigmas=(5.,), degrees=(2,), max_workers=1)
+
+    assert len(best['results']) == 3 * len(lambdas)
+    assert best['loo_error'] == min(result[3] for result in best['results'])
+    assert np.isclose(best['loo_error'],
+                      brute_force_loo(X, Y, best['lambd'], best['kernel_function'], *best['kernel_args']))
+    assert best['kernel_function'].__name__ in ms.report({'Marsens': best})
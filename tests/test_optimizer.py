@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import points_system.KRR as KRR
+import points_system.optimizer as opt
+
+
+def linear_model(slopes, kernel=(KRR.linear_kernel,)):
+    """
+    Model fitted on years where the presence of each activity grows linearly with its points
+    """
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0., 10., (30, len(slopes)))
+    X = np.concatenate((points, np.ones((30, 1))), axis=1)
+    Y = 0.2 + points * np.asarray(slopes) / 100.
+    return KRR.KRRModel(*kernel, lambd=1e-6).fit(X, Y)
+
+
+def test_project_budget():
+    lower, upper = np.zeros(4), np.array([1., 5., 5., 5.])
+    p = opt.project_budget(np.array([3., 10., -2., 1.]), 8., lower, upper)
+
+    assert np.isclose(p.sum(), 8.)
+    assert np.all(p >= lower) and np.all(p <= upper)
+    # Already feasible points are not moved
+    np.testing.assert_allclose(opt.project_budget(np.array([1., 2., 3., 2.]), 8., lower, upper), [1., 2., 3., 2.])
+
+
+def test_round_allocation_keeps_the_budget():
+    p = np.array([1.4, 2.5, 3.1, 3.])
+    rounded = opt.round_allocation(p, 10, np.zeros(4), np.full(4, 10.))
+
+    assert rounded.sum() == 10
+    np.testing.assert_array_equal(rounded, [1, 3, 3, 3])
+
+
+def test_allocation_favours_the_most_sensitive_activities():
+    model = linear_model([1., 3., 2.])
+    p, predictions, reached = opt.optimize_allocation(model, 12, upper=[10., 5., 10.])
+
+    # The average presence grows the most with the points of the second activity, then the third one
+    np.testing.assert_array_equal(p, [0, 5, 7])
+    np.testing.assert_allclose(predictions, model.predict(np.append(p, 1.)))
+    assert reached
+
+
+def test_mandatory_activity_is_brought_to_the_target():
+    model = linear_model([1., 3., 2.])
+    mdt_list = np.array([True, False, False])
+    p, predictions, reached = opt.optimize_allocation(model, 12, mdt_list=mdt_list, target=0.25, penalty=1e4,
+                                                      integer=False)
+
+    # Without the target the first activity gets no point, the penalty only brings it close to the target
+    assert p[0] > 4.
+    assert predictions[0, 0] == pytest.approx(0.25, abs=1e-3)
+    assert p.sum() == pytest.approx(12.)
+
+
+def test_allocation_with_rbf_kernel_improves_the_uniform_one():
+    model = linear_model([1., 3., 2.], (KRR.rbf_kernel, 20.))
+    p, predictions, reached = opt.optimize_allocation(model, 12, upper=[10., 5., 10.])
+
+    uniform = model.predict(np.array([4., 4., 4., 1.]))
+    assert p.sum() == 12 and np.all(p <= [10, 5, 10])
+    assert predictions.mean() > uniform.mean()
+
+
+def test_unreachable_budget():
+    with pytest.raises(ValueError):
+        opt.optimize_allocation(linear_model([1., 3., 2.]), 40, upper=[10., 10., 10.])
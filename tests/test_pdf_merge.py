@@ -0,0 +1,41 @@
+import io
+import re
+
+import pytest
+from matplotlib.figure import Figure
+
+from points_system.pdf_merge import merge_pages, read_objects
+
+
+def page(title):
+    fig = Figure(figsize=(4, 3))
+    ax = fig.add_subplot()
+    ax.plot([1, 2, 3], [3, 1, 2], marker='.')
+    ax.set_title(title)
+    out = io.BytesIO()
+    fig.savefig(out, format='pdf', metadata={'CreationDate': None})
+    return out.getvalue()
+
+
+def test_merge_pages():
+    pages = [page('Loto'), page('Souper é'), page('Giron')]
+    merged = merge_pages(pages, {'Subject': 'Présences'})
+
+    objects, trailer = read_objects(merged)
+    tree = objects[int(re.search(rb'/Pages (\d+) 0 R', objects[1]).group(1))]
+    kids = [int(k) for k in re.findall(rb'(\d+) 0 R', tree)]
+    assert b'/Count 3' in tree and len(kids) == 3
+    assert all(b'/Type /Page' in objects[k] and b'/Parent 2 0 R' in objects[k] for k in kids)
+    # Every reference points to an object of the merged pdf
+    for body in objects.values():
+        head = body.split(b'\nstream\n')[0]
+        assert all(int(n) in objects for n in re.findall(rb'(?<![\w/.])(\d+) 0 R', head))
+    assert '<FEFF' + 'Présences'.encode('utf-16-be').hex().upper() + '>' in objects[3].decode('latin-1')
+
+    # The same pages give the same file
+    assert merge_pages(pages, {'Subject': 'Présences'}) == merged
+
+
+def test_merge_rejects_other_pdfs():
+    with pytest.raises(ValueError):
+        merge_pages([b'%PDF-1.5\n1 0 obj\n<< >>\nendobj\nstartxref\n9\n%%EOF\n'])
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+import points_system.statistics as stat
+
+NAMES = np.array(['Loto', 'Souper', 'Giron'])
+MANDATORY = np.array([True, False, True])
+LAST_YEAR = 2019
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 20, (4, 3 * len(NAMES))).astype(float)
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """
+    Counts the pages drawn
+    """
+    pages = []
+    render_page = stat.render_page
+
+    def counting_render_page(function, args):
+        pages.append(function.__name__)
+        return render_page(function, args)
+
+    monkeypatch.setattr(stat, 'render_page', counting_render_page)
+    return pages
+
+
+def create_pdf(data, path, cache_dir):
+    return stat.create_pdf(data, MANDATORY, LAST_YEAR, NAMES, 20, str(path), max_workers=1, cache_dir=str(cache_dir))
+
+
+def test_cached_report_is_not_drawn_again(data, tmp_path, rendered):
+    first = open(create_pdf(data, tmp_path, tmp_path / 'cache'), 'rb').read()
+    assert len(rendered) == len(stat.CATEGORIES) + 2
+
+    del rendered[:]
+    second = open(create_pdf(data, tmp_path, tmp_path / 'cache'), 'rb').read()
+    assert rendered == []
+    assert second == first
+
+
+def test_only_changed_pages_are_drawn_again(data, tmp_path, rendered):
+    create_pdf(data, tmp_path, tmp_path / 'cache')
+
+    # Correction of the number of excused people at one activity of the last year
+    del rendered[:]
+    data[-1, len(NAMES) + 1] += 1
+    corrected = open(create_pdf(data, tmp_path, tmp_path / 'cache'), 'rb').read()
+    assert sorted(rendered) == ['_activities_figure', '_averages_figure', '_trends_figure']
+
+    os.makedirs(tmp_path / 'uncached')
+    uncached = open(create_pdf(data, tmp_path / 'uncached', tmp_path / 'other_cache'), 'rb').read()
+    assert corrected == uncached
+
+
+def test_least_recently_used_pages_are_evicted(tmp_path):
+    stat.save_cached_pages(str(tmp_path), {'a': b'1', 'b': b'2'}, max_pages=3)
+    os.utime(tmp_path / 'a.pdf', ns=(0, 0))
+    os.utime(tmp_path / 'b.pdf', ns=(1, 1))
+    assert stat.load_cached_page(str(tmp_path), 'a') == b'1'
+
+    stat.save_cached_pages(str(tmp_path), {'c': b'3', 'd': b'4'}, max_pages=3)
+    assert sorted(os.listdir(tmp_path)) == ['a.pdf', 'c.pdf', 'd.pdf']
+    assert stat.load_cached_page(str(tmp_path), 'b') is None
@@ -0,0 +1,30 @@
+import numpy as np
+
+from points_system.summary import compute_summary, format_summary
+
+# 2 years, 3 activities (the second one did not exist the first year) : present, excused, non present
+DATA = np.array([[10., np.nan, 20., 5., np.nan, 2., 5., np.nan, 8.],
+                 [12., 6., 18., 3., 4., 4., 5., 10., 8.]])
+MANDATORY = np.array([True, False, False])
+
+
+def test_summary_matches_a_loop_over_the_activities():
+    summary = compute_summary(DATA, MANDATORY, np.array([20, 30]), years=[2018, 2019])
+
+    for y in range(2):
+        counts = DATA[y].reshape((3, 3))
+        for g, members in enumerate((MANDATORY, ~MANDATORY, np.ones(3, dtype=bool))):
+            for cat in range(3):
+                values = counts[cat, members]
+                values = values[~np.isnan(values)]
+                assert summary['total'][y, g, cat] == values.sum()
+                assert summary['count'][y, g, cat] == values.size
+                assert np.isclose(summary['rate'][y, g, cat], values.mean() / (20, 30)[y])
+
+
+def test_group_without_activity_is_nan():
+    summary = compute_summary(DATA, np.zeros(3, dtype=bool), 20)
+
+    assert np.all(np.isnan(summary['mean'][:, 0]))
+    np.testing.assert_array_equal(summary['years'], [0, 1])
+    assert 'mandatory' in format_summary(summary)
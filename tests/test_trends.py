@@ -0,0 +1,54 @@
+import numpy as np
+
+import points_system.trends as trends
+
+YEARS = np.arange(2015, 2021)
+
+
+def test_rolling_mean_ignores_missing_years():
+    rates = np.array([[1.], [np.nan], [3.], [5.], [np.nan], [np.nan]])
+    np.testing.assert_allclose(trends.rolling_mean(rates, 2)[:, 0], [1., 1., 3., 4., 5., np.nan])
+
+
+def test_slopes_match_polyfit():
+    rng = np.random.default_rng(0)
+    rates = rng.uniform(0., 1., (6, 4))
+    rates[0, 1] = np.nan
+    rates[:5, 3] = np.nan
+
+    result = trends.slopes(rates, YEARS)
+    for j in range(3):
+        valid = ~np.isnan(rates[:, j])
+        assert np.isclose(result[j], np.polyfit(YEARS[valid], rates[valid, j], 1)[0])
+    assert np.isnan(result[3])
+
+
+def test_zscores_use_the_previous_years():
+    rng = np.random.default_rng(1)
+    rates = rng.uniform(0., 1., (6, 2))
+
+    z = trends.zscores(rates, min_std=0.)
+    assert np.all(np.isnan(z[:2]))
+    for y in range(2, 6):
+        previous = rates[:y]
+        np.testing.assert_allclose(z[y], (rates[y] - previous.mean(axis=0)) / previous.std(axis=0, ddof=1))
+
+
+def test_drop_after_constant_years_is_finite():
+    rates = np.array([[0.5], [0.5], [0.5], [0.3]])
+    np.testing.assert_allclose(trends.zscores(rates)[3], (0.3 - 0.5) / trends.MIN_STD)
+
+
+def test_drop_of_the_last_year_is_an_alert():
+    # 2 activities, the first one drops the last year : present, excused, non present
+    present = np.array([[20., 10.], [21., 11.], [19., 10.], [20., 12.], [21., 11.], [8., 11.]])
+    data = np.concatenate((present, np.full((6, 2), 2.), 40. - present - 2.), axis=1)
+
+    result = trends.compute_trends(data, 40, YEARS)
+    alert_list = trends.alerts(result, ['Loto', 'Souper'])
+
+    assert [alert[0] for alert in alert_list] == ['Loto']
+    name, rate, change, z, slope = alert_list[0]
+    assert np.isclose(rate, 8. / 40.) and np.isclose(change, -13. / 40.)
+    assert 'Loto' in trends.format_alerts(alert_list)
+    assert trends.format_alerts([]) == 'Aucune baisse marquée de la présence'
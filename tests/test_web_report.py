@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+
+import points_system.web_report as web_report
+from test_summary import DATA, MANDATORY
+
+NAMES = ['Loto', 'Souper <2>', 'Giron']
+
+
+def test_payload_is_valid_json():
+    payload = web_report.report_payload(DATA, MANDATORY, 2019, NAMES, 30)
+    payload = json.loads(json.dumps(payload, allow_nan=False))
+
+    assert payload['years'] == [2018, 2019]
+    assert payload['activities'][1] == {'name': 'Souper <2>', 'mandatory': False, 'present': [None, 6.],
+                                        'excused': [None, 4.], 'absent': [None, 10.]}
+    assert np.isclose(payload['averages']['mandatory']['present']['rate'], 12. / 30.)
+
+
+def test_missing_year_interrupts_the_sparkline():
+    data = np.array([[10.], [np.nan], [20.], [30.]])
+    path = web_report.sparklines(data, 40., size=(32, 44))[0]
+
+    # x from 2 to 30, y from 42 (nobody) to 2 (the whole society)
+    assert path == 'M2.0,32.0 M20.7,22.0 L30.0,12.0'
+
+
+def test_create_html(tmp_path):
+    html_path, json_path = web_report.create_html(DATA, MANDATORY, 2019, NAMES, 30, tmp_path)
+
+    with open(html_path, encoding='utf-8') as f:
+        page = f.read()
+    assert page.count('<svg') == 3 * len(NAMES)
+    assert 'Souper &lt;2&gt;' in page
+    with open(json_path, encoding='utf-8') as f:
+        assert json.load(f)['society_size'] == 30.